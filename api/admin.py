@@ -1,7 +1,7 @@
 from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin as BaseUserAdmin
 from api.models import (User, UserSiteRole, Course, Project, 
-ProjectCategory, ProjectJoinRequest, ProjectComment, ProjectPost, ProjectTag)
+ProjectCategory, ProjectJoinRequest, ProjectComment, ProjectPost, ProjectTag, Job)
 
 # extend the User admin panel to show extra fields
 class UserAdmin(BaseUserAdmin):
@@ -33,6 +33,10 @@ class ProjectPostAdmin(admin.ModelAdmin):
 class ProjectTagAdmin(admin.ModelAdmin):
     list_display = ["name"]
 
+class JobAdmin(admin.ModelAdmin):
+    list_display = ["name", "status", "attempts", "run_at"]
+    list_filter = ["status"]
+
 # Register your models here.
 admin.site.register(User, UserAdmin)
 admin.site.register(UserSiteRole, UserSiteRoleAdmin)
@@ -43,3 +47,4 @@ admin.site.register(ProjectJoinRequest, ProjectJoinRequestAdmin)
 admin.site.register(ProjectComment, ProjectCommentAdmin)
 admin.site.register(ProjectPost, ProjectPostAdmin)
 admin.site.register(ProjectTag, ProjectTagAdmin)
+admin.site.register(Job, JobAdmin)
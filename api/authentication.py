@@ -0,0 +1,89 @@
+###########
+# imports #
+###########
+
+import threading
+import time
+
+from django.conf import settings
+from django.db.models.base import DEFERRED
+
+from rest_framework import exceptions
+from rest_framework_jwt.authentication import JSONWebTokenAuthentication
+from rest_framework_jwt.utils import jwt_payload_handler as default_payload_handler
+
+from api import models
+
+# JWTs carry the user fields that permission checks read, so authenticating
+# a request needs no query for the user row:
+#
+# - jwt_payload_handler adds them (and User.token_version) to new tokens
+# - ClaimsJSONWebTokenAuthentication builds request.user from the claims,
+#   as a User with its other fields deferred (they load on first access,
+#   and save() only writes the loaded ones)
+#
+# Tokens must still stop working when a user is deactivated, demoted or
+# changes their password (which bumps token_version). The current values
+# of those fields are fetched with one small query per user and then kept in
+# process memory for API_JWT_USER_CACHE_SECONDS, so such changes take effect
+# within that time, and a token whose claims no longer match is refused.
+# Tokens issued before the claims existed are checked against the database.
+
+CLAIMS = ["is_staff", "is_moderator", "token_version"]
+
+def jwt_payload_handler(user):
+    payload = default_payload_handler(user)
+    for name in CLAIMS:
+        payload[name] = getattr(user, name)
+    return payload
+
+class UserStateCache(object):
+    """ Recently read (is_active, claims) of users, per process """
+    max_users = 10000
+
+    def __init__(self):
+        self.states = {}  # user id -> (expires at, is_active, {claim: value})
+        self.lock = threading.Lock()
+
+    def get(self, pk):
+        now = time.monotonic()
+        with self.lock:
+            state = self.states.get(pk)
+        if state is not None and state[0] > now:
+            return state[1:]
+        row = (models.User.objects.filter(pk=pk)
+               .values_list("is_active", *CLAIMS).first())
+        if row is None:
+            return None
+        state = (now + settings.API_JWT_USER_CACHE_SECONDS, row[0], dict(zip(CLAIMS, row[1:])))
+        with self.lock:
+            if len(self.states) >= self.max_users:
+                self.states = {key: value for key, value in self.states.items()
+                               if value[0] > now}
+            self.states[pk] = state
+        return state[1:]
+
+user_states = UserStateCache()
+
+class ClaimsJSONWebTokenAuthentication(JSONWebTokenAuthentication):
+    def authenticate_credentials(self, payload):
+        if any(name not in payload for name in CLAIMS) or "user_id" not in payload:
+            return super(ClaimsJSONWebTokenAuthentication, self).authenticate_credentials(payload)
+
+        state = user_states.get(payload["user_id"])
+        if state is None:
+            raise exceptions.AuthenticationFailed("Invalid signature.")
+        is_active, claims = state
+        if not is_active:
+            raise exceptions.AuthenticationFailed("User account is disabled.")
+        if any(payload[name] != value for name, value in claims.items()):
+            raise exceptions.AuthenticationFailed("Token is out of date, obtain a new one.")
+        return self.get_user(payload)
+
+    def get_user(self, payload):
+        """ A User holding only the fields carried by the token """
+        # a new instance per request, since requests may change it
+        loaded = dict({name: payload[name] for name in CLAIMS},
+                      id=payload["user_id"], username=payload["username"], is_active=True)
+        values = [loaded.get(field.attname, DEFERRED) for field in models.User._meta.concrete_fields]
+        return models.User.from_db("default", list(loaded), values)
@@ -0,0 +1,307 @@
+###########
+# imports #
+###########
+
+import json
+import random
+import time
+import tracemalloc
+from itertools import islice
+
+from django.contrib.auth.hashers import make_password
+from django.core.management import call_command
+
+from rest_framework.test import APIClient
+
+from api import cache
+from api import models
+from api import testing
+
+# Benchmarks of the API against a large, seeded database:
+#
+# - seed() fills an empty database with users, projects, comments and so on,
+#   with relations fanned out the way real data is (a few courses per user,
+#   a handful of members per project, many comments on a few busy projects)
+# - run() requests every GET endpoint of the router through the test client
+#   and reports, per endpoint, the p50/p95 latency, the number of queries and
+#   the peak memory allocated while handling one request
+# - compare() checks results against a saved baseline
+#
+# See the seed_benchmark_data and run_benchmarks management commands.
+
+SIZES = {
+    "users": 100000,
+    "courses": 200,
+    "categories": 20,
+    "tags": 500,
+    "projects": 10000,
+    "posts": 50000,
+    "comments": 1000000,
+    "join_requests": 20000,
+}
+
+BATCH_SIZE = 5000
+
+WORDS = ("design research data art robot music app game health city water energy "
+         "library campus study team build learn open climate code film startup").split()
+
+########
+# seed #
+########
+
+def text(rng, words):
+    return " ".join(rng.choice(WORDS) for _ in range(words))
+
+def skewed(rng, values):
+    """ Picks from values, favouring the first ones, as activity tends to be """
+    if rng.random() < 0.5:
+        return rng.choice(values)
+    return values[min(int(rng.paretovariate(1.2)) - 1, len(values) - 1)]
+
+def some(rng, values, most):
+    """ Picks up to `most` distinct values """
+    return rng.sample(values, rng.randint(0, min(most, len(values))))
+
+def insert(model, objs):
+    """ Inserts an iterable of objects in batches """
+    objs = iter(objs)
+    while True:
+        batch = list(islice(objs, BATCH_SIZE))
+        if not batch:
+            break
+        model.objects.bulk_create(batch)
+
+def bulk_create(model, objs):
+    """ Inserts an iterable of objects in batches and returns their ids """
+    insert(model, objs)
+    return list(model.objects.order_by("pk").values_list("pk", flat=True))
+
+def link(model, name, pairs):
+    """ Inserts (id, related id) pairs into the many-to-many relation `name` of model """
+    through, source, target = models.m2m_through(model, name)
+    pairs = iter(pairs)
+    while True:
+        batch = list(islice(pairs, BATCH_SIZE))
+        if not batch:
+            break
+        # random picks may repeat a pair
+        through.objects.bulk_create([through(**{source: a, target: b}) for a, b in batch],
+                                    ignore_conflicts=True)
+
+def fill_feeds():
+    """
+    Adds every post, comment and join request to the feeds of its project's
+    members and leaders, as tasks.fan_out_to_feeds does for each new one
+    """
+    recipients = {}
+    for project_id, user_id in (models.ProjectMembership.objects
+                                .values_list("project_id", "user_id").iterator()):
+        recipients.setdefault(project_id, set()).add(user_id)
+    for kind, _ in models.FeedEntry.KINDS:
+        model = models.FeedEntry._meta.get_field(kind).related_model
+        sources = (model.objects.filter(project__isnull=False)
+                   .values_list("pk", "project_id", "timestamp").iterator(chunk_size=BATCH_SIZE))
+        insert(models.FeedEntry, (
+            models.FeedEntry(user_id=user_id, project_id=project_id, kind=kind,
+                             timestamp=timestamp, **{kind + "_id": pk})
+            for pk, project_id, timestamp in sources
+            for user_id in sorted(recipients.get(project_id, ()))))
+
+def seed(sizes=None, seed=0, log=print):
+    """ Fills an empty database with generated data of the given sizes """
+    sizes = dict(SIZES, **(sizes or {}))
+    rng = random.Random(seed)
+    # hashing a password per user would take far longer than the inserts
+    password = make_password("benchmark")
+
+    log("courses, categories and tags")
+    courses = bulk_create(models.Course, (
+        models.Course(code="C{}".format(index), name=text(rng, 3))
+        for index in range(sizes["courses"])))
+    categories = bulk_create(models.ProjectCategory, (
+        models.ProjectCategory(name=text(rng, 1)) for _ in range(sizes["categories"])))
+    tags = bulk_create(models.ProjectTag, (
+        models.ProjectTag(name="{}{}".format(rng.choice(WORDS), index))
+        for index in range(sizes["tags"])))
+
+    log("users")
+    users = bulk_create(models.User, (
+        models.User(username="user{}".format(index), email="user{}@example.com".format(index),
+                    first_name=rng.choice(WORDS), last_name=rng.choice(WORDS),
+                    description=text(rng, 20), password=password)
+        for index in range(sizes["users"])))
+    link(models.User, "courses", ((user, course) for user in users
+                                  for course in some(rng, courses, 4)))
+    link(models.User, "hearted_users", ((user, skewed(rng, users)) for user in users
+                                        for _ in range(rng.randint(0, 5))))
+
+    log("projects")
+    projects = bulk_create(models.Project, (
+        models.Project(name=text(rng, 3), description=text(rng, 60),
+                       category_id=rng.choice(categories))
+        for _ in range(sizes["projects"])))
+    link(models.Project, "leaders", ((project, rng.choice(users)) for project in projects
+                                     for _ in range(rng.randint(1, 3))))
+    link(models.Project, "members", ((project, rng.choice(users)) for project in projects
+                                     for _ in range(rng.randint(2, 12))))
+    # bulk inserts into the through tables send no m2m_changed signals
+    models.rebuild_memberships()
+    link(models.Project, "tags", ((project, tag) for project in projects
+                                  for tag in some(rng, tags, 5)))
+    link(models.Project, "hearted_by", ((project, rng.choice(users)) for project in projects
+                                        for _ in range(rng.randint(0, 20))))
+
+    log("posts, comments and join requests")
+    bulk_create(models.ProjectPost, (
+        models.ProjectPost(project_id=skewed(rng, projects), post=text(rng, 40),
+                           private=rng.random() < 0.2)
+        for _ in range(sizes["posts"])))
+    bulk_create(models.ProjectComment, (
+        models.ProjectComment(project_id=skewed(rng, projects), user_id=rng.choice(users),
+                              comment=text(rng, 15), anonymous=rng.random() < 0.05)
+        for _ in range(sizes["comments"])))
+    bulk_create(models.ProjectJoinRequest, (
+        models.ProjectJoinRequest(project_id=rng.choice(projects), user_id=rng.choice(users),
+                                  request=text(rng, 10))
+        for _ in range(sizes["join_requests"])))
+
+    # bulk inserts send no post_save signals to fan them out
+    log("feeds")
+    fill_feeds()
+
+    # the heart counters and cached responses are not kept up by bulk inserts
+    call_command("reconcile_hearts")
+    for model in [models.Course, models.ProjectCategory, models.ProjectTag, models.User,
+                  models.Project, models.ProjectPost, models.ProjectComment,
+                  models.ProjectJoinRequest]:
+        cache.bump_versions(model)
+
+#######
+# run #
+#######
+
+# GET actions that change data, and so are not benchmarked
+MUTATING_ACTIONS = ["heart"]
+
+def get_endpoints(router, user):
+    """
+    Returns [(name, path, public)] for the GET endpoints of a router's
+    viewsets and the join requests nested under projects, `public` for the
+    list and retrieve reads anonymous clients make too
+    """
+    endpoints = []
+    for prefix, viewset, basename in router.registry:
+        if hasattr(viewset, "list"):
+            endpoints.append(("{} list".format(prefix), "/{}/".format(prefix), True))
+            if getattr(viewset, "search_fields", None):
+                endpoints.append(("{} search".format(prefix),
+                                  "/{}/?search={}".format(prefix, WORDS[0]), True))
+            for ordering in getattr(viewset, "ordering_fields", None) or []:
+                endpoints.append(("{} ordering={}".format(prefix, ordering),
+                                  "/{}/?ordering=-{}".format(prefix, ordering), True))
+        model = viewset.queryset.model
+        # the benchmark user's own object, as some actions are theirs only
+        pk = user.pk if model is models.User else \
+            model.objects.order_by("pk").values_list("pk", flat=True).first()
+        if pk is None:
+            continue
+        if hasattr(viewset, "retrieve"):
+            endpoints.append(("{} retrieve".format(prefix), "/{}/{}/".format(prefix, pk), True))
+        for extra in viewset.get_extra_actions():
+            if extra.detail and "get" in extra.mapping and extra.__name__ not in MUTATING_ACTIONS:
+                endpoints.append(("{} {}".format(prefix, extra.__name__),
+                                  "/{}/{}/{}/".format(prefix, pk, extra.url_path), False))
+
+    # only open to the members of the project, so one of the user's
+    project_pk = (models.ProjectMembership.objects.filter(user=user)
+                  .order_by("project").values_list("project", flat=True).first())
+    if project_pk is not None:
+        path = "/projects/{}/join_requests/".format(project_pk)
+        endpoints.append(("join_requests list", path, False))
+        pk = (models.ProjectJoinRequest.objects.filter(project=project_pk)
+              .order_by("pk").values_list("pk", flat=True).first())
+        if pk is not None:
+            endpoints.append(("join_requests retrieve", "{}{}/".format(path, pk), False))
+    return endpoints
+
+def percentile(values, percent):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(percent / 100.0 * (len(values) - 1))))]
+
+def measure(client, path, iterations):
+    """ Returns the status, latency, query and memory figures of GET path """
+    response = client.get(path)  # warm up
+    timings = []
+    for _ in range(iterations):
+        started = time.perf_counter()
+        client.get(path)
+        timings.append(time.perf_counter() - started)
+    with testing.capture_queries() as queries:
+        client.get(path)
+    tracemalloc.start()
+    try:
+        client.get(path)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return {
+        "status": response.status_code,
+        "p50_ms": round(percentile(timings, 50) * 1000, 2),
+        "p95_ms": round(percentile(timings, 95) * 1000, 2),
+        "queries": len(queries),
+        "peak_kb": round(peak / 1024.0, 1),
+    }
+
+def run(router, iterations=20, only=None, log=print):
+    """
+    Benchmarks the router's endpoints as a regular user, and the public ones
+    anonymously as well, which are served from the response cache where the
+    viewset has one; returns {name: figures}
+    """
+    user = models.User.objects.filter(is_staff=False).order_by("pk").first()
+    if user is None:
+        raise ValueError("There are no users to run the benchmarks as; seed the database first.")
+    authenticated = APIClient()
+    authenticated.force_authenticate(user)
+    anonymous = APIClient()
+    results = {}
+    for name, path, public in get_endpoints(router, user):
+        runs = [(name, authenticated)]
+        if public:
+            runs.append(("{} (anonymous)".format(name), anonymous))
+        for name, client in runs:
+            if only and only not in name:
+                continue
+            results[name] = measure(client, path, iterations)
+            log(name, path, results[name])
+    return results
+
+def compare(results, baseline, threshold):
+    """
+    Returns the regressions of results against a baseline: any increase in
+    queries, or latency or memory growing beyond `threshold` times the baseline.
+    """
+    regressions = []
+    for name, result in sorted(results.items()):
+        expected = baseline.get(name)
+        if expected is None:
+            continue
+        if result["status"] != expected["status"]:
+            regressions.append("{}: status {} (baseline {})".format(
+                name, result["status"], expected["status"]))
+        if result["queries"] > expected["queries"]:
+            regressions.append("{}: {} queries (baseline {})".format(
+                name, result["queries"], expected["queries"]))
+        for key in ["p95_ms", "peak_kb"]:
+            if result[key] > expected[key] * threshold:
+                regressions.append("{}: {} {} (baseline {})".format(
+                    name, key, result[key], expected[key]))
+    return regressions
+
+def load(path):
+    with open(path) as file:
+        return json.load(file)
+
+def save(results, path):
+    with open(path, "w") as file:
+        json.dump(results, file, indent=2, sort_keys=True)
@@ -0,0 +1,171 @@
+###########
+# imports #
+###########
+
+from django.db import connections, router, transaction
+from django.db.models import prefetch_related_objects
+from django.utils import timezone
+
+from rest_framework import status
+from rest_framework.decorators import action
+from rest_framework.exceptions import ValidationError
+from rest_framework.response import Response
+
+from api import cache
+from api import models
+
+#################
+# bulk requests #
+#################
+
+# POST, PATCH or DELETE an array to the /bulk/ endpoint of a viewset to
+# create, update or delete many objects in one request and one transaction:
+#
+# - POST [{...}, ...] creates the objects with a single bulk_create
+# - PATCH [{"id": 1, ...}, ...] partially updates them with a single bulk_update
+# - DELETE [1, 2, ...] deletes the objects with these ids
+#
+# Every item is validated before anything is written. If any item fails, the
+# response is a 400 with one entry per item, in request order: {} for items
+# that were fine and the usual error object for the others.
+
+MAX_ITEMS = 1000
+
+def get_items(request, max_items=MAX_ITEMS):
+    """ Returns the list sent as the request body, or raises a ValidationError """
+    items = request.data
+    if not isinstance(items, list):
+        raise ValidationError({"non_field_errors": ["Expected a list of items."]})
+    if len(items) > max_items:
+        raise ValidationError({"non_field_errors": [
+            "At most {} items can be sent at once.".format(max_items)]})
+    return items
+
+def lookup_errors(ids, found):
+    """ Returns the per-item errors of a list of ids, given the set of ids found """
+    return [{} if pk in found else {"id": ["Not found."]} for pk in ids]
+
+def valid_ids(ids):
+    return [pk for pk in ids if isinstance(pk, int) and not isinstance(pk, bool)]
+
+class BulkModelMixin(object):
+    bulk_max_items = MAX_ITEMS
+
+    @action(detail=False, methods=["post", "patch", "delete"])
+    def bulk(self, request):
+        items = get_items(request, self.bulk_max_items)
+        handler = {"POST": self.bulk_create, "PATCH": self.bulk_update,
+                   "DELETE": self.bulk_destroy}[request.method]
+        with transaction.atomic():
+            response = handler(items)
+        # bulk writes send no save or delete signals
+        cache.bump_versions(self.get_queryset().model)
+        return response
+
+    def bulk_errors(self, errors):
+        if any(errors):
+            raise ValidationError(errors)
+
+    def bulk_response(self, objs, status_code=status.HTTP_200_OK):
+        # one query per rendered relation, whatever the number of objects
+        serializer = self.get_serializer(objs, many=True)
+        prefetch_related_objects(objs, *serializer.child.get_prefetch_lookups())
+        return Response(serializer.data, status=status_code)
+
+    def bulk_create(self, items):
+        serializer = self.get_serializer(data=items, many=True)
+        if not serializer.is_valid():
+            raise ValidationError(serializer.errors)
+        model = self.get_queryset().model
+        objs, relations = [], []
+        for attrs in serializer.validated_data:
+            many = {name: attrs.pop(name) for name in list(attrs)
+                    if model._meta.get_field(name).many_to_many}
+            objs.append(model(**attrs))
+            relations.append(many)
+        db = router.db_for_write(model)
+        if connections[db].features.can_return_ids_from_bulk_insert:
+            model.objects.bulk_create(objs)
+        else:
+            # without the ids the created objects could not be returned
+            for obj in objs:
+                obj.save(force_insert=True)
+        self.bulk_create_relations(model, objs, relations)
+        return self.bulk_response(objs, status_code=status.HTTP_201_CREATED)
+
+    def bulk_create_relations(self, model, objs, relations):
+        """ Inserts the many-to-many links of new objects, one insert per relation """
+        rows = {}
+        for obj, many in zip(objs, relations):
+            for name, related in many.items():
+                through, source, target = models.m2m_through(model, name)
+                rows.setdefault((through, model._meta.get_field(name).related_model), []).extend(
+                    through(**{source: obj.pk, target: other.pk}) for other in related)
+        for (through, related_model), links in rows.items():
+            through.objects.bulk_create(links)
+            cache.bump_versions(related_model)
+
+    def get_bulk_objects(self, ids):
+        """ Returns {id: object} for the ids and a per-item list of lookup errors """
+        objs = self.get_queryset().in_bulk(valid_ids(ids))
+        return objs, lookup_errors(ids, objs)
+
+    def bulk_update(self, items):
+        objs, errors = self.get_bulk_objects(
+            [item.get("id") if isinstance(item, dict) else None for item in items])
+        serializers = []
+        for index, item in enumerate(items):
+            if errors[index]:
+                continue
+            serializer = self.get_serializer(objs[item["id"]], data=item, partial=True)
+            if serializer.is_valid():
+                serializers.append(serializer)
+            else:
+                errors[index] = serializer.errors
+        self.bulk_errors(errors)
+
+        # bulk_update skips pre_save, so auto_now fields are set here
+        model = self.get_queryset().model
+        auto_now = [field.name for field in model._meta.concrete_fields
+                    if getattr(field, "auto_now", False)]
+        fields = set(auto_now)
+        now = timezone.now()
+        updated, relations = [], []
+        for serializer in serializers:
+            obj = serializer.instance
+            self.check_object_permissions(self.request, obj)
+            many = {}
+            for name, value in serializer.validated_data.items():
+                if model._meta.get_field(name).many_to_many:
+                    many[name] = value
+                else:
+                    setattr(obj, name, value)
+                    fields.add(name)
+            for name in auto_now:
+                setattr(obj, name, now)
+            updated.append(obj)
+            relations.append(many)
+        if updated:
+            model.objects.bulk_update(updated, sorted(fields))
+        self.bulk_update_relations(model, updated, relations)
+        return self.bulk_response(updated)
+
+    def bulk_update_relations(self, model, objs, relations):
+        """ Replaces the many-to-many links sent for existing objects, one delete and one insert per relation """
+        replaced = {}
+        for obj, many in zip(objs, relations):
+            for name in many:
+                replaced.setdefault(name, []).append(obj.pk)
+        for name, pks in replaced.items():
+            through, source, _ = models.m2m_through(model, name)
+            through.objects.filter(**{source + "__in": pks}).delete()
+            cache.bump_versions(model._meta.get_field(name).related_model)
+        self.bulk_create_relations(model, objs, relations)
+
+    def bulk_destroy(self, items):
+        objs, errors = self.get_bulk_objects(items)
+        self.bulk_errors(errors)
+        for obj in objs.values():
+            self.check_object_permissions(self.request, obj)
+        self.get_queryset().model.objects.filter(pk__in=list(objs)).delete()
+        return Response(status=status.HTTP_204_NO_CONTENT)
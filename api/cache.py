@@ -0,0 +1,155 @@
+###########
+# imports #
+###########
+
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.db.models import F, Value
+from django.db.models.functions import Greatest
+
+from rest_framework.response import Response
+
+from api.models import ModelVersion
+
+##################
+# model versions #
+##################
+
+# Every cached response is keyed on the current version of each model it was
+# built from. Writes bump the version (see signals.py), so invalidation never
+# has to find and delete the stale entries; they are just never read again.
+#
+# The versions are kept in the ModelVersion table, and with
+# API_CACHE_VERSIONS in the cache backend as well, so reads only fall back to
+# the table when the cache has lost them. Both have to be seen by every
+# process: a write handled by one worker must invalidate the responses cached
+# by all of them, so only a cache shared by the workers (or a single worker)
+# may hold versions. They are bumped once the writing transaction commits, so
+# a response built from data read before the commit is never stored under the
+# new version.
+
+def get_cache():
+    return caches[settings.API_CACHE_ALIAS]
+
+# the least a version moves by
+VERSION_STEP = 0.000001
+
+def version_label(model):
+    return model._meta.label_lower
+
+def version_key(label):
+    return "api:version:{}".format(label)
+
+def bump_versions(*models):
+    """ Moves the versions of models on once the current transaction commits """
+    labels = sorted(set(version_label(model) for model in models))
+    if labels:
+        transaction.on_commit(lambda: write_versions(labels), using="default")
+
+def write_versions(labels):
+    now = time.time()
+    versions = ModelVersion.objects.using("default")
+    # never backwards, whatever the clocks of the processes writing
+    updated = versions.filter(model__in=labels).update(
+        version=Greatest(F("version") + VERSION_STEP, Value(now)))
+    if updated < len(labels):
+        versions.bulk_create([ModelVersion(model=label, version=now) for label in labels],
+                             ignore_conflicts=True)
+    if settings.API_CACHE_VERSIONS:
+        backend = get_cache()
+        for label, version in versions.filter(model__in=labels).values_list("model", "version"):
+            # a concurrent bump may have stored a later version already
+            cached = backend.get(version_key(label))
+            if cached is None or cached < version:
+                backend.set(version_key(label), version, None)
+
+def read_versions(labels):
+    """ Reads versions from the database, starting any that are missing """
+    # always the primary: a lagging replica would hand out old versions
+    versions = ModelVersion.objects.using("default")
+    stored = dict(versions.filter(model__in=labels).values_list("model", "version"))
+    missing = [label for label in labels if label not in stored]
+    if missing:
+        versions.bulk_create([ModelVersion(model=label, version=time.time())
+                              for label in missing], ignore_conflicts=True)
+        stored.update(versions.filter(model__in=missing).values_list("model", "version"))
+    return stored
+
+def get_versions(models):
+    """ Returns the current version of each model """
+    labels = [version_label(model) for model in models]
+    if not labels:
+        return []
+    if not settings.API_CACHE_VERSIONS:
+        stored = read_versions(labels)
+        return [stored[label] for label in labels]
+
+    backend = get_cache()
+    cached = backend.get_many([version_key(label) for label in labels])
+    stored = {label: cached[version_key(label)] for label in labels
+              if version_key(label) in cached}
+    missing = [label for label in labels if label not in stored]
+    if missing:
+        for label, version in read_versions(missing).items():
+            # add, not set: a bump that committed after the read has stored
+            # its later version, and must not be overwritten
+            if not backend.add(version_key(label), version, None):
+                version = backend.get(version_key(label), version)
+            stored[label] = version
+    return [stored[label] for label in labels]
+
+def get_request_versions(request, models):
+    """ get_versions, read once per request however many mixins ask """
+    read = getattr(request, "_api_versions", None)
+    if read is None:
+        read = request._api_versions = {}
+    key = tuple(models)
+    if key not in read:
+        read[key] = get_versions(models)
+    return read[key]
+
+##################
+# response cache #
+##################
+
+def response_key(request, models):
+    authenticator = getattr(request, "successful_authenticator", None)
+    parts = [
+        request.path,
+        "&".join(sorted(request.GET.urlencode().split("&"))),
+        type(authenticator).__name__ if authenticator else "anonymous",
+    ] + [repr(version) for version in get_request_versions(request, models)]
+    digest = hashlib.md5("|".join(parts).encode("utf-8")).hexdigest()
+    return "api:response:{}".format(digest)
+
+class CachedResponseMixin(object):
+    """
+    Serves list and retrieve responses to anonymous requests from the cache,
+    keyed on the path, query string, authentication class and the versions
+    of `cache_dependencies` (every model the serialized data is read from).
+    """
+    cache_dependencies = ()
+
+    def list(self, request, *args, **kwargs):
+        return self.cached_response(
+            super(CachedResponseMixin, self).list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.cached_response(
+            super(CachedResponseMixin, self).retrieve, request, *args, **kwargs)
+
+    def cached_response(self, handler, request, *args, **kwargs):
+        if not settings.API_CACHE_ENABLED or request.user.is_authenticated:
+            return handler(request, *args, **kwargs)
+        key = response_key(request, self.cache_dependencies)
+        data = get_cache().get(key)
+        if data is not None:
+            return Response(data)
+        response = handler(request, *args, **kwargs)
+        if response.status_code == 200:
+            get_cache().set(key, response.data, settings.API_CACHE_TIMEOUT)
+        return response
@@ -0,0 +1,121 @@
+###########
+# imports #
+###########
+
+import hashlib
+import time
+
+from django.db.models import prefetch_related_objects
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.utils.http import http_date
+
+from rest_framework.generics import get_object_or_404
+from rest_framework.permissions import BasePermission
+
+from api import cache
+
+###################
+# conditional GET #
+###################
+
+class ConditionalGetMixin(object):
+    """
+    Adds ETag and Last-Modified validators to list and retrieve responses and
+    answers matching If-None-Match / If-Modified-Since requests with
+    304 Not Modified before any serializer runs.
+
+    The validators are built from the write versions of `cache_dependencies`
+    (see cache.py), which move on every write to the requested object as well
+    as on a write to a related row or an M2M link, so the decision needs no
+    query of its own. A retrieve guarded by object permissions is answered
+    only after the object has been found and passed them, as it would be
+    without the headers.
+    """
+    cache_dependencies = ()
+
+    _conditional_object = None
+
+    def list(self, request, *args, **kwargs):
+        return self.conditional_response(
+            super(ConditionalGetMixin, self).list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.conditional_response(
+            super(ConditionalGetMixin, self).retrieve, request, *args, **kwargs)
+
+    def get_object(self):
+        # the object conditional_response already fetched and checked, with
+        # its prefetches only run once a response is built (and not served
+        # from the response cache)
+        if self._conditional_object is not None:
+            obj, lookups = self._conditional_object
+            self._conditional_object = None
+            prefetch_related_objects([obj], *lookups)
+            return obj
+        return super(ConditionalGetMixin, self).get_object()
+
+    def get_conditional_object(self):
+        """
+        Returns the requested object, permission checked but without its
+        prefetches, and the prefetch lookups left to run for a full response
+        """
+        queryset = self.filter_queryset(self.get_queryset())
+        lookups = queryset._prefetch_related_lookups
+        lookup_url_kwarg = self.lookup_url_kwarg or self.lookup_field
+        obj = get_object_or_404(queryset.prefetch_related(None),
+                                **{self.lookup_field: self.kwargs[lookup_url_kwarg]})
+        self.check_object_permissions(self.request, obj)
+        return obj, lookups
+
+    def needs_object(self, request):
+        """ Whether this retrieve has to find the object before answering 304 """
+        if any(type(permission).has_object_permission is not BasePermission.has_object_permission
+               for permission in self.get_permissions()):
+            return True
+        # an ETag given out for the object stops matching once it is deleted,
+        # but "*" and a date say nothing of whether it exists
+        etags = request.META.get("HTTP_IF_NONE_MATCH")
+        if etags is None:
+            return "HTTP_IF_MODIFIED_SINCE" in request.META
+        return etags.strip() == "*"
+
+    def get_write_times(self):
+        """ The times of the last writes that can affect this response """
+        return list(cache.get_request_versions(self.request, self.cache_dependencies))
+
+    def conditional_response(self, handler, request, *args, **kwargs):
+        times = self.get_write_times()
+        if not times:
+            return handler(request, *args, **kwargs)
+        obj = lookups = None
+        if self.action == "retrieve" and self.needs_object(request):
+            obj, lookups = self.get_conditional_object()
+
+        # responses differ per user (e.g. private posts), so the user is part of the tag
+        parts = [
+            request.path,
+            "&".join(sorted(request.GET.urlencode().split("&"))),
+            str(request.user.pk) if request.user.is_authenticated else "anonymous",
+        ] + [repr(written) for written in times]
+        etag = '"{}"'.format(hashlib.md5("|".join(parts).encode("utf-8")).hexdigest())
+        # HTTP dates have whole seconds, and a write later in the same second
+        # would not move them, so Last-Modified is only given (and
+        # If-Modified-Since only honoured) once that second is over
+        last_modified = int(max(times))
+        if last_modified >= int(time.time()):
+            last_modified = None
+
+        not_modified = get_conditional_response(
+            request._request, etag=etag, last_modified=last_modified)
+        if not_modified is not None:
+            return not_modified
+
+        if obj is not None:
+            self._conditional_object = (obj, lookups)
+        response = handler(request, *args, **kwargs)
+        if response.status_code == 200:
+            response["ETag"] = etag
+            if last_modified is not None:
+                response["Last-Modified"] = http_date(last_modified)
+            patch_vary_headers(response, ("Authorization", "Cookie"))
+        return response
@@ -0,0 +1,24 @@
+from django.db.backends.postgresql import base
+
+from api.db import pool
+from api.db.backends.postgresql.creation import DatabaseCreation
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    """
+    The PostgreSQL backend, except that connections are checked out of and
+    returned to a per-process pool (see api/db/pool.py) rather than opened
+    and closed. Configured by the POOL entry of the DATABASES alias.
+    """
+    creation_class = DatabaseCreation
+
+    def get_pool(self):
+        return pool.get_pool(self.alias, self.settings_dict, self.get_connection_params())
+
+    def get_new_connection(self, conn_params):
+        connect = super(DatabaseWrapper, self).get_new_connection
+        return self.get_pool().acquire(lambda: connect(conn_params))
+
+    def _close(self):
+        if self.connection is not None:
+            with self.wrap_database_errors:
+                self.get_pool().release(self.connection)
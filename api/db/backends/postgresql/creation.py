@@ -0,0 +1,9 @@
+from django.db.backends.postgresql import creation
+
+from api.db import pool
+
+class DatabaseCreation(creation.DatabaseCreation):
+    def _destroy_test_db(self, test_database_name, verbosity):
+        # pooled connections would keep the test database in use
+        pool.close_idle(database=test_database_name)
+        super(DatabaseCreation, self)._destroy_test_db(test_database_name, verbosity)
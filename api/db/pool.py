@@ -0,0 +1,237 @@
+###########
+# imports #
+###########
+
+import os
+import threading
+import time
+
+from psycopg2 import OperationalError
+from psycopg2.extensions import (TRANSACTION_STATUS_IDLE, TRANSACTION_STATUS_INERROR,
+                                  TRANSACTION_STATUS_INTRANS)
+
+# A per-process pool of PostgreSQL connections, used by the
+# api.db.backends.postgresql database backend. Django opens a connection per
+# thread and closes it at the end of each request; with the pool, "opening"
+# checks an idle connection out and "closing" returns it, so requests skip
+# the connection handshake and a process never holds more than MAX_SIZE
+# connections, however many threads serve requests.
+#
+# Options (the POOL entry of a DATABASES alias):
+#
+# - MAX_SIZE: connections this process may open
+# - MAX_LIFETIME: seconds after which a connection is closed rather than reused
+# - WAIT_TIMEOUT: seconds to wait for a free connection before failing
+# - PRE_PING: check a connection with a round trip before handing it out
+
+DEFAULTS = {
+    "MAX_SIZE": 10,
+    "MAX_LIFETIME": 30 * 60,
+    "WAIT_TIMEOUT": 10,
+    "PRE_PING": True,
+}
+
+class PoolTimeout(OperationalError):
+    pass
+
+class PooledConnection(object):
+    """ A connection and when it was opened """
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.created_at = time.monotonic()
+
+class ConnectionPool(object):
+    def __init__(self, database, max_size, max_lifetime, wait_timeout, pre_ping):
+        self.database = database
+        self.max_size = max_size
+        self.max_lifetime = max_lifetime
+        self.wait_timeout = wait_timeout
+        self.pre_ping = pre_ping
+        self.idle = []  # most recently returned last
+        self.in_use = {}  # id(connection) -> PooledConnection
+        self.pending = 0  # checked out, but still being opened or pinged
+        self.condition = threading.Condition()
+        self.counters = dict.fromkeys(["checkouts", "opened", "closed", "ping_failures",
+                                       "timeouts"], 0)
+        self.waiting = 0
+        self.wait_seconds = 0.0
+
+    @property
+    def size(self):
+        return len(self.idle) + len(self.in_use) + self.pending
+
+    def acquire(self, connect):
+        """
+        Returns an idle connection, or one opened with `connect` while the
+        pool has room, waiting up to WAIT_TIMEOUT seconds for either.
+        """
+        started = time.monotonic()
+        deadline = started + self.wait_timeout
+        while True:
+            with self.condition:
+                pooled = self.take_idle()
+                while pooled is None and self.size >= self.max_size:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self.counters["timeouts"] += 1
+                        raise PoolTimeout(
+                            "No database connection became available within {} seconds "
+                            "({} in use)".format(self.wait_timeout, len(self.in_use)))
+                    self.waiting += 1
+                    self.condition.wait(remaining)
+                    self.waiting -= 1
+                    pooled = self.take_idle()
+                self.pending += 1
+            if pooled is None:
+                pooled = self.open(connect)
+            elif self.pre_ping and not self.ping(pooled):
+                continue
+            with self.condition:
+                self.pending -= 1
+                self.in_use[id(pooled.connection)] = pooled
+                self.counters["checkouts"] += 1
+                self.wait_seconds += time.monotonic() - started
+            return pooled.connection
+
+    def take_idle(self):
+        """ Pops the freshest idle connection, closing any past their lifetime """
+        while self.idle:
+            pooled = self.idle.pop()
+            if time.monotonic() - pooled.created_at < self.max_lifetime:
+                return pooled
+            self.discard(pooled)
+        return None
+
+    def open(self, connect):
+        """ Opens a connection for a slot counted in self.pending """
+        try:
+            pooled = PooledConnection(connect())
+        except Exception:
+            with self.condition:
+                self.pending -= 1
+                self.condition.notify()
+            raise
+        with self.condition:
+            self.counters["opened"] += 1
+        return pooled
+
+    def ping(self, pooled):
+        try:
+            with pooled.connection.cursor() as cursor:
+                cursor.execute("SELECT 1")
+            return True
+        except Exception:
+            with self.condition:
+                self.counters["ping_failures"] += 1
+                self.pending -= 1
+                self.discard(pooled)
+                self.condition.notify()
+            return False
+
+    def release(self, connection):
+        """ Returns a connection, closing it if it cannot be reused """
+        with self.condition:
+            pooled = self.in_use.pop(id(connection), None)
+        if pooled is None:
+            # checked out by the parent of a fork, whose session closing it
+            # here would end; the parent closes it
+            return
+        reusable = not connection.closed and self.reset(connection)
+        with self.condition:
+            if reusable and time.monotonic() - pooled.created_at < self.max_lifetime:
+                self.idle.append(pooled)
+            else:
+                self.discard(pooled)
+            self.condition.notify()
+
+    def reset(self, connection):
+        """
+        Rolls back a returned connection's open transaction and turns
+        autocommit back on, returning whether it can be reused
+        """
+        try:
+            status = connection.get_transaction_status()
+            if status in (TRANSACTION_STATUS_INTRANS, TRANSACTION_STATUS_INERROR):
+                connection.rollback()
+            elif status != TRANSACTION_STATUS_IDLE:
+                # mid-query, or its state is unknown
+                return False
+            if not connection.autocommit:
+                connection.autocommit = True
+            return True
+        except Exception:
+            return False
+
+    def discard(self, pooled):
+        """ Closes a connection that is no longer counted by the pool """
+        self.counters["closed"] += 1
+        try:
+            pooled.connection.close()
+        except Exception:
+            pass
+
+    def close_idle(self):
+        with self.condition:
+            while self.idle:
+                self.discard(self.idle.pop())
+            self.condition.notify_all()
+
+    def stats(self):
+        with self.condition:
+            stats = dict(self.counters)
+            stats.update({
+                "database": self.database,
+                "max_size": self.max_size,
+                "size": self.size,
+                "idle": len(self.idle),
+                "in_use": len(self.in_use),
+                "waiting": self.waiting,
+                "average_wait_ms": (1000 * self.wait_seconds / self.counters["checkouts"]
+                                    if self.counters["checkouts"] else 0.0),
+            })
+        return stats
+
+#########
+# pools #
+#########
+
+_pools = {}
+_pools_lock = threading.Lock()
+_pools_pid = os.getpid()
+
+def get_pool(alias, settings_dict, conn_params):
+    """ Returns this process's pool for a connection alias and its parameters """
+    global _pools, _pools_pid
+    key = (alias, tuple(sorted((name, str(value)) for name, value in conn_params.items())))
+    with _pools_lock:
+        if _pools_pid != os.getpid():
+            # connections must not be shared with the parent of a fork
+            _pools, _pools_pid = {}, os.getpid()
+        if key not in _pools:
+            options = dict(DEFAULTS, **settings_dict.get("POOL", {}))
+            _pools[key] = ConnectionPool(
+                database=conn_params.get("database"),
+                max_size=options["MAX_SIZE"],
+                max_lifetime=options["MAX_LIFETIME"],
+                wait_timeout=options["WAIT_TIMEOUT"],
+                pre_ping=options["PRE_PING"],
+            )
+        return _pools[key]
+
+def get_stats():
+    """ Returns {alias: [pool stats]} for the pools of this process """
+    with _pools_lock:
+        pools = list(_pools.items())
+    stats = {}
+    for (alias, _), pool in pools:
+        stats.setdefault(alias, []).append(pool.stats())
+    return stats
+
+def close_idle(database=None):
+    """ Closes the idle connections of every pool, or of those for `database` """
+    with _pools_lock:
+        pools = list(_pools.values())
+    for pool in pools:
+        if database is None or pool.database == database:
+            pool.close_idle()
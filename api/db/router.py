@@ -0,0 +1,83 @@
+###########
+# imports #
+###########
+
+import random
+import threading
+import time
+
+from django.conf import settings
+
+from api import cache
+from api import permissions
+
+# Reads of list and retrieve actions go to a read replica (an alias listed in
+# settings.DATABASE_REPLICAS), everything else to the primary "default"
+# database. Replicas lag the primary, so a request stays on the primary for
+# API_REPLICA_STICKY_SECONDS after
+#
+# - a write by the same user, so users read their own writes, and
+# - any write to a model the view is built from (see cache.py), so the
+#   versions keying cached responses and ETags never describe data newer
+#   than what was read. The versions are the ones the request reads for
+#   those anyway, so this costs no extra query.
+#
+# Both are kept in the cache, which every process has to share (settings
+# refuse replicas without one), or a write handled by one process would not
+# keep the next request, handled by another, off the replicas.
+
+_state = threading.local()
+
+def get_replica():
+    """ The replica the current thread reads from, or None for the primary """
+    return getattr(_state, "replica", None)
+
+def pin_key(user):
+    return "api:primary:{}".format(user.pk)
+
+class ReplicaRouter(object):
+    def db_for_read(self, model, **hints):
+        return get_replica()
+
+    def db_for_write(self, model, **hints):
+        _state.wrote = True
+        return "default"
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # replicas hold the same rows as the primary
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # replicas receive the schema through replication
+        if db in settings.DATABASE_REPLICAS:
+            return False
+        return None
+
+class ReplicaReadMixin(object):
+    """ Runs the read actions of a viewset against a read replica """
+    replica_actions = permissions.READ_ACTIONS
+    cache_dependencies = ()
+
+    def initial(self, request, *args, **kwargs):
+        super(ReplicaReadMixin, self).initial(request, *args, **kwargs)
+        if self.action in self.replica_actions and settings.DATABASE_REPLICAS \
+                and not self.needs_primary(request):
+            _state.replica = random.choice(settings.DATABASE_REPLICAS)
+
+    def needs_primary(self, request):
+        since = time.time() - settings.API_REPLICA_STICKY_SECONDS
+        versions = cache.get_request_versions(request, self.cache_dependencies)
+        if versions and max(versions) > since:
+            return True
+        return request.user.is_authenticated and cache.get_cache().get(pin_key(request.user)) is not None
+
+    def dispatch(self, request, *args, **kwargs):
+        _state.replica, _state.wrote = None, False
+        try:
+            return super(ReplicaReadMixin, self).dispatch(request, *args, **kwargs)
+        finally:
+            # DRF hands the authenticated user down to the Django request
+            if _state.wrote and request.user.is_authenticated:
+                cache.get_cache().set(pin_key(request.user), True,
+                                      settings.API_REPLICA_STICKY_SECONDS)
+            _state.replica, _state.wrote = None, False
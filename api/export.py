@@ -0,0 +1,113 @@
+###########
+# imports #
+###########
+
+import csv
+import json
+import random
+from itertools import islice
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+
+from api import models
+
+##########
+# export #
+##########
+
+# Staff export whole tables from /export/<resource>.csv or .ndjson. Rows are
+# read through a server-side cursor and written to a streaming response one
+# chunk at a time, so memory use does not grow with the size of the table:
+#
+# - every concrete column is exported, foreign keys as their id (user_id, ...)
+# - many-to-many relations are exported as lists of ids, fetched with one
+#   query per relation and chunk; in CSV the ids are separated by spaces
+
+CHUNK_SIZE = 2000
+
+EXPORTS = {
+    # resource: (model, excluded columns, many-to-many relations)
+    "users": (models.User, ["password"],
+              ["courses", "site_roles", "member_projects", "leader_projects"]),
+    "projects": (models.Project, ["search_vector"],
+                 ["members", "leaders", "tags", "hearted_by"]),
+    "comments": (models.ProjectComment, ["search_vector"], []),
+}
+
+FORMATS = {
+    "csv": "text/csv; charset=utf-8",
+    "ndjson": "application/x-ndjson",
+}
+
+def get_database():
+    """ Exports read a replica when there is one; a little lag does not matter """
+    if settings.DATABASE_REPLICAS:
+        return random.choice(settings.DATABASE_REPLICAS)
+    return "default"
+
+def get_columns(model, exclude):
+    return [field.attname for field in model._meta.concrete_fields if field.name not in exclude]
+
+def get_relation_ids(model, name, pks, using):
+    """ Returns {pk: [related ids]} for the many-to-many relation `name` """
+    through, source, target = models.m2m_through(model, name)
+    ids = {pk: [] for pk in pks}
+    rows = (through.objects.using(using).filter(**{source + "__in": pks})
+            .order_by(source, target).values_list(source, target))
+    for pk, related in rows:
+        ids[pk].append(related)
+    return ids
+
+def iter_chunks(resource, chunk_size=CHUNK_SIZE, using=None):
+    """ Yields the rows of an export, as lists of dicts of up to chunk_size rows """
+    model, exclude, relations = EXPORTS[resource]
+    using = using or get_database()
+    columns = get_columns(model, exclude)
+    rows = (model.objects.using(using).order_by("pk").values_list(*columns)
+            .iterator(chunk_size=chunk_size))
+    while True:
+        chunk = [dict(zip(columns, row)) for row in islice(rows, chunk_size)]
+        if not chunk:
+            return
+        pks = [row["id"] for row in chunk]
+        for name in relations:
+            ids = get_relation_ids(model, name, pks, using)
+            for row in chunk:
+                row[name] = ids[row["id"]]
+        yield chunk
+
+def get_header(resource):
+    model, exclude, relations = EXPORTS[resource]
+    return get_columns(model, exclude) + relations
+
+class Echo(object):
+    """ A file-like object handing back what the csv writer writes """
+
+    def write(self, value):
+        return value
+
+def csv_value(value):
+    if value is None:
+        return ""
+    if isinstance(value, list):
+        return " ".join(str(item) for item in value)
+    if hasattr(value, "isoformat"):
+        return value.isoformat()
+    return value
+
+def iter_csv(resource, **kwargs):
+    header = get_header(resource)
+    writer = csv.writer(Echo())
+    yield writer.writerow(header)
+    for chunk in iter_chunks(resource, **kwargs):
+        yield "".join(writer.writerow([csv_value(row[name]) for name in header])
+                      for row in chunk)
+
+def iter_ndjson(resource, **kwargs):
+    for chunk in iter_chunks(resource, **kwargs):
+        yield "".join(json.dumps(row, cls=DjangoJSONEncoder) + "\n" for row in chunk)
+
+def iter_export(resource, file_format, **kwargs):
+    """ Yields the text of an export, a chunk of rows at a time """
+    return {"csv": iter_csv, "ndjson": iter_ndjson}[file_format](resource, **kwargs)
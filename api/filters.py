@@ -0,0 +1,40 @@
+###########
+# imports #
+###########
+
+from django.contrib.postgres.search import SearchQuery, SearchRank
+from django.db import connections
+from django.db.models import F
+
+from rest_framework.filters import SearchFilter
+
+SEARCH_CONFIG = "english"
+
+##################
+# search filters #
+##################
+
+class RankedSearchFilter(SearchFilter):
+    """
+    Drop-in replacement for DRF's SearchFilter. On PostgreSQL, views that
+    declare a `search_vector_field` are matched against that trigger-maintained,
+    GIN-indexed tsvector column and, unless the client asked for an explicit
+    ordering, ranked by relevance. Everything else (and every other database)
+    keeps SearchFilter's icontains matching, which the pg_trgm indexes serve
+    on PostgreSQL.
+    """
+
+    def filter_queryset(self, request, queryset, view):
+        vector_field = getattr(view, "search_vector_field", None)
+        terms = self.get_search_terms(request)
+        if (not terms or vector_field is None
+                or connections[queryset.db].vendor != "postgresql"):
+            return super(RankedSearchFilter, self).filter_queryset(request, queryset, view)
+
+        query = SearchQuery(" ".join(terms), config=SEARCH_CONFIG)
+        queryset = queryset.filter(**{vector_field: query})
+        if not request.query_params.get("ordering"):
+            queryset = queryset.annotate(
+                search_rank=SearchRank(F(vector_field), query)
+            ).order_by("-search_rank", "-pk")
+        return queryset
@@ -0,0 +1,178 @@
+###########
+# imports #
+###########
+
+import io
+import os
+from contextlib import contextmanager
+
+from django.core.files.base import ContentFile
+from django.utils import timezone
+from PIL import Image, ImageOps
+
+from api import cache
+
+##############
+# renditions #
+##############
+
+# Profile images are served from a fixed set of precomputed WebP renditions
+# rather than at upload resolution. Each rendition fits inside a square box
+# of the given size (aspect ratio is kept) and is stored next to the original
+# as "<name>.<rendition>.webp", so its location follows from the original's
+# name and needs no extra column.
+
+RENDITIONS = [
+    ("large", 512),
+    ("medium", 256),
+    ("small", 64),
+]
+
+WEBP_QUALITY = 80
+
+def rendition_name(name, rendition):
+    """ Returns the storage name of `rendition` for the original file `name` """
+    root, _ = os.path.splitext(name)
+    return "{}.{}.webp".format(root, rendition)
+
+def rendition_urls(field_file):
+    """
+    Returns {rendition: url} for an image field's file, or None if it is empty.
+    Until its renditions have been stored (see create_renditions) every
+    rendition is the original's URL.
+    """
+    if not field_file:
+        return None
+    if field_file.instance.rendered_image != field_file.name:
+        return {rendition: field_file.url for rendition, _ in RENDITIONS}
+    return {rendition: field_file.storage.url(rendition_name(field_file.name, rendition))
+            for rendition, _ in RENDITIONS}
+
+def render(image):
+    """
+    Returns [(rendition, webp bytes)] of an opened image from the largest
+    rendition down. Orientation from EXIF is applied to the pixels and no
+    metadata is written to the renditions.
+    """
+    with decoding():
+        image = ImageOps.exif_transpose(image)
+        has_alpha = image.mode in ("RGBA", "LA", "PA") or (
+            image.mode == "P" and "transparency" in image.info)
+        image = image.convert("RGBA" if has_alpha else "RGB")
+        rendered = []
+        for rendition, size in sorted(RENDITIONS, key=lambda item: -item[1]):
+            # every rendition is resampled from the next larger one
+            image.thumbnail((size, size), Image.LANCZOS)
+            output = io.BytesIO()
+            image.save(output, format="WEBP", quality=WEBP_QUALITY, method=4)
+            rendered.append((rendition, output.getvalue()))
+    return rendered
+
+def create_renditions(field_file):
+    """
+    Stores every rendition of an image field's file, strips the metadata of
+    originals stored before uploads were stripped, and then marks the
+    renditions as ready
+    """
+    storage = field_file.storage
+    # decoded once for both
+    with storage.open(field_file.name, "rb") as original, open_image(original) as image:
+        stripped = strip_metadata(image)
+        rendered = render(image)
+    for rendition, data in rendered:
+        name = rendition_name(field_file.name, rendition)
+        # replace rather than let the storage pick an alternative name
+        storage.delete(name)
+        storage.save(name, ContentFile(data))
+    if stripped is not None:
+        storage.delete(field_file.name)
+        storage.save(field_file.name, ContentFile(stripped))
+
+    # only if the image was not replaced in the meantime
+    instance = field_file.instance
+    model = type(instance)
+    marked = model.objects.filter(pk=instance.pk, **{field_file.field.name: field_file.name}) \
+        .update(rendered_image=field_file.name, updated_at=timezone.now())
+    if marked:
+        cache.bump_versions(model)
+
+############
+# decoding #
+############
+
+class InvalidImage(ValueError):
+    """ The content is not an image Pillow can decode, or is too large to """
+
+# what Pillow raises for truncated, corrupt, unsupported or oversized images
+DECODING_ERRORS = (OSError, SyntaxError, ValueError, Image.DecompressionBombError)
+
+@contextmanager
+def decoding():
+    try:
+        yield
+    except DECODING_ERRORS as error:
+        raise InvalidImage(str(error)) from error
+
+def open_image(content):
+    """ Opens and decodes the image in `content`, or raises InvalidImage """
+    if hasattr(content, "seek"):
+        content.seek(0)
+    with decoding():
+        image = Image.open(content)
+        image.load()
+    return image
+
+############
+# metadata #
+############
+
+# Photos straight from a phone carry EXIF metadata, often including the GPS
+# position they were taken at. Originals are stored and served without it.
+
+METADATA_KEYS = ["exif", "xmp", "XML:com.adobe.xmp", "photoshop", "comment"]
+
+JPEG_QUALITY = 95
+
+def strip_metadata(image):
+    """
+    Returns an opened image re-encoded in its own format without EXIF, XMP,
+    IPTC or comment metadata, with the EXIF orientation applied to the
+    pixels, or None if it carries no metadata and can be stored as it is
+    """
+    image_format = image.format
+    metadata = any(image.info.get(key) for key in METADATA_KEYS)
+    if image_format not in ("JPEG", "MPO", "PNG", "WEBP") or not metadata:
+        return None
+    output = io.BytesIO()
+    options = {}
+    if image.info.get("icc_profile"):
+        options["icc_profile"] = image.info["icc_profile"]
+    with decoding():
+        if getattr(image, "is_animated", False):
+            # keep every frame; Pillow writes no metadata it is not given
+            image.save(output, format=image_format, save_all=True, **options)
+            image.seek(0)
+        else:
+            image = ImageOps.exif_transpose(image)
+            if image_format in ("JPEG", "MPO"):
+                image_format = "JPEG"
+                options["quality"] = JPEG_QUALITY
+                options["comment"] = b""
+                if image.mode not in ("RGB", "L", "CMYK"):
+                    image = image.convert("RGB")
+            image.save(output, format=image_format, **options)
+    return output.getvalue()
+
+def strip_upload(upload):
+    """
+    Returns the file to store in place of `upload`: the same file, or one
+    with its metadata stripped, marked as stripped either way. Raises
+    InvalidImage for broken images.
+    """
+    with open_image(upload) as image:
+        stripped = strip_metadata(image)
+    upload.seek(0)
+    if stripped is not None:
+        upload = ContentFile(stripped, name=upload.name)
+    upload.metadata_stripped = True
+    return upload
@@ -0,0 +1,137 @@
+###########
+# imports #
+###########
+
+import json
+import logging
+import threading
+import time
+from contextlib import ExitStack, contextmanager
+
+from django.conf import settings
+from django.db import connections
+
+logger = logging.getLogger("api.requests")
+
+# InstrumentationMiddleware measures every request: wall time, the number and
+# time of database queries (through connection.execute_wrapper, on every
+# alias), the time spent rendering serializers, and the response size. Each
+# request is logged as one JSON line on the "api.requests" logger, tagged with
+# its view and action, and, with API_SERVER_TIMING, the timings are sent back
+# in a Server-Timing header for the browser's network panel.
+#
+# Requests slower than API_SLOW_REQUEST_MS are logged as warnings instead,
+# along with the SQL they ran (parameters left out) and each query's time.
+
+MAX_CAPTURED_QUERIES = 100
+
+_state = threading.local()
+
+class RequestMetrics(object):
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.view = self.action = None
+        self.queries = 0
+        self.db_time = 0.0
+        self.serialize_time = 0.0
+        self.serialize_depth = 0
+        self.sql = []  # (statement, seconds), up to MAX_CAPTURED_QUERIES
+
+    def record_query(self, sql, seconds):
+        self.queries += 1
+        self.db_time += seconds
+        if len(self.sql) < MAX_CAPTURED_QUERIES:
+            self.sql.append((sql, seconds))
+
+def get_metrics():
+    """ The metrics of the request the current thread serves, or None """
+    return getattr(_state, "metrics", None)
+
+def execute_wrapper(execute, sql, params, many, context):
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        metrics = get_metrics()
+        if metrics is not None:
+            metrics.record_query(sql, time.perf_counter() - started)
+
+@contextmanager
+def serializing():
+    """ Counts the enclosed code as serializer time; nested uses count once """
+    metrics = get_metrics()
+    if metrics is None:
+        yield
+        return
+    metrics.serialize_depth += 1
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        metrics.serialize_depth -= 1
+        if not metrics.serialize_depth:
+            metrics.serialize_time += time.perf_counter() - started
+
+def ms(seconds):
+    return round(seconds * 1000, 1)
+
+##############
+# middleware #
+##############
+
+class InstrumentationMiddleware(object):
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        metrics = _state.metrics = RequestMetrics()
+        try:
+            with ExitStack() as stack:
+                for alias in connections:
+                    stack.enter_context(connections[alias].execute_wrapper(execute_wrapper))
+                response = self.get_response(request)
+        finally:
+            _state.metrics = None
+        total = time.perf_counter() - metrics.started
+        if settings.API_SERVER_TIMING:
+            response["Server-Timing"] = self.server_timing(metrics, total)
+        self.log(request, response, metrics, total)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        metrics = get_metrics()
+        view = getattr(view_func, "cls", None)
+        if metrics is None or view is None:
+            return None
+        metrics.view = view.__name__
+        # viewsets map methods to actions, plain API views handle methods
+        actions = getattr(view_func, "actions", None) or {}
+        metrics.action = actions.get(request.method.lower(), request.method.lower())
+        return None
+
+    def server_timing(self, metrics, total):
+        return ", ".join([
+            'db;dur={};desc="{} queries"'.format(ms(metrics.db_time), metrics.queries),
+            "serialize;dur={}".format(ms(metrics.serialize_time)),
+            "total;dur={}".format(ms(total)),
+        ])
+
+    def log(self, request, response, metrics, total):
+        record = {
+            "method": request.method,
+            "path": request.path,
+            "status": response.status_code,
+            "view": metrics.view,
+            "action": metrics.action,
+            "duration_ms": ms(total),
+            "queries": metrics.queries,
+            "db_ms": ms(metrics.db_time),
+            "serialize_ms": ms(metrics.serialize_time),
+            # streamed responses are sent after this point
+            "response_bytes": None if response.streaming else len(response.content),
+        }
+        if ms(total) >= settings.API_SLOW_REQUEST_MS:
+            record["sql"] = [{"sql": sql, "ms": ms(seconds)} for sql, seconds in metrics.sql]
+            logger.warning(json.dumps(record))
+        else:
+            logger.info(json.dumps(record))
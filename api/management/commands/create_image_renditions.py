@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand
+
+from api import images
+from api import models
+
+class Command(BaseCommand):
+    help = ("Create the WebP renditions of every stored User.image, e.g. for "
+            "images uploaded before renditions existed.")
+
+    def add_arguments(self, parser):
+        parser.add_argument("users", nargs="*", type=int,
+                            help="Only process the users with these ids.")
+
+    def handle(self, *args, **options):
+        users = models.User.objects.exclude(image="").exclude(image__isnull=True)
+        if options["users"]:
+            users = users.filter(pk__in=options["users"])
+        created = failed = 0
+        for user in users.only("pk", "image").iterator():
+            try:
+                images.create_renditions(user.image)
+            except (IOError, SyntaxError) as error:
+                # a missing or undecodable original should not stop the backfill
+                failed += 1
+                self.stderr.write("user {}: {}".format(user.pk, error))
+            else:
+                created += 1
+        self.stdout.write("{} image(s) rendered, {} failed".format(created, failed))
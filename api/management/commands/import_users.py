@@ -0,0 +1,129 @@
+import csv
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+
+import django
+from django.contrib.auth.hashers import make_password
+from django.core.exceptions import ValidationError
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from api import cache
+from api import models
+
+FIELDS = ["username", "email", "first_name", "last_name", "password"]
+
+def read_rows(path, file_format):
+    """ Yields the rows of a CSV or JSON lines file as dicts """
+    with open(path, newline="", encoding="utf-8") as file:
+        if file_format == "csv":
+            yield from csv.DictReader(file)
+        else:
+            for line in file:
+                if line.strip():
+                    yield json.loads(line)
+
+def course_codes(value):
+    """ The course codes of a row, given as a list or, as in CSV files, separated by spaces """
+    if not value:
+        return []
+    if isinstance(value, str):
+        return value.split()
+    if isinstance(value, list) and all(isinstance(code, str) for code in value):
+        return value
+    raise ValidationError("courses must be a list of course codes or a string of "
+                          "space separated course codes")
+
+class Command(BaseCommand):
+    help = ("Create users, and enroll them in courses, from a CSV or JSON lines file "
+            "with the columns username, email, first_name, last_name, password and "
+            "courses (course codes). Users without a password get an unusable one, "
+            "to be set through a password reset.")
+
+    def add_arguments(self, parser):
+        parser.add_argument("path")
+        parser.add_argument("--format", choices=["csv", "jsonl"],
+                            help="File format, by default guessed from the extension.")
+        parser.add_argument("--batch-size", type=int, default=1000,
+                            help="Users inserted per transaction.")
+        parser.add_argument("--processes", type=int, default=os.cpu_count(),
+                            help="Processes hashing passwords.")
+
+    def handle(self, *args, **options):
+        file_format = options["format"] or (
+            "csv" if options["path"].lower().endswith(".csv") else "jsonl")
+        self.courses = dict(models.Course.objects.values_list("code", "pk"))
+        self.seen = set()
+        self.counts = dict.fromkeys(["imported", "skipped", "invalid"], 0)
+        started = time.monotonic()
+        rows = enumerate(read_rows(options["path"], file_format), start=1)
+        try:
+            # django.setup() for processes that are spawned rather than forked
+            with ProcessPoolExecutor(options["processes"], initializer=django.setup) as pool:
+                while True:
+                    batch = list(islice(rows, options["batch_size"]))
+                    if not batch:
+                        break
+                    self.import_batch(batch, pool)
+        except (OSError, ValueError) as error:
+            raise CommandError(error)
+        # bulk_create sends no post_save signals
+        cache.bump_versions(models.User)
+        cache.bump_versions(models.Course)
+
+        elapsed = time.monotonic() - started
+        self.stdout.write("{imported} user(s) imported, {skipped} skipped as existing, "
+                          "{invalid} invalid".format(**self.counts))
+        self.stdout.write("{:.1f}s, {:.0f} users/s".format(
+            elapsed, self.counts["imported"] / elapsed if elapsed else 0))
+
+    def import_batch(self, batch, pool):
+        usernames = [row.get("username") for _, row in batch]
+        existing = set(models.User.objects.filter(username__in=usernames)
+                       .values_list("username", flat=True))
+        users, enrollments = [], []
+        for number, row in batch:
+            username = row.get("username")
+            if username in existing or username in self.seen:
+                self.counts["skipped"] += 1
+                continue
+            user = models.User(**{name: row.get(name) or "" for name in FIELDS})
+            try:
+                user.full_clean(exclude=["password"], validate_unique=False)
+                courses = [self.get_course(code) for code in course_codes(row.get("courses"))]
+            except ValidationError as error:
+                self.counts["invalid"] += 1
+                self.stderr.write("row {}: {}".format(number, "; ".join(error.messages)))
+                continue
+            self.seen.add(username)
+            users.append(user)
+            enrollments.append(courses)
+
+        # PBKDF2 is slow by design, so passwords are hashed in parallel
+        hashed = [user for user in users if user.password]
+        for user, password in zip(hashed, pool.map(make_password, [user.password for user in hashed],
+                                                   chunksize=32)):
+            user.password = password
+        for user in users:
+            if not user.password:
+                user.set_unusable_password()
+
+        with transaction.atomic():
+            models.User.objects.bulk_create(users)
+            # bulk_create only sets the ids on some databases
+            pks = dict(models.User.objects.filter(username__in=[user.username for user in users])
+                       .values_list("username", "pk"))
+            through = models.User.courses.through
+            through.objects.bulk_create([
+                through(user_id=pks[user.username], course_id=course)
+                for user, courses in zip(users, enrollments) for course in set(courses)
+            ])
+        self.counts["imported"] += len(users)
+
+    def get_course(self, code):
+        if code not in self.courses:
+            raise ValidationError("Unknown course {}".format(code))
+        return self.courses[code]
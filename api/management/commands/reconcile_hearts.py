@@ -0,0 +1,41 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, F, IntegerField, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+from api import cache
+from api import models
+
+class Command(BaseCommand):
+    help = ("Recompute the denormalized User.hearts and Project.hearts "
+            "counters from the heart M2M tables.")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--dry-run", action="store_true",
+                            help="Report drifted counters without fixing them.")
+
+    def handle(self, *args, **options):
+        # (counted model, heart through table, through column naming the counted row)
+        counters = [
+            (models.User, models.User.hearted_users.through, "to_user"),
+            (models.Project, models.Project.hearted_by.through, "project"),
+        ]
+        with transaction.atomic():
+            for model, through, column in counters:
+                actual = Coalesce(Subquery(
+                    through.objects.filter(**{column: OuterRef("pk")})
+                    .values(column)
+                    .annotate(count=Count("pk"))
+                    .values("count"),
+                    output_field=IntegerField()), 0)
+                drifted = model.objects.annotate(actual=actual).exclude(hearts=F("actual"))
+                if options["dry_run"]:
+                    fixed = drifted.count()
+                else:
+                    fixed = model.objects.filter(pk__in=drifted.values("pk")).update(hearts=actual)
+                    if fixed:
+                        # update() sends no signals to invalidate cached responses
+                        cache.bump_versions(model)
+                self.stdout.write("{}: {} drifted counter(s){}".format(
+                    model._meta.verbose_name_plural, fixed,
+                    "" if options["dry_run"] else " fixed"))
@@ -0,0 +1,50 @@
+import logging
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.test.utils import override_settings
+
+from api import benchmarks
+from thinkspace_api.urls import router
+
+class Command(BaseCommand):
+    help = ("Benchmark every GET endpoint of the API against the current database "
+            "(see seed_benchmark_data), reporting p50/p95 latency, queries and peak "
+            "memory per endpoint, and optionally checking them against a baseline.")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--iterations", type=int, default=20,
+                            help="Timed requests per endpoint.")
+        parser.add_argument("--endpoint",
+                            help="Only run the endpoints whose name contains this.")
+        parser.add_argument("--save", metavar="PATH",
+                            help="Write the results as a JSON baseline.")
+        parser.add_argument("--baseline", metavar="PATH",
+                            help="Fail if the results regress from this JSON baseline.")
+        parser.add_argument("--threshold", type=float, default=1.5,
+                            help="Allowed latency and memory growth over the baseline.")
+
+    def handle(self, *args, **options):
+        # timed requests would flood the log, and the slow ones with their SQL
+        logging.getLogger("api.requests").disabled = True
+        # the test client's requests are addressed to "testserver"
+        with override_settings(ALLOWED_HOSTS=list(settings.ALLOWED_HOSTS) + ["testserver"]):
+            try:
+                results = benchmarks.run(router, iterations=options["iterations"],
+                                         only=options["endpoint"], log=self.log)
+            except ValueError as error:
+                raise CommandError(error)
+        if options["save"]:
+            benchmarks.save(results, options["save"])
+        if options["baseline"]:
+            regressions = benchmarks.compare(results, benchmarks.load(options["baseline"]),
+                                             options["threshold"])
+            if regressions:
+                raise CommandError("Regressions from {}:\n{}".format(
+                    options["baseline"], "\n".join(regressions)))
+            self.stdout.write("No regressions from {}".format(options["baseline"]))
+
+    def log(self, name, path, result):
+        self.stdout.write("{:<30} {status} p50 {p50_ms:>8}ms p95 {p95_ms:>8}ms "
+                          "{queries:>3} queries {peak_kb:>8}KB  {path}".format(
+                              name, path=path, **result))
@@ -0,0 +1,35 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from api import tasks
+
+class Command(BaseCommand):
+    help = "Run the background tasks queued in the Job table."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--once", action="store_true",
+                            help="Exit once no job is due instead of polling.")
+        parser.add_argument("--batch", type=int, default=10,
+                            help="Jobs claimed at a time.")
+        parser.add_argument("--sleep", type=float, default=1.0,
+                            help="Seconds to wait between polls of an empty queue.")
+        parser.add_argument("--lease", type=int, default=600,
+                            help="Seconds after which a job held by a dead worker is run again.")
+
+    def handle(self, *args, **options):
+        # the worker drains the table whatever backend the web processes use
+        backend = tasks.DatabaseBackend()
+        processed = 0
+        while True:
+            close_old_connections()
+            jobs = backend.claim(options["batch"], options["lease"])
+            for job in jobs:
+                backend.run(job)
+            processed += len(jobs)
+            if not jobs:
+                if options["once"]:
+                    break
+                time.sleep(options["sleep"])
+        self.stdout.write("{} job(s) processed".format(processed))
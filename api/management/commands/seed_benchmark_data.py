@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from api import benchmarks
+from api import models
+
+class Command(BaseCommand):
+    help = ("Fill an empty database with generated users, projects, comments and "
+            "their relations for run_benchmarks (by default 100k users, 10k "
+            "projects and 1M comments).")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--scale", type=float, default=1.0,
+                            help="Multiply every table size, e.g. 0.01 for a quick run.")
+        parser.add_argument("--seed", type=int, default=0,
+                            help="Random seed, so repeated runs generate the same data.")
+
+    def handle(self, *args, **options):
+        if models.User.objects.exists():
+            raise CommandError("The database already has users; seed an empty database.")
+        sizes = {name: max(1, int(size * options["scale"]))
+                 for name, size in benchmarks.SIZES.items()}
+        benchmarks.seed(sizes, seed=options["seed"], log=self.stdout.write)
+        self.stdout.write(", ".join("{} {}".format(size, name) for name, size in sizes.items()))
@@ -0,0 +1,29 @@
+# Generated by Django 2.2.28 on 2026-10-18 18:34
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0030_auto_20180719_1627'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='project',
+            index=models.Index(fields=['timestamp', 'id'], name='api_project_ts_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='projectcomment',
+            index=models.Index(fields=['timestamp', 'id'], name='api_comment_ts_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='projectjoinrequest',
+            index=models.Index(fields=['timestamp', 'id'], name='api_joinrequest_ts_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='projectpost',
+            index=models.Index(fields=['timestamp', 'id'], name='api_post_ts_id_idx'),
+        ),
+    ]
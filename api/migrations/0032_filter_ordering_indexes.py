@@ -0,0 +1,75 @@
+# Generated by Django 2.2.28 on 2026-10-18 18:35
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0031_timestamp_id_indexes'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='course',
+            name='code',
+            field=models.TextField(db_index=True),
+        ),
+        migrations.AlterField(
+            model_name='course',
+            name='name',
+            field=models.TextField(db_index=True),
+        ),
+        migrations.AlterField(
+            model_name='project',
+            name='hearts',
+            field=models.IntegerField(db_index=True, default=0),
+        ),
+        migrations.AlterField(
+            model_name='project',
+            name='name',
+            field=models.TextField(db_index=True),
+        ),
+        migrations.AlterField(
+            model_name='projectcategory',
+            name='name',
+            field=models.TextField(db_index=True),
+        ),
+        migrations.AlterField(
+            model_name='projecttag',
+            name='name',
+            field=models.TextField(db_index=True),
+        ),
+        migrations.AddIndex(
+            model_name='projectcomment',
+            index=models.Index(fields=['project', 'timestamp', 'id'], name='api_comment_proj_ts_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='projectcomment',
+            index=models.Index(fields=['user', 'timestamp', 'id'], name='api_comment_user_ts_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='projectjoinrequest',
+            index=models.Index(fields=['project', 'user'], name='api_joinrequest_proj_user_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='projectjoinrequest',
+            index=models.Index(fields=['project', 'timestamp', 'id'], name='api_joinrequest_proj_ts_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='projectpost',
+            index=models.Index(fields=['project', 'timestamp', 'id'], name='api_post_proj_ts_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='user',
+            index=models.Index(fields=['email'], name='api_user_email_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='user',
+            index=models.Index(fields=['hearts'], name='api_user_hearts_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='user',
+            index=models.Index(fields=['date_joined'], name='api_user_date_joined_idx'),
+        ),
+    ]
@@ -0,0 +1,88 @@
+# Generated by Django 2.2.28 on 2026-10-18 18:37
+
+import django.contrib.postgres.search
+from django.db import migrations
+
+# full-text searchable tables and the columns their tsvector is built from
+SEARCH_VECTOR_COLUMNS = {
+    "api_project": ["name", "description"],
+    "api_projectcomment": ["comment"],
+    "api_projectpost": ["post"],
+}
+
+# short columns searched by substring; trigram indexes serve their icontains lookups
+TRIGRAM_COLUMNS = {
+    "api_user": ["username", "email"],
+    "api_course": ["name", "code"],
+    "api_projecttag": ["name"],
+    "api_projectcategory": ["name"],
+}
+
+def create_search_indexes(apps, schema_editor):
+    """ PostgreSQL only: the other backends keep plain substring search """
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    for table, columns in SEARCH_VECTOR_COLUMNS.items():
+        document = " || ' ' || ".join("coalesce({}, '')".format(column) for column in columns)
+        schema_editor.execute(
+            "UPDATE {table} SET search_vector = to_tsvector('pg_catalog.english', {document})"
+            .format(table=table, document=document))
+        schema_editor.execute(
+            "CREATE TRIGGER {table}_search_vector_update BEFORE INSERT OR UPDATE ON {table} "
+            "FOR EACH ROW EXECUTE PROCEDURE tsvector_update_trigger("
+            "search_vector, 'pg_catalog.english', {columns})"
+            .format(table=table, columns=", ".join(columns)))
+        schema_editor.execute(
+            "CREATE INDEX {table}_search_vector_idx ON {table} USING gin (search_vector)"
+            .format(table=table))
+
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute("SELECT 1 FROM pg_available_extensions WHERE name = 'pg_trgm'")
+        if cursor.fetchone() is None:
+            return
+    schema_editor.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+    for table, columns in TRIGRAM_COLUMNS.items():
+        for column in columns:
+            # matches the UPPER(column::text) LIKE UPPER(...) emitted for icontains
+            schema_editor.execute(
+                "CREATE INDEX {table}_{column}_trgm_idx ON {table} "
+                "USING gin (UPPER({column}::text) gin_trgm_ops)"
+                .format(table=table, column=column))
+
+def drop_search_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    for table in SEARCH_VECTOR_COLUMNS:
+        schema_editor.execute("DROP TRIGGER IF EXISTS {table}_search_vector_update ON {table}"
+                              .format(table=table))
+        schema_editor.execute("DROP INDEX IF EXISTS {table}_search_vector_idx".format(table=table))
+    for table, columns in TRIGRAM_COLUMNS.items():
+        for column in columns:
+            schema_editor.execute("DROP INDEX IF EXISTS {table}_{column}_trgm_idx"
+                                  .format(table=table, column=column))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0032_filter_ordering_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='project',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='projectcomment',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='projectpost',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        migrations.RunPython(create_search_indexes, drop_search_indexes),
+    ]
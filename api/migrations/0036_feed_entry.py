@@ -0,0 +1,69 @@
+# Generated by Django 2.2.28 on 2026-10-18 18:53
+
+from itertools import islice
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+from django.utils import timezone
+
+
+BATCH_SIZE = 1000
+
+
+def backfill_feeds(apps, schema_editor):
+    """ Fans the existing posts, comments and join requests out to the feeds, in batches """
+    db = schema_editor.connection.alias
+    Project = apps.get_model('api', 'Project')
+    FeedEntry = apps.get_model('api', 'FeedEntry')
+    recipients = {}
+    for through in [Project.members.through, Project.leaders.through]:
+        rows = through.objects.using(db).values_list('project_id', 'user_id')
+        for project_id, user_id in rows.iterator(chunk_size=BATCH_SIZE):
+            recipients.setdefault(project_id, set()).add(user_id)
+    for kind, model_name in [('post', 'ProjectPost'), ('comment', 'ProjectComment'),
+                             ('join_request', 'ProjectJoinRequest')]:
+        model = apps.get_model('api', model_name)
+        sources = model.objects.using(db).filter(project__isnull=False) \
+            .values_list('pk', 'project_id', 'timestamp').iterator(chunk_size=BATCH_SIZE)
+        entries = (FeedEntry(user_id=user_id, project_id=project_id, kind=kind,
+                             timestamp=timestamp or timezone.now(), **{kind + '_id': pk})
+                   for pk, project_id, timestamp in sources
+                   for user_id in sorted(recipients.get(project_id, ())))
+        while True:
+            batch = list(islice(entries, BATCH_SIZE))
+            if not batch:
+                break
+            FeedEntry.objects.using(db).bulk_create(batch)
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0035_job'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FeedEntry',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.TextField(choices=[('post', 'Post'), ('comment', 'Comment'), ('join_request', 'Join Request')])),
+                ('timestamp', models.DateTimeField()),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('comment', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='feed_entries', to='api.ProjectComment')),
+                ('join_request', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='feed_entries', to='api.ProjectJoinRequest')),
+                ('post', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='feed_entries', to='api.ProjectPost')),
+                ('project', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='feed_entries', to='api.Project')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='feed_entries', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Feed Entry',
+                'verbose_name_plural': 'Feed Entries',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='feedentry',
+            index=models.Index(fields=['user', 'timestamp', 'id'], name='api_feedentry_user_ts_idx'),
+        ),
+        migrations.RunPython(backfill_feeds, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,53 @@
+# Generated by Django 2.2.28 on 2026-10-18 19:11
+
+from itertools import islice
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+BATCH_SIZE = 1000
+
+
+def backfill_memberships(apps, schema_editor):
+    """ Copies the existing members and leaders into ProjectMembership, in batches """
+    db = schema_editor.connection.alias
+    Project = apps.get_model('api', 'Project')
+    ProjectMembership = apps.get_model('api', 'ProjectMembership')
+    for role, through in [('member', Project.members.through), ('leader', Project.leaders.through)]:
+        rows = through.objects.using(db).values_list('user_id', 'project_id') \
+            .iterator(chunk_size=BATCH_SIZE)
+        while True:
+            batch = [ProjectMembership(user_id=user_id, project_id=project_id, role=role)
+                     for user_id, project_id in islice(rows, BATCH_SIZE)]
+            if not batch:
+                break
+            ProjectMembership.objects.using(db).bulk_create(batch)
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0038_user_token_version'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProjectMembership',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('role', models.TextField(choices=[('member', 'Member'), ('leader', 'Leader')])),
+                ('project', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='memberships', to='api.Project')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='memberships', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='projectmembership',
+            index=models.Index(fields=['project', 'user'], name='api_membership_project_idx'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='projectmembership',
+            unique_together={('user', 'project', 'role')},
+        ),
+        migrations.RunPython(backfill_memberships, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,67 @@
+# Generated by Django 2.2.28 on 2026-10-18 19:23
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0039_project_membership'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='course',
+            name='code',
+            field=models.TextField(),
+        ),
+        migrations.AlterField(
+            model_name='course',
+            name='name',
+            field=models.TextField(),
+        ),
+        migrations.AlterField(
+            model_name='project',
+            name='hearts',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AlterField(
+            model_name='project',
+            name='name',
+            field=models.TextField(),
+        ),
+        migrations.AlterField(
+            model_name='projectcategory',
+            name='name',
+            field=models.TextField(),
+        ),
+        migrations.AlterField(
+            model_name='projecttag',
+            name='name',
+            field=models.TextField(),
+        ),
+        migrations.AddIndex(
+            model_name='course',
+            index=models.Index(fields=['code'], name='api_course_code_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='course',
+            index=models.Index(fields=['name'], name='api_course_name_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='project',
+            index=models.Index(fields=['name'], name='api_project_name_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='project',
+            index=models.Index(fields=['hearts'], name='api_project_hearts_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='projectcategory',
+            index=models.Index(fields=['name'], name='api_category_name_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='projecttag',
+            index=models.Index(fields=['name'], name='api_tag_name_idx'),
+        ),
+    ]
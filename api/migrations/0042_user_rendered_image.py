@@ -0,0 +1,18 @@
+# Generated by Django 2.2.28 on 2026-10-18 19:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0041_model_version'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='user',
+            name='rendered_image',
+            field=models.TextField(blank=True, default=''),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 2.2.28 on 2026-10-18 19:39
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0042_user_rendered_image'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='throttlebucket',
+            index=models.Index(fields=['refilled_at'], name='api_throttle_refilled_idx'),
+        ),
+    ]
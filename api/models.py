@@ -2,19 +2,88 @@
 # imports #
 ###########
 
-from django.db import models
+from itertools import islice
+
+from django.db import models, router, transaction, IntegrityError
+from django.contrib.auth import hashers
 from django.contrib.auth.models import AbstractUser
+from django.contrib.postgres.search import SearchVectorField
+from django.db.models import F
+from django.db.models.signals import m2m_changed
 from django.db.models.functions import Substr
+from django.utils import timezone
 
 def upload_to(instance, filename):
     return "users/{}/{}".format(instance.id, filename)
 
+def toggle_heart(relation, instance, related, counted, hearted=None):
+    """
+    Adds `related` to, or removes it from, the forward many-to-many `relation`
+    of `instance` by deleting or inserting a single row of its through table,
+    and moves the denormalized `counted.hearts` counter by one in the same
+    transaction. Returns True if the relation ends up holding `related`.
+
+    With `hearted` given, only hearts (True) or only unhearts (False), so that
+    repeated or concurrent requests with the same intent agree on the outcome
+    instead of undoing each other.
+    """
+    through = relation.through
+    field = relation.field
+    lookup = {field.m2m_field_name(): instance, field.m2m_reverse_field_name(): related}
+    db = router.db_for_write(through, instance=instance)
+    with transaction.atomic(using=db):
+        deleted = 0
+        if hearted is not True:
+            deleted, _ = through.objects.using(db).filter(**lookup).delete()
+            if not deleted and hearted is False:
+                return False
+        if deleted:
+            delta, action = -1, "post_remove"
+        else:
+            try:
+                with transaction.atomic(using=db):
+                    through.objects.using(db).create(**lookup)
+            except IntegrityError:
+                # already hearted, by this or a concurrent request, and counted
+                return True
+            delta, action = 1, "post_add"
+        type(counted).objects.using(db).filter(pk=counted.pk).update(hearts=F("hearts") + delta)
+        # through rows never send save/delete signals, so announce the change
+        # the same way the related manager's add() and remove() would
+        m2m_changed.send(sender=through, action=action, instance=instance, reverse=False,
+                         model=type(related), pk_set={related.pk}, using=db)
+    return delta > 0
+
+def m2m_through(model, name):
+    """
+    Returns the through model of the many-to-many relation `name` of `model`
+    (either side of a ManyToManyField), with the attnames of its column
+    pointing at `model` and of its column pointing at the related model.
+    """
+    field = model._meta.get_field(name)
+    if field.concrete:
+        through = field.remote_field.through
+        source, target = field.m2m_field_name(), field.m2m_reverse_field_name()
+    else:
+        through = field.through
+        source, target = field.field.m2m_reverse_field_name(), field.field.m2m_field_name()
+    return (through, through._meta.get_field(source).attname,
+            through._meta.get_field(target).attname)
+
 class UserSiteRole(models.Model):
     name = models.TextField()
+    updated_at = models.DateTimeField(auto_now=True)
 
 class Course(models.Model):
     code = models.TextField()
     name = models.TextField()
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["code"], name="api_course_code_idx"),
+            models.Index(fields=["name"], name="api_course_name_idx"),
+        ]
 
     def __str__(self):
         return "{}".format(self.code)
@@ -25,14 +94,44 @@ class User(AbstractUser):
     description = models.TextField(blank=True, null=True)
     links = models.TextField(blank=True, null=True)
     image = models.ImageField(blank=True, null=True, upload_to=upload_to)
+    # the image whose renditions have been stored (see images.py)
+    rendered_image = models.TextField(blank=True, default="")
     is_moderator = models.BooleanField(default=False)
     is_mentor = models.BooleanField(default=False)
     site_roles = models.ManyToManyField(UserSiteRole, related_name="users", blank=True)
     courses = models.ManyToManyField(Course, related_name="courses", blank=True)
+    # part of every JWT; bumping it revokes the tokens issued before
+    token_version = models.IntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta(AbstractUser.Meta):
+        indexes = [
+            models.Index(fields=["email"], name="api_user_email_idx"),
+            models.Index(fields=["hearts"], name="api_user_hearts_idx"),
+            models.Index(fields=["date_joined"], name="api_user_date_joined_idx"),
+        ]
 
     def __str__(self):
         return "{}".format(self.username)
 
+    def set_password(self, raw_password):
+        super(User, self).set_password(raw_password)
+        # a new password signs the user out of every client
+        self.token_version += 1
+
+    def check_password(self, raw_password):
+        def rehash(raw_password):
+            # upgrading the hash of the same password (which only saves the
+            # password field) must not sign the user out
+            super(User, self).set_password(raw_password)
+            self._password = None
+            self.save(update_fields=["password"])
+        return hashers.check_password(raw_password, self.password, rehash)
+
+    def toggle_heart(self, user, hearted=None):
+        """ Hearts or unhearts this user on behalf of `user` """
+        return toggle_heart(User.hearted_users, user, self, counted=self, hearted=hearted)
+
 class Project(models.Model):
     timestamp = models.DateTimeField(auto_now_add=True)
     name = models.TextField()  # what is the name of the project
@@ -43,29 +142,100 @@ class Project(models.Model):
     leaders = models.ManyToManyField(User, related_name="leader_projects")
     hearted_by = models.ManyToManyField(User, related_name="hearted_projects", blank=True)
     tags = models.ManyToManyField("ProjectTag", related_name="projects", blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    search_vector = SearchVectorField(null=True, editable=False)  # kept current by a PostgreSQL trigger
     
     class Meta:
         ordering = ["timestamp"]
+        indexes = [
+            # keyset pagination seeks on (timestamp, id)
+            models.Index(fields=["timestamp", "id"], name="api_project_ts_id_idx"),
+            models.Index(fields=["name"], name="api_project_name_idx"),
+            models.Index(fields=["hearts"], name="api_project_hearts_idx"),
+        ]
 
     def __str__(self):
         return "{}".format(self.name)
 
+    def toggle_heart(self, user, hearted=None):
+        """ Hearts or unhearts this project on behalf of `user` """
+        return toggle_heart(Project.hearted_by, self, user, counted=self, hearted=hearted)
+
+class ProjectMembership(models.Model):
+    """
+    One row per role a user holds in a project, mirroring Project.members
+    and Project.leaders (kept in step by api/signals.py), so a user's
+    projects, or their roles in one project, are a single index lookup.
+    """
+    MEMBER = "member"
+    LEADER = "leader"
+    ROLES = [(MEMBER, "Member"), (LEADER, "Leader")]
+
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="memberships")
+    project = models.ForeignKey(Project, on_delete=models.CASCADE, related_name="memberships")
+    role = models.TextField(choices=ROLES)
+
+    class Meta:
+        # the unique index serves lookups by user, this one by project
+        unique_together = [("user", "project", "role")]
+        indexes = [
+            models.Index(fields=["project", "user"], name="api_membership_project_idx"),
+        ]
+
+    def __str__(self):
+        return "{} : {} ({})".format(self.user_id, self.project_id, self.role)
+
+# the Project relations each membership role mirrors
+MEMBERSHIP_RELATIONS = {
+    ProjectMembership.MEMBER: "members",
+    ProjectMembership.LEADER: "leaders",
+}
+
+def rebuild_memberships(batch_size=5000):
+    """ Refills ProjectMembership from the members and leaders tables, e.g. after bulk inserts into them """
+    with transaction.atomic():
+        ProjectMembership.objects.all().delete()
+        for role, name in MEMBERSHIP_RELATIONS.items():
+            rows = (getattr(Project, name).through.objects
+                    .values_list("user_id", "project_id").iterator(chunk_size=batch_size))
+            while True:
+                # the database's own limits decide the size of each insert
+                batch = list(islice(rows, batch_size))
+                if not batch:
+                    break
+                ProjectMembership.objects.bulk_create([
+                    ProjectMembership(user_id=user_id, project_id=project_id, role=role)
+                    for user_id, project_id in batch])
+    # the inserts that made a rebuild necessary sent no signals either, so
+    # the responses built from the relations are invalidated here (cache.py
+    # imports this module, hence the late import)
+    from api import cache
+    cache.bump_versions(User, Project)
+
 class ProjectCategory(models.Model):
     name = models.TextField()
+    updated_at = models.DateTimeField(auto_now=True)
 
     class Meta:
         verbose_name = "Project Category"
         verbose_name_plural = "Project Categories"
+        indexes = [
+            models.Index(fields=["name"], name="api_category_name_idx"),
+        ]
 
     def __str__(self):
         return "{}".format(self.name)
 
 class ProjectTag(models.Model):
     name = models.TextField()
+    updated_at = models.DateTimeField(auto_now=True)
 
     class Meta:
         verbose_name = "Project Tag"
         verbose_name_plural = "Project Tags"
+        indexes = [
+            models.Index(fields=["name"], name="api_tag_name_idx"),
+        ]
 
     def __str__(self):
         return "{}".format(self.name)
@@ -75,6 +245,7 @@ class ProjectJoinRequest(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="join_requests", blank=True, null=True)
     project = models.ForeignKey(Project, on_delete=models.CASCADE, related_name="join_requests", blank=True, null=True)
     timestamp = models.DateTimeField(auto_now_add=True, blank=True, null=True)
+    updated_at = models.DateTimeField(auto_now=True)
 
     def __str__(self):
         return "{} : {}".format(self.user, self.project)
@@ -82,6 +253,11 @@ class ProjectJoinRequest(models.Model):
     class Meta:
         verbose_name = "Project Join Request"
         verbose_name_plural = "Project Join Requests"
+        indexes = [
+            models.Index(fields=["timestamp", "id"], name="api_joinrequest_ts_id_idx"),
+            models.Index(fields=["project", "user"], name="api_joinrequest_proj_user_idx"),
+            models.Index(fields=["project", "timestamp", "id"], name="api_joinrequest_proj_ts_idx"),
+        ]
 
 class ProjectComment(models.Model):
     comment = models.TextField()
@@ -91,10 +267,17 @@ class ProjectComment(models.Model):
         Project, on_delete=models.CASCADE, related_name="comments", blank=True, null=True)
     anonymous = models.BooleanField(default=False)
     timestamp = models.DateTimeField(auto_now_add=True, blank=True, null=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    search_vector = SearchVectorField(null=True, editable=False)  # kept current by a PostgreSQL trigger
 
     class Meta:
         verbose_name = "Project Comment"
         verbose_name_plural = "Project Comments"
+        indexes = [
+            models.Index(fields=["timestamp", "id"], name="api_comment_ts_id_idx"),
+            models.Index(fields=["project", "timestamp", "id"], name="api_comment_proj_ts_idx"),
+            models.Index(fields=["user", "timestamp", "id"], name="api_comment_user_ts_idx"),
+        ]
 
     def __str__(self):
         return "{} ...".format(self.comment[0:20])
@@ -105,10 +288,100 @@ class ProjectPost(models.Model):
         Project, on_delete=models.CASCADE, related_name="posts", blank=True, null=True)
     private = models.BooleanField(default=False)
     timestamp = models.DateTimeField(auto_now_add=True, blank=True, null=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    search_vector = SearchVectorField(null=True, editable=False)  # kept current by a PostgreSQL trigger
 
     class Meta:
         verbose_name = "Project Post"
         verbose_name_plural = "Project Posts"
+        indexes = [
+            models.Index(fields=["timestamp", "id"], name="api_post_ts_id_idx"),
+            models.Index(fields=["project", "timestamp", "id"], name="api_post_proj_ts_idx"),
+        ]
 
     def __str__(self):
         return "{} ...".format(self.post[0:20])
+
+class FeedEntry(models.Model):
+    """
+    One post, comment or join request in the activity feed of a member or
+    leader of its project. Entries are written once per recipient when the
+    row is created (see tasks.fan_out_to_feeds), so a user's feed is a single
+    range of the (user, timestamp, id) index.
+    """
+    POST = "post"
+    COMMENT = "comment"
+    JOIN_REQUEST = "join_request"
+    KINDS = [(POST, "Post"), (COMMENT, "Comment"), (JOIN_REQUEST, "Join Request")]
+
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="feed_entries")
+    project = models.ForeignKey(Project, on_delete=models.CASCADE, related_name="feed_entries")
+    kind = models.TextField(choices=KINDS)
+    post = models.ForeignKey(ProjectPost, on_delete=models.CASCADE, related_name="feed_entries",
+                             blank=True, null=True)
+    comment = models.ForeignKey(ProjectComment, on_delete=models.CASCADE,
+                                related_name="feed_entries", blank=True, null=True)
+    join_request = models.ForeignKey(ProjectJoinRequest, on_delete=models.CASCADE,
+                                     related_name="feed_entries", blank=True, null=True)
+    timestamp = models.DateTimeField()  # of the post, comment or join request
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = "Feed Entry"
+        verbose_name_plural = "Feed Entries"
+        indexes = [
+            models.Index(fields=["user", "timestamp", "id"], name="api_feedentry_user_ts_idx"),
+        ]
+
+    def __str__(self):
+        return "{} : {}".format(self.user, self.kind)
+
+class Job(models.Model):
+    """ A queued call of a background task (see api/tasks.py) """
+    QUEUED = "queued"
+    RUNNING = "running"
+    FAILED = "failed"
+    STATUSES = [(QUEUED, "Queued"), (RUNNING, "Running"), (FAILED, "Failed")]
+
+    name = models.TextField()  # registered task name
+    payload = models.TextField()  # JSON encoded [args, kwargs]
+    status = models.TextField(choices=STATUSES, default=QUEUED)
+    attempts = models.IntegerField(default=0)
+    max_attempts = models.IntegerField()
+    run_at = models.DateTimeField(default=timezone.now)  # not before, for retry backoff
+    locked_at = models.DateTimeField(blank=True, null=True)  # when a worker claimed it
+    last_error = models.TextField(blank=True, default="")
+    timestamp = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            # workers claim the due jobs of a status, oldest first
+            models.Index(fields=["status", "run_at"], name="api_job_status_run_at_idx"),
+        ]
+
+    def __str__(self):
+        return "{} ({})".format(self.name, self.status)
+
+class ThrottleBucket(models.Model):
+    """ The token bucket of a rate limited client (see api/throttling.py) """
+    key = models.TextField(unique=True)  # scope and user or IP address
+    tokens = models.FloatField()
+    refilled_at = models.DateTimeField()  # when tokens was last brought up to date
+
+    class Meta:
+        indexes = [
+            # stale buckets are pruned by age
+            models.Index(fields=["refilled_at"], name="api_throttle_refilled_idx"),
+        ]
+
+    def __str__(self):
+        return "{} ({:.1f})".format(self.key, self.tokens)
+
+class ModelVersion(models.Model):
+    """ When rows of a model were last written, keying cached responses (see api/cache.py) """
+    model = models.TextField(unique=True)  # app_label.model_name
+    version = models.FloatField()  # time of the last committed write, only ever increasing
+
+    def __str__(self):
+        return "{} ({})".format(self.model, self.version)
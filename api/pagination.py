@@ -0,0 +1,109 @@
+###########
+# imports #
+###########
+
+import binascii
+from base64 import urlsafe_b64decode as b64decode, urlsafe_b64encode as b64encode
+from collections import OrderedDict
+
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+
+from rest_framework import pagination
+from rest_framework.exceptions import NotFound, ValidationError
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import replace_query_param
+
+######################
+# pagination classes #
+######################
+
+def seek(queryset, timestamp, pk):
+    """ The rows of a newest first queryset that come after (timestamp, pk) """
+    # the OR alone is no index condition, and the scan would start at the
+    # newest row; the redundant bound makes it start at the cursor
+    return queryset.filter(timestamp__lte=timestamp).filter(
+        Q(timestamp__lt=timestamp) | Q(timestamp=timestamp, pk__lt=pk))
+
+class BoundedLimitOffsetPagination(pagination.LimitOffsetPagination):
+    """
+    Limit/offset pagination that refuses to serve more than `max_limit` rows
+    per page, however large a `?limit=` the client asks for.
+    """
+    max_limit = 100
+
+class FeedPagination(BoundedLimitOffsetPagination):
+    """
+    Limit/offset pagination with an opt-in keyset mode for timestamp-ordered
+    feeds. Passing `?cursor=` (empty for the first page) switches to seeking
+    on (timestamp, id), newest first, so every page costs the same index range
+    read however deep it is, and rows created between requests never shift
+    the pages that follow. Rows without a timestamp are not part of the feed.
+    The keyset order is fixed, so `?ordering=` is refused in that mode.
+    """
+    cursor_query_param = "cursor"
+    invalid_cursor_message = "Invalid cursor"
+    ordering_message = "Keyset pages are always newest first; use ?offset= paging to order otherwise."
+
+    keyset = False
+
+    def paginate_queryset(self, queryset, request, view=None):
+        if self.cursor_query_param not in request.query_params:
+            return super(FeedPagination, self).paginate_queryset(queryset, request, view)
+
+        if request.query_params.get(api_settings.ORDERING_PARAM):
+            raise ValidationError({api_settings.ORDERING_PARAM: self.ordering_message})
+        self.keyset = True
+        self.request = request
+        self.limit = self.get_limit(request)
+        queryset = queryset.filter(timestamp__isnull=False).order_by("-timestamp", "-pk")
+        position = self.decode_cursor(request)
+        if position is not None:
+            queryset = seek(queryset, *position)
+
+        # fetch one extra row to learn whether there is a next page
+        page = list(queryset[:self.limit + 1])
+        self.has_next = len(page) > self.limit
+        self.page = page[:self.limit]
+        return self.page
+
+    def get_paginated_response(self, data):
+        if not self.keyset:
+            return super(FeedPagination, self).get_paginated_response(data)
+        return Response(OrderedDict([
+            ("next", self.get_next_link()),
+            ("results", data),
+        ]))
+
+    def get_next_link(self):
+        if not self.keyset:
+            return super(FeedPagination, self).get_next_link()
+        if not self.has_next:
+            return None
+        last = self.page[-1]
+        url = self.request.build_absolute_uri()
+        url = replace_query_param(url, self.cursor_query_param, self.encode_cursor(last))
+        return replace_query_param(url, self.limit_query_param, self.limit)
+
+    def get_previous_link(self):
+        if not self.keyset:
+            return super(FeedPagination, self).get_previous_link()
+        return None
+
+    def encode_cursor(self, obj):
+        position = "{}|{}".format(obj.timestamp.isoformat(), obj.pk)
+        return b64encode(position.encode("ascii")).decode("ascii")
+
+    def decode_cursor(self, request):
+        encoded = request.query_params[self.cursor_query_param]
+        if not encoded:
+            return None
+        try:
+            timestamp, pk = b64decode(encoded.encode("ascii")).decode("ascii").split("|")
+            timestamp, pk = parse_datetime(timestamp), int(pk)
+        except (TypeError, ValueError, UnicodeError, binascii.Error):
+            raise NotFound(self.invalid_cursor_message)
+        if timestamp is None:
+            raise NotFound(self.invalid_cursor_message)
+        return timestamp, pk
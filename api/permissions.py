@@ -6,7 +6,7 @@ from rest_framework import permissions
 from api import models
 
 SAFE_METHODS = ["GET", "HEAD", "OPTIONS"]
-WRITE_ACTIONS = ["create", "update", "partial_update", "destroy"]
+WRITE_ACTIONS = ["create", "update", "partial_update", "destroy", "bulk"]
 READ_ACTIONS = ["list", "retrieve"]
 
 #########################
@@ -22,6 +22,38 @@ def CanWriteGeneric(user, obj_with_user_field):
     else:
         return False
 
+class ProjectRoles(object):
+    """
+    The ids of the projects a user is a member or leader of. Resolved once per
+    request with one index lookup of their memberships and cached on the
+    request, so each object-level project check is a set lookup however many
+    objects a response touches.
+    """
+
+    def __init__(self, user):
+        self.member_ids = set()
+        self.leader_ids = set()
+        if user is not None and user.is_authenticated:
+            roles = {models.ProjectMembership.MEMBER: self.member_ids,
+                     models.ProjectMembership.LEADER: self.leader_ids}
+            for project_id, role in (models.ProjectMembership.objects.filter(user=user)
+                                     .values_list("project_id", "role")):
+                roles[role].add(project_id)
+
+    @classmethod
+    def for_request(cls, request):
+        roles = getattr(request, "_project_roles", None)
+        if roles is None:
+            roles = cls(request.user)
+            request._project_roles = roles
+        return roles
+
+    def is_member(self, project_id):
+        return project_id in self.member_ids or project_id in self.leader_ids
+
+    def is_leader(self, project_id):
+        return project_id in self.leader_ids
+
 class Nope(permissions.BasePermission):
     def has_permission(self, request, view):
         return False
@@ -29,6 +61,10 @@ class Nope(permissions.BasePermission):
     def has_object_permission(self, request, view, obj):
         return False
 
+class IsStaff(permissions.BasePermission):
+    def has_permission(self, request, view):
+        return request.user and request.user.is_staff
+
 #########
 # users #
 #########
@@ -69,6 +105,16 @@ class UserDestroy(permissions.BasePermission):
                 return True
         return False
 
+class UserFeed(permissions.BasePermission):
+    def has_object_permission(self, request, view, obj):
+        """ Only staff members, the owning user can read a user's feed """
+        return CanWriteUser(request.user, obj)
+
+class UserProjects(permissions.BasePermission):
+    def has_object_permission(self, request, view, obj):
+        """ Only staff members, the owning user can list a user's projects """
+        return CanWriteUser(request.user, obj)
+
 class UserUpdate(permissions.BasePermission):
     def has_object_permission(self, request, view, obj):
         if request.user.is_authenticated:
@@ -93,10 +139,10 @@ class CourseWrite(permissions.BasePermission):
 # projects #
 ############
 
-def CanWriteProject(user, project):
-    if user.is_staff:
+def CanWriteProject(request, project):
+    if request.user.is_staff:
         return True
-    elif (user in project.leaders.all()):
+    elif ProjectRoles.for_request(request).is_leader(project.pk):
         return True
     else:
         return False
@@ -108,12 +154,19 @@ class ProjectWrite(permissions.BasePermission):
 
     def has_object_permission(self, request, view, obj):
         """ Staff members, project leaders can write to existing projects """
-        return CanWriteProject(request.user, obj)
+        return CanWriteProject(request, obj)
 
 #########################
 # project join requests #
 #########################
 
+class ProjectJoinRequestRead(permissions.BasePermission):
+    def has_permission(self, request, view):
+        """ Staff members, project members, project leaders can read a project's join requests """
+        if request.user.is_staff:
+            return True
+        return ProjectRoles.for_request(request).is_member(int(view.kwargs["project_pk"]))
+
 class ProjectJoinRequestWrite(permissions.BasePermission):
     def has_permission(self, request, view):
         """ All authenticated users can create join requests """
@@ -162,10 +215,10 @@ class ProjectCommentWrite(permissions.BasePermission):
 # project posts #
 #################
 
-def CanReadPrivateProjectPost(user, post):
-    if user.is_staff:
+def CanReadPrivateProjectPost(request, post):
+    if request.user.is_staff:
         return True
-    elif (user in post.project.members.all()) or (user in post.project.leaders.all()):
+    elif ProjectRoles.for_request(request).is_member(post.project_id):
         return True
     else:
         return False
@@ -180,14 +233,14 @@ class ProjectPostRead(permissions.BasePermission):
         """ Only staff members, project members, project leaders can read private posts. 
         Everyone can read public posts """
         if obj.private:
-            return CanReadPrivateProjectPost(request.user, obj)
+            return CanReadPrivateProjectPost(request, obj)
         else:
             return True
 
-def CanWriteProjectPost(user, post):
-    if user.is_staff:
+def CanWriteProjectPost(request, post):
+    if request.user.is_staff:
         return True
-    elif (user in post.project.leaders.all()):
+    elif ProjectRoles.for_request(request).is_leader(post.project_id):
         return True
     else:
         return False
@@ -199,5 +252,5 @@ class ProjectPostWrite(permissions.BasePermission):
 
     def has_object_permission(self, request, view, obj):
         """ Staff members, project leaders can write to existing post objects """
-        return CanWriteProjectPost(request.user, obj)
+        return CanWriteProjectPost(request, obj)
 
@@ -3,9 +3,13 @@
 ###########
 
 from django.contrib.auth.models import Group
+from django.core.exceptions import FieldDoesNotExist
+from django.db.models import Prefetch
 
 from rest_framework import serializers
 
+from api import images
+from api import instrumentation
 from api import models
 from api import permissions
 
@@ -20,14 +24,112 @@ from api import permissions
 # "extra_fields" meta attribute "extra_fields" is useful because now we can
 # explicitly add related_names
 
+# On reads, clients can also trim the payload with sparse fieldsets:
+# ?fields=id,username only renders the named fields, and ?expand=courses only
+# renders the named "extra_fields" relations (all of them when absent). The
+# pruning carries through to the queries, since get_prefetch_lookups and
+# get_only_columns plan from the fields that are left.
+
 class BaseSerializer(serializers.ModelSerializer):
+    def to_representation(self, instance):
+        with instrumentation.serializing():
+            return super(BaseSerializer, self).to_representation(instance)
+
     def get_field_names(self, declared_fields, info):
         expanded_fields = super(BaseSerializer, self).get_field_names(
             declared_fields, info)
-        if getattr(self.Meta, 'extra_fields', None):
-            return expanded_fields + self.Meta.extra_fields
-        else:
-            return expanded_fields
+        extra_fields = list(getattr(self.Meta, 'extra_fields', None) or [])
+        field_names = expanded_fields + [name for name in extra_fields
+                                         if name not in expanded_fields]
+        fields, expand = self.get_requested_fields()
+        if fields is None and expand is None:
+            return field_names
+
+        many = [name for name in field_names if self.is_many_relation(name, declared_fields, info)]
+        errors = {}
+        if fields is not None and fields - set(field_names):
+            errors["fields"] = "Unknown fields: {}.".format(", ".join(sorted(fields - set(field_names))))
+        if expand is not None and expand - set(many):
+            errors["expand"] = "Unknown relations: {}.".format(", ".join(sorted(expand - set(many))))
+        if errors:
+            raise serializers.ValidationError(errors)
+
+        # ?expand= names the relations to render, all others are left out
+        if expand is not None:
+            field_names = [name for name in field_names if name not in many or
+                           name in expand or (fields is not None and name in fields)]
+        if fields is not None:
+            field_names = [name for name in field_names if name in fields or
+                           (expand is not None and name in expand)]
+        return field_names
+
+    def is_many_relation(self, name, declared_fields, info):
+        if name in declared_fields:
+            field = declared_fields[name]
+            return isinstance(field, (serializers.ManyRelatedField, serializers.ListSerializer))
+        return name in info.relations and info.relations[name].to_many
+
+    def get_requested_fields(self):
+        """
+        Returns the (?fields=, ?expand=) name sets of a read request, each None
+        when not given. Only the top-level serializer of a response honours them.
+        """
+        request = self.context.get("request")
+        if request is None or request.method not in permissions.SAFE_METHODS:
+            return None, None
+        if not (self.parent is None or (self.parent is self.root and
+                                        isinstance(self.parent, serializers.ListSerializer))):
+            return None, None
+        requested = []
+        for param in ["fields", "expand"]:
+            value = request.query_params.get(param)
+            requested.append(None if value is None else
+                             set(name.strip() for name in value.split(",") if name.strip()))
+        fields, expand = requested
+        return fields or None, expand
+
+    # With sparse fieldsets only the columns behind the selected fields (plus
+    # any the serializer needs for itself, listed in Meta.always_load) have to
+    # be loaded. Returns None when every column is needed.
+    def get_only_columns(self):
+        fields, _ = self.get_requested_fields()
+        if fields is None:
+            return None
+        model = self.Meta.model
+        columns = set(["pk"] + list(getattr(self.Meta, "always_load", [])))
+        for field in self.fields.values():
+            if field.source == "*":
+                return None
+            try:
+                model_field = model._meta.get_field(field.source_attrs[0])
+            except FieldDoesNotExist:
+                return None
+            if model_field.concrete and not model_field.many_to_many:
+                columns.add(model_field.name)
+        return sorted(columns)
+
+    # Every many-relation we render is a list of primary keys, so rather than
+    # letting each row hit the database once per relation we derive a
+    # prefetch for each one. Each prefetch only loads the columns needed to
+    # emit the ids, giving one bulk query per relation regardless of page size.
+    def get_prefetch_lookups(self):
+        model = self.Meta.model
+        lookups = []
+        for field in self.fields.values():
+            if not isinstance(field, serializers.ManyRelatedField):
+                continue
+            try:
+                model_field = model._meta.get_field(field.source)
+            except FieldDoesNotExist:
+                continue
+            columns = ["pk"]
+            if model_field.one_to_many:
+                # reverse foreign keys are matched back to their owner through
+                # the foreign key column, so it must not be deferred
+                columns.append(model_field.field.attname)
+            related = model_field.related_model._default_manager.only(*columns)
+            lookups.append(Prefetch(field.source, queryset=related))
+        return lookups
 
 #####################
 # model serializers #
@@ -37,10 +139,20 @@ class BaseSerializer(serializers.ModelSerializer):
 # user #
 ########
 
+class ImageRenditionsField(serializers.ReadOnlyField):
+    """ Renders an image field as the URLs of its precomputed renditions """
+
+    def to_representation(self, value):
+        return images.rendition_urls(value)
+
 class UserListRetrieve(BaseSerializer):
+    image_renditions = ImageRenditionsField(source="image")
+
     class Meta:
         model = models.User
-        exclude = ["is_superuser", "user_permissions", "groups", "password"]
+        exclude = ["is_superuser", "user_permissions", "groups", "password",
+                   "rendered_image"]
+        always_load = ["rendered_image"]
         extra_fields = ["member_projects", "leader_projects",
                         "hearted_by", "hearted_projects", "join_requests", "courses"]
 
@@ -58,6 +170,17 @@ class UserUpdate(BaseSerializer):
         model = models.User
         fields = ["email", "first_name", "last_name", "image", "links", "courses"]
 
+    def validate_image(self, image):
+        """ Decodes uploads once, rejecting broken ones and stripping their metadata """
+        if not image:
+            return image
+        try:
+            return images.strip_upload(image)
+        except images.InvalidImage:
+            raise serializers.ValidationError(
+                "Upload a valid image. The file you uploaded was either not an image, "
+                "a corrupted image or too large.")
+
 ###########
 # courses #
 ###########
@@ -79,6 +202,17 @@ class ProjectTagSerializer(BaseSerializer):
         extra_fields = ["projects"]
         fields = "__all__"
 
+    def validate_projects(self, projects):
+        """ Only staff members and their leaders can tag projects """
+        request = self.context["request"]
+        denied = sorted(project.pk for project in projects
+                        if not permissions.CanWriteProject(request, project))
+        if denied:
+            raise serializers.ValidationError(
+                "Only project leaders can tag projects: {}.".format(
+                    ", ".join(str(pk) for pk in denied)))
+        return projects
+
 class ProjectJoinRequestSerializer(BaseSerializer):
     class Meta:
         model = models.ProjectJoinRequest
@@ -88,13 +222,16 @@ class ProjectJoinRequestSerializer(BaseSerializer):
 class ProjectSerializer(BaseSerializer):
     class Meta:
         model = models.Project
-        fields = "__all__"
+        exclude = ["search_vector"]
         extra_fields = ["join_requests", "comments", "posts"]
 
 class ProjectCommentSerializer(BaseSerializer):
     class Meta:
         model = models.ProjectComment
-        fields = "__all__"
+        exclude = ["search_vector"]
+        always_load = ["anonymous"]
+        # comments are written as the requesting user (see ProjectCommentViewSet)
+        read_only_fields = ["user"]
 
     # exclude fields on a per-instance basis
     # but whose fields we still want to show on the browsable API on a list basis
@@ -102,26 +239,41 @@ class ProjectCommentSerializer(BaseSerializer):
         representation = super(ProjectCommentSerializer,
                                self).to_representation(obj)
         if obj.anonymous:
-            representation.pop("user")
+            representation.pop("user", None)
         return representation
 
 class ProjectPostSerializer(BaseSerializer):
     class Meta:
         model = models.ProjectPost
-        fields = "__all__"
+        exclude = ["search_vector"]
+        always_load = ["private", "project"]
+
+    def validate_project(self, project):
+        """ Only staff members and its leaders can post to a project """
+        if project is not None and not permissions.CanWriteProject(self.context["request"], project):
+            raise serializers.ValidationError("Only project leaders can post to this project.")
+        return project
 
     # exclude fields on a per-instance basis
     # but whose fields we still want to show on the browsable API on a list basis
     def to_representation(self, obj):
         representation = super(ProjectPostSerializer,
                                self).to_representation(obj)
-        user = None
         request = self.context.get("request")
-        if request and hasattr(request, "user"):
-            user = request.user
         if obj.private:
-            if permissions.CanReadPrivateProjectPost(user, obj) == False:
-                representation.pop("post")
+            if request is None or permissions.CanReadPrivateProjectPost(request, obj) == False:
+                representation.pop("post", None)
         return representation
 
+########
+# feed #
+########
 
+class FeedEntrySerializer(BaseSerializer):
+    post = ProjectPostSerializer(read_only=True)
+    comment = ProjectCommentSerializer(read_only=True)
+    join_request = ProjectJoinRequestSerializer(read_only=True)
+
+    class Meta:
+        model = models.FeedEntry
+        fields = ["id", "kind", "project", "timestamp", "post", "comment", "join_request"]
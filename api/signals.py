@@ -0,0 +1,111 @@
+###########
+# imports #
+###########
+
+from django.apps import apps
+from django.db.models.signals import pre_save, post_save, post_delete, m2m_changed
+
+from api import cache
+from api import images
+from api import models
+from api import tasks
+
+######################
+# cache invalidation #
+######################
+
+def invalidate_on_write(sender, **kwargs):
+    cache.bump_versions(sender)
+
+def invalidate_on_m2m_change(sender, action, **kwargs):
+    # a through table row changes the representation of both of its sides
+    if action.startswith("post_"):
+        cache.bump_versions(*[field.related_model for field in sender._meta.fields
+                              if field.is_relation])
+
+#################
+# image uploads #
+#################
+
+# pre_save runs before the upload is written to storage, which is the last
+# point where a new upload can be told apart from an unchanged image (and
+# stripped of its metadata before it is stored)
+
+def note_image_upload(sender, instance, **kwargs):
+    instance._image_uploaded = bool(instance.image) and not instance.image._committed
+    # uploads through the API were stripped when the serializer validated them
+    if instance._image_uploaded and not getattr(instance.image.file, "metadata_stripped", False):
+        try:
+            instance.image.file = images.strip_upload(instance.image.file)
+        except images.InvalidImage:
+            # stored as it is; the renditions job reports the broken image
+            pass
+
+def render_image_upload(sender, instance, **kwargs):
+    if getattr(instance, "_image_uploaded", False):
+        instance._image_uploaded = False
+        tasks.create_image_renditions.delay(instance.pk, instance.image.name)
+
+###############
+# memberships #
+###############
+
+# ProjectMembership mirrors Project.members and Project.leaders, whichever
+# side of the relation they are changed from
+
+def sync_memberships(sender, instance, action, reverse, pk_set, **kwargs):
+    role = MEMBERSHIP_ROLES[sender]
+    # reverse when changed from the user's side, e.g. user.member_projects
+    own, other = ("user_id", "project_id") if reverse else ("project_id", "user_id")
+    memberships = models.ProjectMembership.objects.filter(role=role, **{own: instance.pk})
+    if action == "post_add":
+        models.ProjectMembership.objects.bulk_create(
+            [models.ProjectMembership(role=role, **{own: instance.pk, other: pk}) for pk in pk_set],
+            ignore_conflicts=True)
+    elif action == "post_remove":
+        memberships.filter(**{other + "__in": pk_set}).delete()
+    elif action == "post_clear":
+        memberships.delete()
+
+MEMBERSHIP_ROLES = {}
+
+########
+# feed #
+########
+
+def fan_out_on_create(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        tasks.fan_out_to_feeds.delay(FEED_KINDS[sender], instance.pk)
+
+FEED_KINDS = {}
+
+def connect():
+    user = apps.get_model("api", "User")
+    pre_save.connect(note_image_upload, sender=user)
+    post_save.connect(render_image_upload, sender=user)
+
+    for role, name in models.MEMBERSHIP_RELATIONS.items():
+        MEMBERSHIP_ROLES[getattr(models.Project, name).through] = role
+    for through in MEMBERSHIP_ROLES:
+        m2m_changed.connect(sync_memberships, sender=through)
+
+    FEED_KINDS.update({
+        apps.get_model("api", "ProjectPost"): "post",
+        apps.get_model("api", "ProjectComment"): "comment",
+        apps.get_model("api", "ProjectJoinRequest"): "join_request",
+    })
+    for model in FEED_KINDS:
+        post_save.connect(fan_out_on_create, sender=model)
+
+    # through tables never send save/delete signals, only m2m_changed
+    for model in apps.get_app_config("api").get_models(include_auto_created=True):
+        if model._meta.object_name in ["Job", "FeedEntry", "ThrottleBucket", "ProjectMembership",
+                                        "ModelVersion"]:
+            # never part of a cached response, and left out so that deleting
+            # their rows stays a single query
+            continue
+        if model._meta.auto_created:
+            m2m_changed.connect(invalidate_on_m2m_change, sender=model)
+        else:
+            post_save.connect(invalidate_on_write, sender=model)
+            post_delete.connect(invalidate_on_write, sender=model)
@@ -0,0 +1,207 @@
+###########
+# imports #
+###########
+
+import json
+import logging
+import threading
+import traceback
+from concurrent.futures import ThreadPoolExecutor, wait
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connections, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from api import images
+from api import models
+
+logger = logging.getLogger(__name__)
+
+# Slow side effects (storage uploads, notification fan-out) run as tasks
+# outside the request. A task is a plain function registered with @task and
+# queued with `func.delay(*args, **kwargs)`; its arguments must be JSON
+# serializable, since they may be stored in the Job table. Where the job is
+# run depends on settings.API_TASK_BACKEND:
+#
+# - ThreadPoolBackend runs jobs on threads of the enqueuing process, once the
+#   current transaction commits. Used in development and tests.
+# - DatabaseBackend stores jobs as Job rows in the current transaction, for
+#   `python manage.py run_worker` processes to claim and run.
+#
+# Failed jobs are retried with exponential backoff up to max_attempts times.
+
+DEFAULT_MAX_ATTEMPTS = 5
+RETRY_BASE_DELAY = 10  # seconds before the first retry, doubled on each one
+RETRY_MAX_DELAY = 60 * 60
+
+############
+# registry #
+############
+
+TASKS = {}
+
+def task(func=None, max_attempts=DEFAULT_MAX_ATTEMPTS):
+    """ Registers `func` as a task, usable as @task or @task(max_attempts=...) """
+    if func is None:
+        return lambda func: task(func, max_attempts=max_attempts)
+    func.task_name = "{}.{}".format(func.__module__, func.__name__)
+    func.max_attempts = max_attempts
+    func.delay = lambda *args, **kwargs: enqueue(func, *args, **kwargs)
+    TASKS[func.task_name] = func
+    return func
+
+def enqueue(func, *args, **kwargs):
+    """ Queues a call of the task `func` on the configured backend """
+    payload = json.dumps([args, kwargs])
+    get_backend().enqueue(func.task_name, payload, func.max_attempts)
+
+def execute(name, payload):
+    """ Runs the task `name` with its JSON encoded [args, kwargs] """
+    args, kwargs = json.loads(payload)
+    TASKS[name](*args, **kwargs)
+
+def retry_delay(attempts):
+    """ Returns the backoff in seconds before retrying a job that failed `attempts` times """
+    return min(RETRY_BASE_DELAY * 2 ** (attempts - 1), RETRY_MAX_DELAY)
+
+_backend = None
+_backend_lock = threading.Lock()
+
+def get_backend():
+    global _backend
+    with _backend_lock:
+        if _backend is None:
+            _backend = import_string(settings.API_TASK_BACKEND)()
+    return _backend
+
+############
+# backends #
+############
+
+class ThreadPoolBackend(object):
+    """ Runs jobs on a pool of threads in this process """
+    # starts the retry of a failed job once its backoff is over
+    timer_class = threading.Timer
+
+    def __init__(self):
+        self.executor = ThreadPoolExecutor(max_workers=settings.API_TASK_WORKERS)
+        self.futures = set()
+        self.lock = threading.Lock()
+
+    def enqueue(self, name, payload, max_attempts):
+        # the job may need rows written by the enqueuing transaction
+        transaction.on_commit(lambda: self.submit(name, payload, max_attempts))
+
+    def submit(self, name, payload, max_attempts, attempt=1):
+        future = self.executor.submit(self.run, name, payload, max_attempts, attempt)
+        with self.lock:
+            self.futures.add(future)
+        future.add_done_callback(self.discard)
+
+    def discard(self, future):
+        with self.lock:
+            self.futures.discard(future)
+
+    def run(self, name, payload, max_attempts, attempt):
+        try:
+            execute(name, payload)
+        except Exception:
+            if attempt == max_attempts:
+                logger.exception("Task %s failed after %d attempts", name, attempt)
+            else:
+                logger.warning("Task %s failed, retrying", name, exc_info=True)
+                # the pool thread is freed during the backoff
+                timer = self.timer_class(retry_delay(attempt), self.submit,
+                                         args=(name, payload, max_attempts, attempt + 1))
+                timer.daemon = True
+                timer.start()
+        finally:
+            # every pool thread opens its own connections
+            connections.close_all()
+
+    def join(self):
+        """ Waits for every submitted job to finish, but not for retries still backing off """
+        while True:
+            with self.lock:
+                futures = list(self.futures)
+            if not futures:
+                return
+            wait(futures)
+
+class DatabaseBackend(object):
+    """ Stores jobs in the Job table for worker processes to run """
+
+    def enqueue(self, name, payload, max_attempts):
+        # written in the caller's transaction, so the job only becomes
+        # visible to workers along with the rows it refers to
+        models.Job.objects.create(name=name, payload=payload, max_attempts=max_attempts)
+
+    def claim(self, limit, lease):
+        """
+        Locks up to `limit` due jobs for this worker and returns them. Jobs
+        held longer than `lease` seconds by a worker that died are claimed
+        again, or failed if they are out of attempts.
+        """
+        now = timezone.now()
+        expired = Q(status=models.Job.RUNNING, locked_at__lt=now - timedelta(seconds=lease))
+        with transaction.atomic():
+            models.Job.objects.filter(expired, attempts__gte=F("max_attempts")).update(
+                status=models.Job.FAILED, last_error="Lease expired")
+            jobs = list(models.Job.objects
+                        .select_for_update(skip_locked=True)
+                        .filter(Q(status=models.Job.QUEUED, run_at__lte=now) | expired)
+                        .order_by("run_at")[:limit])
+            models.Job.objects.filter(pk__in=[job.pk for job in jobs]).update(
+                status=models.Job.RUNNING, locked_at=now, attempts=F("attempts") + 1)
+        for job in jobs:
+            job.attempts += 1
+        return jobs
+
+    def run(self, job):
+        """ Runs a claimed job, then deletes it or schedules its retry """
+        try:
+            execute(job.name, job.payload)
+        except Exception:
+            logger.warning("Task %s failed (attempt %d)", job.name, job.attempts, exc_info=True)
+            update = {"last_error": traceback.format_exc(), "locked_at": None}
+            if job.attempts >= job.max_attempts:
+                update["status"] = models.Job.FAILED
+            else:
+                update["status"] = models.Job.QUEUED
+                update["run_at"] = timezone.now() + timedelta(seconds=retry_delay(job.attempts))
+            models.Job.objects.filter(pk=job.pk).update(**update)
+        else:
+            models.Job.objects.filter(pk=job.pk).delete()
+
+#########
+# tasks #
+#########
+
+@task
+def create_image_renditions(user_pk, name):
+    """ Stores the renditions of a user's uploaded image """
+    user = models.User.objects.filter(pk=user_pk).only("image").first()
+    # skip images that were replaced before the job ran
+    if user is not None and user.image.name == name:
+        images.create_renditions(user.image)
+
+@task
+def fan_out_to_feeds(kind, pk):
+    """ Adds a new post, comment or join request to the feeds of its project's members and leaders """
+    model = models.FeedEntry._meta.get_field(kind).related_model
+    source = model.objects.filter(pk=pk).only("project", "timestamp").first()
+    if source is None or source.project_id is None:
+        return
+    recipients = set(models.ProjectMembership.objects.filter(project=source.project_id)
+                     .values_list("user_id", flat=True))
+    with transaction.atomic():
+        # a retried job must not add the entries twice
+        models.FeedEntry.objects.filter(**{kind: source}).delete()
+        models.FeedEntry.objects.bulk_create([
+            models.FeedEntry(user_id=user_id, project_id=source.project_id, kind=kind,
+                             timestamp=source.timestamp or timezone.now(), **{kind: source})
+            for user_id in sorted(recipients)
+        ])
@@ -0,0 +1,79 @@
+###########
+# imports #
+###########
+
+from contextlib import ExitStack, contextmanager
+
+from django.db import connections
+
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+# Viewsets declare the most queries each of their read actions may make:
+#
+#     query_budgets = {"list": 8, "retrieve": 8}
+#
+# QueryBudgetMixin checks them in tests. A list action must also make as many
+# queries for a page of 100 rows as for a page of 1, so a relation that starts
+# being fetched row by row (say, a new extra_fields entry the prefetch
+# planning does not cover) fails the suite instead of reaching production.
+
+@contextmanager
+def capture_queries():
+    """
+    Collects the SQL of every query run, on any database, in the enclosed
+    block. Unlike CaptureQueriesContext it works with DEBUG on or off and
+    however many queries ran before.
+    """
+    queries = []
+
+    def capture(execute, sql, params, many, context):
+        queries.append(sql)
+        return execute(sql, params, many, context)
+
+    with ExitStack() as stack:
+        for alias in connections:
+            stack.enter_context(connections[alias].execute_wrapper(capture))
+        yield queries
+
+class QueryBudgetMixin(object):
+    """ Query count assertions for viewset actions, for TestCase classes """
+    page_sizes = (1, 100)
+
+    def request_action(self, viewset, action, user=None, query=None, **kwargs):
+        """ GETs a viewset action, returning the response and the SQL it ran """
+        request = APIRequestFactory().get("/", query or {})
+        if user is not None:
+            force_authenticate(request, user)
+        view = viewset.as_view({"get": action})
+        with capture_queries() as queries:
+            response = view(request, **kwargs)
+            response.render()
+        self.assertEqual(response.status_code, 200, "{} {}: {}".format(
+            viewset.__name__, action, getattr(response, "data", response.content)))
+        return response, queries
+
+    def assertWithinBudget(self, viewset, action, queries):
+        budget = viewset.query_budgets[action]
+        self.assertLessEqual(len(queries), budget, "{} {} made {} queries, over its budget "
+                             "of {}:\n{}".format(viewset.__name__, action, len(queries), budget,
+                                                 "\n".join(queries)))
+
+    def assertActionWithinBudget(self, viewset, action, user=None, **kwargs):
+        response, queries = self.request_action(viewset, action, user, **kwargs)
+        self.assertWithinBudget(viewset, action, queries)
+
+    def assertListWithinBudget(self, viewset, user=None, **kwargs):
+        """ Asserts the list action's queries stay within budget and constant in the page size """
+        pages = []
+        for size in self.page_sizes:
+            response, queries = self.request_action(viewset, "list", user,
+                                                    query={"limit": size}, **kwargs)
+            self.assertEqual(len(response.data["results"]), size,
+                             "{} has too few rows to fill a page of {}".format(
+                                 viewset.__name__, size))
+            pages.append(queries)
+        first, last = pages[0], pages[-1]
+        self.assertEqual(len(first), len(last), "{} list made {} queries for {} row(s) but {} "
+                         "for {}:\n{}".format(viewset.__name__, len(first), self.page_sizes[0],
+                                              len(last), self.page_sizes[-1], "\n".join(last)))
+        self.assertWithinBudget(viewset, "list", last)
@@ -1,3 +1,1526 @@
-from django.test import TestCase
+import asyncio
+import csv
+import io
+import json
+import os
+import shutil
+import tempfile
+import time
+from contextlib import redirect_stdout
+from datetime import timedelta
+from unittest import mock
+
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.conf import settings
+from django.contrib.auth.hashers import PBKDF2PasswordHasher
+from django.core.management import call_command
+from django.db import connection, transaction
+from psycopg2 import OperationalError
+from psycopg2.extensions import (TRANSACTION_STATUS_ACTIVE, TRANSACTION_STATUS_IDLE,
+                                  TRANSACTION_STATUS_INTRANS)
+from django.db.models import F
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+from django.utils.http import http_date
+from PIL import Image
+
+from rest_framework.test import APIClient, APIRequestFactory, force_authenticate
+
+from api import authentication
+from api import benchmarks
+from api import cache
+from api import export
+from api.db import pool
+from api.db import router
+from api import images
+from api import models
+from api import pagination
+from api import tasks
+from api import throttling
+from api import views
+from api.testing import QueryBudgetMixin, capture_queries
+from thinkspace_api.asgi import WsgiToAsgi
+from thinkspace_api import urls
+
+###########
+# indexes #
+###########
+
+INDEXED_VIEWSETS = [
+    views.UserViewSet,
+    views.CourseViewSet,
+    views.ProjectViewSet,
+    views.ProjectCategoryViewSet,
+    views.ProjectTagViewSet,
+    views.ProjectCommentViewSet,
+    views.ProjectPostViewSet,
+]
+
+class IndexUsageTests(TestCase):
+    """
+    Every declared filter_fields/ordering_fields combination must be
+    answerable from an index, judged from the query plan of the test
+    database. On PostgreSQL sequential scans are disabled while planning, so
+    a "Seq Scan" left in the plan means no usable index exists; SQLite's
+    planner picks any usable index for the (empty) tables on its own.
+    """
+
+    def setUp(self):
+        if connection.vendor == "postgresql":
+            with connection.cursor() as cursor:
+                cursor.execute("SET enable_seqscan = off")
+
+    def tearDown(self):
+        if connection.vendor == "postgresql":
+            with connection.cursor() as cursor:
+                cursor.execute("RESET enable_seqscan")
+
+    def filter_lookup(self, model, field_name):
+        """ Returns an equality lookup on field_name and the column it hits """
+        field = model._meta.get_field(field_name)
+        if field.many_to_many:
+            return {field_name: 1}, field.m2m_reverse_name()
+        if field.is_relation:
+            return {field_name: 1}, field.column
+        return {field_name: "x"}, field.column
+
+    def assertUsesIndex(self, queryset, label, column=None, ordered=False):
+        """
+        Asserts the plan avoids full table scans, that `column` is matched by
+        an index condition, and (if `ordered`) that no sort step is needed.
+        """
+        plan = queryset.explain()
+        message = "{} is not indexed:\n{}".format(label, plan)
+        if connection.vendor == "postgresql":
+            full_scan, condition, sort = r"Seq Scan", r"Index Cond: .*\b{}\b", r"Sort Key"
+        else:
+            full_scan = r"(?m)\bSCAN (TABLE )?\w+\s*$"
+            condition, sort = r"SEARCH .*INDEX .*[( ]{}=", r"TEMP B-TREE"
+        self.assertNotRegex(plan, full_scan, message)
+        if column is not None:
+            self.assertRegex(plan, condition.format(column), message)
+        if ordered:
+            self.assertNotRegex(plan, sort, message)
+
+    def test_viewset_filters_and_orderings_use_indexes(self):
+        for viewset in INDEXED_VIEWSETS:
+            queryset = viewset.queryset.all()
+            model = queryset.model
+            filters = [None] + list(getattr(viewset, "filter_fields", []))
+            orderings = [None] + list(getattr(viewset, "ordering_fields", []))
+            for filter_field in filters:
+                for ordering in orderings:
+                    if filter_field is None and ordering is None:
+                        continue
+                    combination, column = queryset, None
+                    if filter_field is not None:
+                        lookup, column = self.filter_lookup(model, filter_field)
+                        combination = combination.filter(**lookup)
+                    if ordering is not None:
+                        combination = combination.order_by("-" + ordering)
+                    label = "{} filter={} ordering={}".format(
+                        viewset.__name__, filter_field, ordering)
+                    with self.subTest(label):
+                        self.assertUsesIndex(combination[:100], label, column=column,
+                                             ordered=filter_field is None)
+
+    def test_join_request_lookups_use_indexes(self):
+        queryset = models.ProjectJoinRequest.objects.filter(project=1)
+        self.assertUsesIndex(queryset.filter(user=1), "join request by project and user",
+                             column="user_id")
+        self.assertUsesIndex(queryset.order_by("-timestamp", "-id")[:100],
+                             "join requests by project, newest first", column="project_id")
+
+    def test_keyset_seek_starts_at_the_cursor(self):
+        for queryset in [models.Project.objects.all(),
+                         models.ProjectComment.objects.filter(project=1),
+                         models.FeedEntry.objects.filter(user=1)]:
+            queryset = pagination.seek(queryset.order_by("-timestamp", "-pk"), timezone.now(), 1)
+            label = "{} keyset seek".format(queryset.model.__name__)
+            self.assertUsesIndex(queryset[:100], label)
+            # the index scan is bounded by the cursor
+            if connection.vendor == "postgresql":
+                bound = r'Index Cond: .*"?timestamp"? <= '
+            else:
+                bound = r"SEARCH .*INDEX .*timestamp<"
+            self.assertRegex(queryset[:100].explain(), bound, label)
+
+#################
+# query budgets #
+#################
+
+BUDGETED_VIEWSETS = INDEXED_VIEWSETS + [views.ProjectJoinRequestViewSet]
+
+# cached responses would skip the queries being counted
+@override_settings(API_CACHE_ENABLED=False)
+class QueryBudgetTests(QueryBudgetMixin, TestCase):
+    """
+    Every viewset action stays within its query_budgets, and list pages cost
+    the same number of queries whatever their size.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        # enough rows of everything to fill a page of 100
+        sizes = dict.fromkeys(benchmarks.SIZES, 110)
+        with redirect_stdout(io.StringIO()):
+            benchmarks.seed(sizes, log=lambda *args: None)
+        cls.user = models.User.objects.order_by("pk").first()
+        cls.project = models.Project.objects.order_by("pk").first()
+        # join requests are only open to the members of their project
+        cls.project.members.add(cls.user)
+        # pages with a private post also look up the reader's project roles,
+        # so every page, even of one post, does the same work
+        models.ProjectPost.objects.update(private=True)
+        models.ProjectJoinRequest.objects.bulk_create([
+            models.ProjectJoinRequest(project=cls.project, user_id=pk, request="join")
+            for pk in models.User.objects.values_list("pk", flat=True)[:100]])
+        # the first read of a model's version also creates it; read from the
+        # table, not from what earlier tests left in the cache
+        cache.get_cache().clear()
+        for viewset in BUDGETED_VIEWSETS:
+            cache.get_versions(viewset.cache_dependencies)
+
+    def get_kwargs(self, viewset):
+        if viewset is views.ProjectJoinRequestViewSet:
+            return {"project_pk": self.project.pk}
+        return {}
+
+    def get_object_pk(self, viewset):
+        # some actions (the user feed) are only open to the user themselves
+        if viewset.queryset.model is models.User:
+            return self.user.pk
+        queryset = viewset.queryset
+        if viewset is views.ProjectJoinRequestViewSet:
+            queryset = queryset.filter(project=self.project)
+        return queryset.order_by("pk")[0].pk
+
+    def test_seed_fills_the_feeds(self):
+        # so that the feed is measured with entries in it
+        post = models.ProjectPost.objects.exclude(project__memberships=None).first()
+        recipients = set(models.ProjectMembership.objects.filter(project=post.project_id)
+                         .values_list("user_id", flat=True))
+        self.assertEqual(set(post.feed_entries.values_list("user_id", flat=True)), recipients)
+        self.assertTrue(models.FeedEntry.objects.filter(kind=models.FeedEntry.COMMENT).exists())
+
+    @override_settings(API_CACHE_ENABLED=True)
+    def test_benchmarks_measure_anonymous_reads(self):
+        names = [name for name, _, _ in benchmarks.get_endpoints(urls.router, self.user)]
+        self.assertIn("join_requests list", names)
+        results = benchmarks.run(urls.router, iterations=1, only="user_courses list",
+                                 log=lambda *args: None)
+        self.assertEqual(sorted(results), ["user_courses list", "user_courses list (anonymous)"])
+        # served from the response cache
+        self.assertEqual(results["user_courses list (anonymous)"]["queries"], 0)
+        self.assertGreater(results["user_courses list"]["queries"], 0)
+
+    def test_viewsets_declare_budgets(self):
+        for viewset in BUDGETED_VIEWSETS:
+            with self.subTest(viewset.__name__):
+                self.assertIn("list", viewset.query_budgets)
+                self.assertIn("retrieve", viewset.query_budgets)
+
+    def test_list_queries_are_constant(self):
+        for viewset in BUDGETED_VIEWSETS:
+            readers = [self.user] if viewset is views.ProjectJoinRequestViewSet else [None, self.user]
+            for user in readers:
+                with self.subTest(viewset.__name__, authenticated=user is not None):
+                    self.assertListWithinBudget(viewset, user, **self.get_kwargs(viewset))
+
+    def test_detail_actions_within_budget(self):
+        for viewset in BUDGETED_VIEWSETS:
+            kwargs = dict(self.get_kwargs(viewset), pk=self.get_object_pk(viewset))
+            for action in viewset.query_budgets:
+                if action == "list":
+                    continue
+                with self.subTest(viewset.__name__, action=action):
+                    self.assertActionWithinBudget(viewset, action, self.user, **kwargs)
+
+##########
+# hearts #
+##########
+
+# transactions commit, so that cache versions move
+class HeartTests(TransactionTestCase):
+    """ The heart endpoints keep the relation and its counter in step """
+
+    def setUp(self):
+        self.fan = models.User.objects.create(username="fan")
+        self.user = models.User.objects.create(username="hearted")
+        category = models.ProjectCategory.objects.create(name="category")
+        self.project = models.Project.objects.create(name="project", description="",
+                                                     category=category)
+        self.client = APIClient()
+        self.client.force_authenticate(self.fan)
+
+    def heart(self, path, query=""):
+        response = self.client.get(path + query)
+        self.assertEqual(response.status_code, 200, response.data)
+        return response.data["hearts"]
+
+    def test_toggle_moves_the_counter(self):
+        path = "/users/{}/heart/".format(self.user.pk)
+        self.assertEqual(self.heart(path), 1)
+        self.assertTrue(self.user.hearted_by.filter(pk=self.fan.pk).exists())
+        self.assertEqual(self.heart(path), 0)
+        self.assertFalse(self.user.hearted_by.filter(pk=self.fan.pk).exists())
+
+    def test_explicit_intent_is_idempotent(self):
+        path = "/projects/{}/heart/".format(self.project.pk)
+        self.assertEqual(self.heart(path, "?hearted=true"), 1)
+        self.assertEqual(self.heart(path, "?hearted=true"), 1)
+        self.assertEqual(self.project.hearted_by.count(), 1)
+        self.assertEqual(self.heart(path, "?hearted=false"), 0)
+        self.assertEqual(self.heart(path, "?hearted=false"), 0)
+        self.assertEqual(self.project.hearted_by.count(), 0)
+
+    def test_relations_are_prefetched_once(self):
+        # only for the response, not for the read before the toggle
+        for path, table in [("/users/{}/heart/".format(self.user.pk), '"api_user_courses"'),
+                            ("/projects/{}/heart/".format(self.project.pk), '"api_project_tags"')]:
+            with capture_queries() as queries:
+                self.heart(path)
+            self.assertEqual(len([sql for sql in queries if table in sql]), 1, "\n".join(queries))
+
+    def test_unknown_intent_is_refused(self):
+        response = self.client.get("/projects/{}/heart/?hearted=maybe".format(self.project.pk))
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(models.Project.objects.get(pk=self.project.pk).hearts, 0)
+
+    def test_reconcile_fixes_drift_and_invalidates_cache(self):
+        self.user.toggle_heart(self.fan)
+        models.User.objects.filter(pk=self.user.pk).update(hearts=7)
+        models.Project.objects.filter(pk=self.project.pk).update(hearts=3)
+        versions = cache.get_versions([models.User, models.Project])
+        call_command("reconcile_hearts", stdout=io.StringIO())
+        self.assertEqual(models.User.objects.get(pk=self.user.pk).hearts, 1)
+        self.assertEqual(models.Project.objects.get(pk=self.project.pk).hearts, 0)
+        for old, new in zip(versions, cache.get_versions([models.User, models.Project])):
+            self.assertNotEqual(old, new)
+
+##############
+# pagination #
+##############
+
+class KeysetPaginationTests(TestCase):
+    """ ?cursor= pages of projects, newest first """
+
+    @classmethod
+    def setUpTestData(cls):
+        category = models.ProjectCategory.objects.create(name="category")
+        now = timezone.now()
+        for index in range(7):
+            project = models.Project.objects.create(name="p{}".format(index), description="",
+                                                    category=category)
+            # two pairs share a timestamp, which the id breaks ties of
+            models.Project.objects.filter(pk=project.pk).update(
+                timestamp=now - timedelta(minutes=index // 2 * 2))
+        cls.expected = list(models.Project.objects.order_by("-timestamp", "-pk")
+                            .values_list("pk", flat=True))
+
+    def get_page(self, url):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200, response.content)
+        return [project["id"] for project in response.data["results"]], response.data["next"]
+
+    def test_cursor_round_trip(self):
+        seen, url = [], "/projects/?cursor=&limit=2"
+        while url is not None:
+            ids, url = self.get_page(url)
+            self.assertLessEqual(len(ids), 2)
+            seen.extend(ids)
+        self.assertEqual(seen, self.expected)
+
+    def test_pages_are_stable_across_inserts(self):
+        ids, url = self.get_page("/projects/?cursor=&limit=3")
+        self.assertEqual(ids, self.expected[:3])
+        models.Project.objects.create(name="new", description="",
+                                      category=models.ProjectCategory.objects.get())
+        ids, url = self.get_page(url)
+        self.assertEqual(ids, self.expected[3:6])
+
+    def test_invalid_cursor(self):
+        self.assertEqual(self.client.get("/projects/?cursor=nonsense").status_code, 404)
+
+    def test_ordering_is_refused(self):
+        response = self.client.get("/projects/?cursor=&ordering=-hearts")
+        self.assertEqual(response.status_code, 400)
+        # offset pages still honour it
+        self.assertEqual(self.client.get("/projects/?ordering=-hearts").status_code, 200)
+
+##########
+# search #
+##########
+
+class SearchTests(TestCase):
+    """ ?search= with full-text ranking on PostgreSQL and substring matching elsewhere """
+
+    @classmethod
+    def setUpTestData(cls):
+        category = models.ProjectCategory.objects.create(name="category")
+        now = timezone.now()
+        cls.projects = {}
+        for index, (name, description) in enumerate([
+                # the newest project is the less relevant one
+                ("Garden", "Watering plants, with the help of some robots"),
+                ("Robots", "Robots that build robots, robots everywhere"),
+                ("Library", "Books and reading")]):
+            project = models.Project.objects.create(name=name, description=description,
+                                                    category=category)
+            models.Project.objects.filter(pk=project.pk).update(
+                timestamp=now - timedelta(days=index))
+            cls.projects[name] = project.pk
+        models.Course.objects.create(code="CS101", name="Introduction to programming")
+        models.Course.objects.create(code="HIST200", name="Modern history")
+
+    def search(self, path):
+        response = self.client.get(path)
+        self.assertEqual(response.status_code, 200, response.content)
+        key = "code" if path.startswith("/user_courses/") else "name"
+        return [item[key] for item in response.data["results"]]
+
+    def test_substring_matching(self):
+        self.assertEqual(self.search("/user_courses/?search=troduct"), ["CS101"])
+        if connection.vendor != "postgresql":
+            # the fallback keeps SearchFilter's icontains matching
+            self.assertEqual(self.search("/projects/?search=obot"), ["Garden", "Robots"])
+            self.assertEqual(self.search("/projects/?search=READING"), ["Library"])
+
+    def test_full_text_matching(self):
+        self.assertEqual(sorted(self.search("/projects/?search=robots")), ["Garden", "Robots"])
+        self.assertEqual(self.search("/projects/?search=submarine"), [])
+
+    def test_ordering_overrides_ranking(self):
+        # ranked by relevance on PostgreSQL, newest first otherwise
+        ranked = ["Robots", "Garden"] if connection.vendor == "postgresql" else ["Garden", "Robots"]
+        self.assertEqual(self.search("/projects/?search=robots"), ranked)
+        self.assertEqual(self.search("/projects/?search=robots&ordering=timestamp"),
+                         ["Robots", "Garden"])
+        self.assertEqual(self.search("/projects/?search=robots&ordering=-timestamp"),
+                         ["Garden", "Robots"])
+
+#################
+# sparse fields #
+#################
+
+@override_settings(API_CACHE_ENABLED=False)
+class SparseFieldsTests(TestCase):
+    """ ?fields= and ?expand= pick what a read renders, and so what it loads """
+
+    @classmethod
+    def setUpTestData(cls):
+        course = models.Course.objects.create(code="CS101", name="Intro")
+        cls.user = models.User.objects.create(username="ada")
+        cls.user.courses.add(course)
+        category = models.ProjectCategory.objects.create(name="category")
+        cls.project = models.Project.objects.create(name="project", description="",
+                                                    category=category)
+        cls.tag = models.ProjectTag.objects.create(name="tag")
+        cls.project.tags.add(cls.tag)
+        cls.project.members.add(cls.user)
+
+    def get_result(self, path):
+        response = self.client.get(path)
+        self.assertEqual(response.status_code, 200, response.data)
+        return response.data["results"][0]
+
+    def test_fields(self):
+        self.assertEqual(set(self.get_result("/users/?fields=id,username")), {"id", "username"})
+        self.assertEqual(set(self.get_result("/users/?fields=id&expand=courses")), {"id", "courses"})
+
+    def test_unknown_names_are_rejected(self):
+        for query in ["fields=bogus", "fields=id,bogus", "expand=bogus", "expand=username"]:
+            response = self.client.get("/users/?" + query)
+            self.assertEqual(response.status_code, 400, query)
+
+    def test_expand_picks_every_many_relation(self):
+        user = self.get_result("/users/?expand=courses")
+        self.assertEqual(user["courses"], [self.user.courses.get().pk])
+        for name in ["member_projects", "hearted_users", "site_roles"]:
+            self.assertNotIn(name, user)
+        self.assertIn("username", user)
+
+        project = self.get_result("/projects/?expand=")
+        for name in ["tags", "members", "leaders", "hearted_by", "posts"]:
+            self.assertNotIn(name, project)
+        project = self.get_result("/projects/?expand=tags")
+        self.assertEqual(project["tags"], [self.tag.pk])
+        self.assertNotIn("members", project)
+
+    def test_unexpanded_relations_are_not_loaded(self):
+        with capture_queries() as full:
+            self.get_result("/projects/")
+        with capture_queries() as bare:
+            self.get_result("/projects/?expand=")
+        self.assertLess(len(bare), len(full))
+        self.assertTrue(any("api_project_tags" in sql for sql in full))
+        self.assertFalse(any("api_project_tags" in sql for sql in bare))
+
+##################
+# project routes #
+##################
+
+class ProjectRouteTests(TestCase):
+    """ Categories, comments, posts and join requests of projects """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.leader = models.User.objects.create(username="leader")
+        cls.outsider = models.User.objects.create(username="outsider")
+        cls.category = models.ProjectCategory.objects.create(name="category")
+        cls.project = models.Project.objects.create(name="project", description="",
+                                                    category=cls.category)
+        cls.project.leaders.add(cls.leader)
+        cls.join_request = models.ProjectJoinRequest.objects.create(
+            project=cls.project, user=cls.outsider, request="let me in")
+
+    def test_routes(self):
+        for path in ["/project_categories/", "/project_comments/?cursor=", "/project_posts/?cursor="]:
+            self.assertEqual(self.client.get(path).status_code, 200, path)
+
+    def test_join_requests_are_only_open_to_the_project(self):
+        path = "/projects/{}/join_requests/".format(self.project.pk)
+        detail = "{}{}/".format(path, self.join_request.pk)
+        self.assertEqual(self.client.get(path).status_code, 403)
+        client = APIClient()
+        client.force_authenticate(self.outsider)
+        self.assertEqual(client.get(detail).status_code, 403)
+        client.force_authenticate(self.leader)
+        response = client.get(path + "?cursor=")
+        self.assertEqual([item["id"] for item in response.data["results"]], [self.join_request.pk])
+        self.assertEqual(client.get(detail).status_code, 200)
+
+    def test_comments_are_written_as_the_requesting_user(self):
+        client = APIClient()
+        client.force_authenticate(self.outsider)
+        response = client.post("/project_comments/", {
+            "project": self.project.pk, "comment": "nice", "user": self.leader.pk})
+        self.assertEqual(response.status_code, 201, response.data)
+        self.assertEqual(models.ProjectComment.objects.get().user, self.outsider)
+
+    def test_only_leaders_post_to_a_project(self):
+        client = APIClient()
+        for user, status_code in [(self.outsider, 400), (self.leader, 201)]:
+            client.force_authenticate(user)
+            response = client.post("/project_posts/", {"project": self.project.pk, "post": "news"})
+            self.assertEqual(response.status_code, status_code, response.data)
+        self.assertEqual(models.ProjectPost.objects.count(), 1)
+
+###################
+# response caches #
+###################
+
+class ResponseCacheTests(TransactionTestCase):
+    """ Anonymous reads are cached until a write to their models commits """
+
+    def setUp(self):
+        cache.get_cache().clear()
+        self.course = models.Course.objects.create(code="CS101", name="Intro")
+
+    def get_names(self):
+        response = self.client.get("/user_courses/")
+        self.assertEqual(response.status_code, 200)
+        return [course["name"] for course in response.data["results"]]
+
+    def test_writes_invalidate_cached_responses(self):
+        self.assertEqual(self.get_names(), ["Intro"])
+        # update() sends no signals, so the cached response is served
+        models.Course.objects.update(name="Updated")
+        self.assertEqual(self.get_names(), ["Intro"])
+        self.course.refresh_from_db()
+        self.course.save()
+        self.assertEqual(self.get_names(), ["Updated"])
+        self.course.delete()
+        self.assertEqual(self.get_names(), [])
+
+    def test_m2m_changes_bump_both_sides(self):
+        user = models.User.objects.create(username="student")
+        before = cache.get_versions([models.User, models.Course])
+        user.courses.add(self.course)
+        after = cache.get_versions([models.User, models.Course])
+        self.assertGreater(after[0], before[0])
+        self.assertGreater(after[1], before[1])
+
+    def test_versions_move_on_commit(self):
+        before = cache.get_versions([models.Course])
+        with transaction.atomic():
+            self.course.save()
+            # a read before the commit must not be stored under a new version
+            self.assertEqual(cache.get_versions([models.Course]), before)
+        self.assertGreater(cache.get_versions([models.Course])[0], before[0])
+
+    def test_rolled_back_writes_keep_versions(self):
+        before = cache.get_versions([models.Course])
+        try:
+            with transaction.atomic():
+                self.course.save()
+                raise ValueError
+        except ValueError:
+            pass
+        self.assertEqual(cache.get_versions([models.Course]), before)
+
+    def test_versions_are_shared_through_the_database(self):
+        self.assertEqual(self.get_names(), ["Intro"])
+        models.Course.objects.update(name="Updated")
+        # another process bumping the version, as seen from this one
+        cache.write_versions([cache.version_label(models.Course)])
+        self.assertEqual(self.get_names(), ["Updated"])
+
+    def test_cached_reads_run_no_queries(self):
+        for path in ["/user_courses/", "/user_courses/{}/".format(self.course.pk)]:
+            self.client.get(path)
+            with capture_queries() as queries:
+                self.assertEqual(self.client.get(path).status_code, 200)
+            self.assertEqual(queries, [])
+
+    def test_lost_versions_are_read_from_the_database(self):
+        before = cache.get_versions([models.Course])
+        cache.get_cache().clear()
+        self.assertEqual(cache.get_versions([models.Course]), before)
+        self.course.save()
+        cache.get_cache().clear()
+        self.assertGreater(cache.get_versions([models.Course])[0], before[0])
+
+    @override_settings(API_CACHE_VERSIONS=False)
+    def test_versions_can_be_kept_out_of_the_cache(self):
+        before = cache.get_versions([models.Course])
+        models.ModelVersion.objects.update(version=F("version") + 1)
+        self.assertEqual(cache.get_versions([models.Course]), [before[0] + 1])
+
+    def test_versions_never_move_backwards(self):
+        label = cache.version_label(models.Course)
+        models.ModelVersion.objects.update_or_create(model=label, defaults={"version": 4e9})
+        cache.write_versions([label])
+        self.assertGreater(cache.get_versions([models.Course])[0], 4e9)
+
+###################
+# conditional GET #
+###################
+
+class ConditionalGetTests(TransactionTestCase):
+    """ ETag and Last-Modified validators, and the 304s they allow """
+
+    def setUp(self):
+        cache.get_cache().clear()
+        self.course = models.Course.objects.create(code="CS101", name="Intro")
+        self.path = "/user_courses/{}/".format(self.course.pk)
+
+    def age(self, seconds):
+        """ Moves every write the course responses depend on `seconds` into the past """
+        past = time.time() - seconds
+        models.ModelVersion.objects.update(version=past)
+        # for the versions kept in the cache to be read from the table again
+        cache.get_cache().clear()
+        return int(past)
+
+    def test_if_none_match(self):
+        for path in ["/user_courses/", self.path]:
+            response = self.client.get(path)
+            etag = response["ETag"]
+            self.assertEqual(self.client.get(path, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+            self.course.save()
+            response = self.client.get(path, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, 200)
+            self.assertNotEqual(response["ETag"], etag)
+
+    def test_if_modified_since(self):
+        self.client.get(self.path)
+        past = self.age(60)
+        response = self.client.get(self.path)
+        self.assertEqual(response["Last-Modified"], http_date(past))
+        since = response["Last-Modified"]
+        self.assertEqual(self.client.get(self.path, HTTP_IF_MODIFIED_SINCE=since).status_code, 304)
+        self.course.save()
+        self.assertEqual(self.client.get(self.path, HTTP_IF_MODIFIED_SINCE=since).status_code, 200)
+
+    def test_no_last_modified_within_the_second_of_a_write(self):
+        # a second write within the same second would not move it
+        self.course.save()
+        response = self.client.get(self.path)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn("Last-Modified", response)
+        response = self.client.get(self.path, HTTP_IF_MODIFIED_SINCE=http_date(time.time() + 60))
+        self.assertEqual(response.status_code, 200)
+
+    def test_not_modified_without_finding_the_object(self):
+        etag = self.client.get(self.path)["ETag"]
+        with capture_queries() as queries:
+            response = self.client.get(self.path, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(queries, [])
+
+    def test_missing_object_is_not_found(self):
+        response = self.client.get("/user_courses/0/", HTTP_IF_NONE_MATCH="*")
+        self.assertEqual(response.status_code, 404)
+        response = self.client.get("/user_courses/0/", HTTP_IF_MODIFIED_SINCE=http_date(time.time()))
+        self.assertEqual(response.status_code, 404)
+
+    def test_permissions_are_checked_before_not_modified(self):
+        category = models.ProjectCategory.objects.create(name="category")
+        project = models.Project.objects.create(name="project", description="", category=category)
+        # the post's feed fan-out job would otherwise still be writing to
+        # SQLite once the next test starts
+        self.addCleanup(tasks.get_backend().join)
+        post = models.ProjectPost.objects.create(project=project, post="members only",
+                                                 private=True)
+        outsider = models.User.objects.create(username="outsider")
+        view = views.ProjectPostViewSet.as_view({"get": "retrieve"})
+        request = APIRequestFactory().get("/", HTTP_IF_NONE_MATCH="*")
+        force_authenticate(request, outsider)
+        self.assertEqual(view(request, pk=post.pk).status_code, 403)
+        project.members.add(outsider)
+        request = APIRequestFactory().get("/", HTTP_IF_NONE_MATCH="*")
+        force_authenticate(request, outsider)
+        self.assertEqual(view(request, pk=post.pk).status_code, 304)
+
+##########
+# images #
+##########
+
+class ImageUploadTests(TransactionTestCase):
+    """ Uploaded profile images: stripped metadata and their renditions """
+
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        settings = override_settings(MEDIA_ROOT=media_root, MEDIA_URL="/media/")
+        settings.enable()
+        self.addCleanup(settings.disable)
+        cache.get_cache().clear()
+
+    def upload(self):
+        """ A 40x20 JPEG taken with the camera turned, with its GPS position """
+        exif = Image.Exif()
+        exif[0x0112] = 6  # orientation: rotated 90 degrees
+        exif[0x8825] = {1: "N", 2: (41.0, 18.0, 59.0)}
+        output = io.BytesIO()
+        Image.new("RGB", (40, 20), (255, 0, 0)).save(output, "JPEG", exif=exif.tobytes())
+        return SimpleUploadedFile("photo.jpg", output.getvalue(), "image/jpeg")
+
+    def test_metadata_is_stripped_before_storing(self):
+        user = models.User.objects.create(username="photographer", image=self.upload())
+        tasks.get_backend().join()
+        with user.image.storage.open(user.image.name) as stored:
+            image = Image.open(stored)
+            self.assertEqual(image.size, (20, 40))
+            self.assertNotIn("exif", image.info)
+            self.assertEqual(dict(image.getexif()), {})
+
+    def patch_image(self, user, upload):
+        client = APIClient()
+        client.force_authenticate(user)
+        return client.patch("/users/{}/".format(user.pk), {"image": upload}, format="multipart")
+
+    def test_uploads_through_the_api_are_stripped(self):
+        user = models.User.objects.create(username="photographer")
+        self.assertEqual(self.patch_image(user, self.upload()).status_code, 200)
+        tasks.get_backend().join()
+        user.refresh_from_db()
+        with user.image.storage.open(user.image.name) as stored:
+            image = Image.open(stored)
+            self.assertEqual(image.size, (20, 40))
+            self.assertNotIn("exif", image.info)
+
+    def test_broken_uploads_are_rejected(self):
+        user = models.User.objects.create(username="photographer")
+        output = io.BytesIO()
+        Image.effect_noise((200, 200), 50).save(output, "JPEG")
+        # whole headers, so only decoding the pixels finds it broken
+        truncated = SimpleUploadedFile("photo.jpg", output.getvalue()[:-1000], "image/jpeg")
+        response = self.patch_image(user, truncated)
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("too large", response.data["image"][0])
+        with mock.patch.object(Image, "MAX_IMAGE_PIXELS", 100):
+            self.assertEqual(self.patch_image(user, self.upload()).status_code, 400)
+        user.refresh_from_db()
+        self.assertFalse(user.image)
+
+    def test_renditions_are_only_reported_once_stored(self):
+        user = models.User.objects.create(username="photographer", image=self.upload())
+        tasks.get_backend().join()
+        path = "/users/{}/".format(user.pk)
+        response = self.client.get(path)
+        for rendition, _ in images.RENDITIONS:
+            name = images.rendition_name(user.image.name, rendition)
+            self.assertTrue(user.image.storage.exists(name))
+            self.assertTrue(response.data["image_renditions"][rendition].endswith(name))
+
+        # as before the job ran
+        models.User.objects.filter(pk=user.pk).update(rendered_image="")
+        cache.get_cache().clear()
+        response = self.client.get(path)
+        for url in response.data["image_renditions"].values():
+            self.assertTrue(response.data["image"].endswith(url))
+
+#########
+# tasks #
+#########
+
+calls = []
+
+@tasks.task(max_attempts=2)
+def flaky_task(key, fail_first=False):
+    calls.append(key)
+    if fail_first and calls.count(key) == 1:
+        raise ValueError("first attempt fails")
+
+class ManualTimer(object):
+    """ A threading.Timer that only fires when the test says so """
+    started = []
+
+    def __init__(self, interval, function, args=()):
+        self.interval, self.function, self.args = interval, function, args
+        self.daemon = False
+
+    def start(self):
+        self.started.append(self)
+
+    def fire(self):
+        self.function(*self.args)
+
+class ThreadPoolBackendTests(TestCase):
+    """ Retries back off without holding one of the pool's threads """
+
+    @override_settings(API_TASK_WORKERS=1)
+    def test_retry_does_not_block_the_pool(self):
+        backend = tasks.ThreadPoolBackend()
+        backend.timer_class = ManualTimer
+        self.addCleanup(backend.executor.shutdown)
+        del calls[:]
+        del ManualTimer.started[:]
+        with mock.patch.object(tasks, "logger"):
+            backend.submit(flaky_task.task_name, '[["flaky", true], {}]',
+                           flaky_task.max_attempts)
+            backend.join()
+            # the only thread is free while the retry waits
+            backend.submit(flaky_task.task_name, '[["other"], {}]', flaky_task.max_attempts)
+            backend.join()
+            self.assertEqual(calls, ["flaky", "other"])
+            [timer] = ManualTimer.started
+            self.assertEqual(timer.interval, tasks.retry_delay(1))
+            self.assertTrue(timer.daemon)
+            timer.fire()
+            backend.join()
+        self.assertEqual(calls, ["flaky", "other", "flaky"])
+
+########
+# ASGI #
+########
+
+def echo_application(environ, start_response):
+    """ A WSGI application answering with its environ and request body in chunks """
+    start_response("201 Created", [("Content-Type", "text/plain"), ("X-Echo", "yes")])
+    yield environ["wsgi.input"].read(int(environ["CONTENT_LENGTH"]))
+    for name in ["REQUEST_METHOD", "PATH_INFO", "QUERY_STRING", "CONTENT_TYPE",
+                 "HTTP_ACCEPT", "HTTP_COOKIE"]:
+        yield "|{}={}".format(name, environ.get(name, "")).encode("latin-1")
+
+class AsgiAdapterTests(TestCase):
+    """ The WSGI application served over ASGI by thinkspace_api/asgi.py """
+
+    def setUp(self):
+        self.adapter = WsgiToAsgi(echo_application, max_threads=2)
+        self.addCleanup(self.adapter.executor.shutdown)
+
+    def call(self, scope, received):
+        """ Runs the adapter for `scope` with the `received` messages and returns those sent """
+        received = list(received)
+        sent = []
+
+        async def receive():
+            return received.pop(0)
+
+        async def send(message):
+            sent.append(message)
+
+        asyncio.run(self.adapter(scope, receive, send))
+        return sent
+
+    def test_request_and_response(self):
+        scope = {
+            "type": "http", "method": "POST", "path": "/caf\u00e9/", "query_string": b"a=1&b=2",
+            "headers": [(b"content-type", b"text/plain"), (b"accept", b"text/html"),
+                        (b"accept", b"*/*"), (b"cookie", b"a=1"), (b"cookie", b"b=2")],
+        }
+        sent = self.call(scope, [
+            {"type": "http.request", "body": b"hello ", "more_body": True},
+            {"type": "http.request", "body": b"world"},
+        ])
+        self.assertEqual(sent[0], {"type": "http.response.start", "status": 201, "headers": [
+            (b"content-type", b"text/plain"), (b"x-echo", b"yes")]})
+        self.assertTrue(all(message["more_body"] for message in sent[1:-1]))
+        self.assertEqual(sent[-1], {"type": "http.response.body", "body": b""})
+        body = b"".join(message["body"] for message in sent[1:]).decode("latin-1")
+        self.assertEqual(body.split("|"), [
+            "hello world", "REQUEST_METHOD=POST",
+            "PATH_INFO=/caf\u00e9/".encode("utf-8").decode("latin-1"),
+            "QUERY_STRING=a=1&b=2", "CONTENT_TYPE=text/plain",
+            "HTTP_ACCEPT=text/html,*/*", "HTTP_COOKIE=a=1; b=2",
+        ])
+
+    def test_disconnect_before_body(self):
+        scope = {"type": "http", "method": "POST", "path": "/", "headers": []}
+        sent = self.call(scope, [{"type": "http.request", "body": b"partial", "more_body": True},
+                                 {"type": "http.disconnect"}])
+        self.assertEqual(sent, [])
+
+    def test_response_stops_once_the_client_is_gone(self):
+        produced = []
+
+        def streaming_application(environ, start_response):
+            start_response("200 OK", [])
+            for chunk in range(1000):
+                produced.append(chunk)
+                yield b"chunk"
+
+        async def receive():
+            return {"type": "http.request", "body": b""}
+
+        async def send(message):
+            if message.get("body"):
+                raise OSError("connection reset")
+
+        adapter = WsgiToAsgi(streaming_application, max_threads=1)
+        self.addCleanup(adapter.executor.shutdown)
+        scope = {"type": "http", "method": "GET", "path": "/", "headers": []}
+        with self.assertRaises(OSError):
+            asyncio.run(adapter(scope, receive, send))
+        # only a bounded number of chunks was produced ahead of the client
+        self.assertLess(len(produced), 100)
+
+    def test_lifespan(self):
+        sent = self.call({"type": "lifespan"}, [{"type": "lifespan.startup"},
+                                                {"type": "lifespan.shutdown"}])
+        self.assertEqual(sent, [{"type": "lifespan.startup.complete"},
+                                {"type": "lifespan.shutdown.complete"}])
+
+###################
+# connection pool #
+###################
+
+class FakeConnection(object):
+    """ Stands in for a psycopg2 connection """
+
+    def __init__(self):
+        self.closed = False
+        self.autocommit = True
+        self.status = TRANSACTION_STATUS_IDLE
+        self.broken = False
+        self.rollbacks = 0
+
+    def get_transaction_status(self):
+        return self.status
+
+    def rollback(self):
+        self.rollbacks += 1
+        self.status = TRANSACTION_STATUS_IDLE
+
+    def cursor(self):
+        if self.broken:
+            raise OperationalError("server closed the connection unexpectedly")
+        return mock.MagicMock()
+
+    def close(self):
+        self.closed = True
+
+class ConnectionPoolTests(TestCase):
+    """ Checking connections out of and back into the per-process pool """
+
+    def get_pool(self, **options):
+        options = dict({"max_size": 2, "max_lifetime": 60, "wait_timeout": 1, "pre_ping": True},
+                       **options)
+        return pool.ConnectionPool(database="test", **options)
+
+    def test_connections_are_reused(self):
+        connections = self.get_pool()
+        first = connections.acquire(FakeConnection)
+        second = connections.acquire(FakeConnection)
+        self.assertIsNot(first, second)
+        connections.release(first)
+        self.assertIs(connections.acquire(FakeConnection), first)
+        stats = connections.stats()
+        self.assertEqual((stats["opened"], stats["checkouts"], stats["in_use"]), (2, 3, 2))
+
+    def test_waits_for_a_free_connection_up_to_the_timeout(self):
+        connections = self.get_pool(max_size=1, wait_timeout=0.01)
+        connections.acquire(FakeConnection)
+        with self.assertRaises(pool.PoolTimeout):
+            connections.acquire(FakeConnection)
+        self.assertEqual(connections.stats()["timeouts"], 1)
+        self.assertEqual(connections.size, 1)
+
+    def test_connections_past_their_lifetime_are_closed(self):
+        connections = self.get_pool()
+        first = connections.acquire(FakeConnection)
+        connections.release(first)
+        connections.idle[0].created_at -= 61
+        second = connections.acquire(FakeConnection)
+        self.assertIsNot(second, first)
+        self.assertTrue(first.closed)
+        self.assertEqual(connections.size, 1)
+
+    def test_connections_failing_the_ping_are_replaced(self):
+        connections = self.get_pool()
+        first = connections.acquire(FakeConnection)
+        connections.release(first)
+        first.broken = True
+        second = connections.acquire(FakeConnection)
+        self.assertIsNot(second, first)
+        self.assertTrue(first.closed)
+        stats = connections.stats()
+        self.assertEqual((stats["ping_failures"], stats["size"]), (1, 1))
+
+    def test_returned_connections_are_reset(self):
+        connections = self.get_pool()
+        first = connections.acquire(FakeConnection)
+        first.status, first.autocommit = TRANSACTION_STATUS_INTRANS, False
+        connections.release(first)
+        self.assertEqual((first.rollbacks, first.autocommit, first.closed), (1, True, False))
+        self.assertIs(connections.acquire(FakeConnection), first)
+
+        # a connection still running a query is not handed out again
+        first.status = TRANSACTION_STATUS_ACTIVE
+        connections.release(first)
+        self.assertTrue(first.closed)
+        self.assertEqual(connections.size, 0)
+
+#################
+# read replicas #
+#################
+
+class ReplicaRouterTests(TransactionTestCase):
+    """ Reads stay on the primary while a replica may miss a recent write """
+
+    def setUp(self):
+        cache.get_cache().clear()
+        self.course = models.Course.objects.create(code="CS101", name="Intro")
+
+    def needs_primary(self, user=None):
+        request = APIRequestFactory().get("/user_courses/")
+        if user is not None:
+            force_authenticate(request, user)
+        view = views.CourseViewSet(action_map={"get": "list"})
+        return view.needs_primary(view.initialize_request(request))
+
+    def test_recent_writes_to_the_view_models(self):
+        self.assertTrue(self.needs_primary())
+        models.ModelVersion.objects.update(version=time.time() - 60)
+        cache.get_cache().clear()
+        self.assertFalse(self.needs_primary())
+
+    def test_recent_writes_by_the_user(self):
+        models.ModelVersion.objects.update(version=time.time() - 60)
+        cache.get_cache().clear()
+        user = models.User.objects.create(username="writer")
+        self.assertFalse(self.needs_primary(user))
+        cache.get_cache().set(router.pin_key(user), True)
+        self.assertTrue(self.needs_primary(user))
+
+#########
+# feeds #
+#########
+
+class FeedTests(TestCase):
+    """ New posts and comments reach their project's members, and only they can read them """
+
+    def setUp(self):
+        # jobs wait in the Job table until run_jobs(), in this thread
+        self.backend = tasks.DatabaseBackend()
+        patcher = mock.patch.object(tasks, "_backend", self.backend)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        category = models.ProjectCategory.objects.create(name="category")
+        self.project = models.Project.objects.create(name="project", description="",
+                                                     category=category)
+        self.member = models.User.objects.create(username="member")
+        self.leader = models.User.objects.create(username="leader")
+        self.outsider = models.User.objects.create(username="outsider")
+        self.project.members.add(self.member)
+        self.project.leaders.add(self.leader)
+
+    def get(self, path, user=None):
+        client = APIClient()
+        if user is not None:
+            client.force_authenticate(user)
+        return client.get(path)
+
+    def run_jobs(self):
+        for job in self.backend.claim(10, 60):
+            self.backend.run(job)
+
+    def feed_users(self, **source):
+        return sorted(models.FeedEntry.objects.filter(**source).values_list("user_id", flat=True))
+
+    def test_new_posts_and_comments_are_fanned_out(self):
+        post = models.ProjectPost.objects.create(project=self.project, post="news")
+        client = APIClient()
+        client.force_authenticate(self.outsider)
+        response = client.post("/project_comments/", {"project": self.project.pk,
+                                                       "comment": "hello"})
+        self.assertEqual(response.status_code, 201, response.data)
+        self.assertEqual(self.feed_users(), [])
+        self.run_jobs()
+
+        members = sorted([self.member.pk, self.leader.pk])
+        self.assertEqual(self.feed_users(post=post), members)
+        self.assertEqual(self.feed_users(comment=response.data["id"]), members)
+        self.assertEqual(self.feed_users(user=self.outsider), [])
+        feed = self.get("/users/{}/feed/".format(self.member.pk), self.member)
+        self.assertEqual(feed.status_code, 200)
+        self.assertEqual(sorted(entry["kind"] for entry in feed.data["results"]),
+                         ["comment", "post"])
+
+    def test_only_the_user_reads_their_feed_and_projects(self):
+        for path in ["/users/{}/feed/", "/users/{}/projects/"]:
+            path = path.format(self.member.pk)
+            self.assertEqual(self.get(path, self.member).status_code, 200)
+            self.assertEqual(self.get(path, self.outsider).status_code, 403)
+            self.assertEqual(self.get(path).status_code, 403)
+        projects = self.get("/users/{}/projects/".format(self.member.pk), self.member)
+        self.assertEqual([project["id"] for project in projects.data["results"]],
+                         [self.project.pk])
+
+###############
+# bulk writes #
+###############
+
+class BulkWriteTests(TestCase):
+    """ The /bulk/ endpoints of courses and project tags """
+
+    def setUp(self):
+        self.staff = models.User.objects.create(username="staff", is_staff=True)
+        self.leader = models.User.objects.create(username="leader")
+        category = models.ProjectCategory.objects.create(name="category")
+        self.led = models.Project.objects.create(name="led", description="", category=category)
+        self.other = models.Project.objects.create(name="other", description="", category=category)
+        self.led.leaders.add(self.leader)
+        self.client = APIClient()
+
+    def bulk(self, method, path, items, user):
+        self.client.force_authenticate(user)
+        return getattr(self.client, method)(path, items, format="json")
+
+    def test_create(self):
+        response = self.bulk("post", "/project_tags/bulk/", [
+            {"name": "robots", "projects": [self.led.pk]}, {"name": "art", "projects": []},
+        ], self.leader)
+        self.assertEqual(response.status_code, 201, response.data)
+        self.assertEqual([tag["name"] for tag in response.data], ["robots", "art"])
+        self.assertEqual(list(self.led.tags.values_list("name", flat=True)), ["robots"])
+
+    def test_update(self):
+        first = models.ProjectTag.objects.create(name="first")
+        second = models.ProjectTag.objects.create(name="second")
+        first.projects.add(self.other)
+        response = self.bulk("patch", "/project_tags/bulk/", [
+            {"id": first.pk, "name": "renamed", "projects": [self.led.pk]},
+            {"id": second.pk, "projects": [self.led.pk, self.other.pk]},
+        ], self.staff)
+        self.assertEqual(response.status_code, 200, response.data)
+        first.refresh_from_db()
+        self.assertEqual(first.name, "renamed")
+        self.assertEqual(list(first.projects.all()), [self.led])
+        self.assertEqual(set(second.projects.all()), {self.led, self.other})
+
+    def test_destroy(self):
+        models.ProjectTag.objects.bulk_create(
+            [models.ProjectTag(name="a"), models.ProjectTag(name="b")])
+        ids = list(models.ProjectTag.objects.values_list("pk", flat=True))
+        response = self.bulk("delete", "/project_tags/bulk/", ids, self.staff)
+        self.assertEqual(response.status_code, 204)
+        self.assertFalse(models.ProjectTag.objects.exists())
+
+    def test_errors_are_reported_per_item_and_nothing_is_written(self):
+        course = models.Course.objects.create(code="CS101", name="Intro")
+        response = self.bulk("patch", "/user_courses/bulk/", [
+            {"id": course.pk, "name": "Renamed"}, {"id": 0, "name": "Missing"}, {"name": "No id"},
+        ], self.staff)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data[0], {})
+        self.assertIn("id", response.data[1])
+        self.assertIn("id", response.data[2])
+        self.assertEqual(models.Course.objects.get(pk=course.pk).name, "Intro")
+
+        response = self.bulk("post", "/user_courses/bulk/", {"code": "CS102"}, self.staff)
+        self.assertEqual(response.status_code, 400)
+        response = self.bulk("delete", "/user_courses/bulk/", [course.pk, 0], self.staff)
+        self.assertEqual(response.status_code, 400)
+        self.assertTrue(models.Course.objects.filter(pk=course.pk).exists())
+
+    def test_only_leaders_can_tag_projects(self):
+        for path in ["/project_tags/", "/project_tags/bulk/"]:
+            items = [{"name": "mine", "projects": [self.led.pk]},
+                     {"name": "theirs", "projects": [self.led.pk, self.other.pk]}]
+            data = items if path.endswith("bulk/") else items[1]
+            response = self.bulk("post", path, data, self.leader)
+            self.assertEqual(response.status_code, 400)
+            errors = response.data[1] if path.endswith("bulk/") else response.data
+            self.assertIn(str(self.other.pk), str(errors["projects"]))
+        self.assertFalse(models.ProjectTag.objects.exists())
+
+##########
+# export #
+##########
+
+class ExportTests(TestCase):
+    """ Staff stream whole tables as CSV or NDJSON """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.staff = models.User.objects.create(username="staff", is_staff=True)
+        cls.member = models.User.objects.create(username="member")
+        cls.course = models.Course.objects.create(code="CS101", name="Intro")
+        cls.member.courses.add(cls.course)
+        category = models.ProjectCategory.objects.create(name="category")
+        cls.tags = [models.ProjectTag.objects.create(name=name) for name in ["a", "b"]]
+        cls.first = models.Project.objects.create(name="first", description="",
+                                                  category=category)
+        cls.first.members.add(cls.member, cls.staff)
+        cls.first.tags.add(*cls.tags)
+        cls.second = models.Project.objects.create(name="second", description="",
+                                                   category=category)
+
+    def download(self, path, user=None):
+        client = APIClient()
+        if user is not None:
+            client.force_authenticate(user)
+        response = client.get(path)
+        if response.status_code != 200:
+            return response, None
+        return response, b"".join(response.streaming_content).decode("utf-8")
+
+    def test_csv(self):
+        response, content = self.download("/export/projects.csv", self.staff)
+        self.assertEqual(response["Content-Type"], "text/csv; charset=utf-8")
+        rows = list(csv.DictReader(io.StringIO(content)))
+        self.assertEqual([row["name"] for row in rows], ["first", "second"])
+        self.assertNotIn("search_vector", rows[0])
+        self.assertEqual(rows[0]["category_id"], str(self.first.category_id))
+        self.assertEqual(rows[0]["members"],
+                         " ".join(str(pk) for pk in sorted([self.staff.pk, self.member.pk])))
+        self.assertEqual(rows[0]["tags"], " ".join(str(tag.pk) for tag in self.tags))
+        self.assertEqual((rows[1]["members"], rows[1]["tags"]), ("", ""))
+
+    def test_ndjson(self):
+        response, content = self.download("/export/users.ndjson", self.staff)
+        self.assertEqual(response["Content-Type"], "application/x-ndjson")
+        rows = [json.loads(line) for line in content.splitlines()]
+        self.assertEqual([row["username"] for row in rows], ["staff", "member"])
+        self.assertNotIn("password", rows[0])
+        self.assertEqual(rows[1]["courses"], [self.course.pk])
+        self.assertEqual(rows[1]["member_projects"], [self.first.pk])
+        self.assertEqual(rows[0]["courses"], [])
+
+    def test_relations_are_read_per_chunk(self):
+        chunks = list(export.iter_chunks("projects", chunk_size=1, using="default"))
+        self.assertEqual([[row["name"] for row in chunk] for chunk in chunks],
+                         [["first"], ["second"]])
+        self.assertEqual(chunks[0][0]["tags"], [tag.pk for tag in self.tags])
+
+    def test_only_staff_can_export(self):
+        for user in [None, self.member]:
+            response, _ = self.download("/export/users.csv", user)
+            self.assertEqual(response.status_code, 403)
+
+################
+# user imports #
+################
+
+class ImportUsersTests(TestCase):
+    """ python manage.py import_users """
+
+    def setUp(self):
+        for code in ["CS101", "CS102"]:
+            models.Course.objects.create(code=code, name=code)
+
+    def import_users(self, extension, content):
+        handle, path = tempfile.mkstemp(suffix=extension)
+        self.addCleanup(os.remove, path)
+        with os.fdopen(handle, "w") as file:
+            file.write(content)
+        errors = io.StringIO()
+        call_command("import_users", path, processes=1, stdout=io.StringIO(), stderr=errors)
+        return errors.getvalue()
+
+    def courses(self, username):
+        return sorted(models.User.objects.get(username=username)
+                      .courses.values_list("code", flat=True))
+
+    def test_course_codes_in_every_format(self):
+        errors = self.import_users(".csv", "username,email,courses\n"
+                                           "ada,ada@example.com,CS101 CS102\n")
+        errors += self.import_users(".jsonl", "\n".join([
+            '{"username": "bob", "courses": ["CS101"]}',
+            '{"username": "cy", "courses": "CS101 CS102"}',
+            '{"username": "dee", "courses": "CS102"}',
+        ]))
+        self.assertEqual(errors, "")
+        self.assertEqual(self.courses("ada"), ["CS101", "CS102"])
+        self.assertEqual(self.courses("bob"), ["CS101"])
+        self.assertEqual(self.courses("cy"), ["CS101", "CS102"])
+        self.assertEqual(self.courses("dee"), ["CS102"])
+
+    def test_invalid_courses_are_row_errors(self):
+        errors = self.import_users(".jsonl", "\n".join([
+            '{"username": "ada", "courses": {"code": "CS101"}}',
+            '{"username": "bob", "courses": ["CS999"]}',
+            '{"username": "cy", "courses": "CS101"}',
+        ]))
+        self.assertIn("row 1: courses must be", errors)
+        self.assertIn("row 2: Unknown course CS999", errors)
+        self.assertEqual(list(models.User.objects.values_list("username", flat=True)), ["cy"])
+
+###################
+# instrumentation #
+###################
+
+# a cached response would run no queries to capture
+@override_settings(API_CACHE_ENABLED=False)
+class InstrumentationTests(TestCase):
+    """ Every request is timed, logged as JSON and, optionally, in Server-Timing """
+
+    def setUp(self):
+        models.Course.objects.create(code="CS101", name="Intro")
+
+    def get_logged(self, level="INFO"):
+        with self.assertLogs("api.requests", level) as logs:
+            response = self.client.get("/user_courses/")
+        self.assertEqual(response.status_code, 200)
+        [record] = logs.records
+        return response, record.levelname, json.loads(record.getMessage())
+
+    @override_settings(API_SERVER_TIMING=True)
+    def test_server_timing(self):
+        response, _, logged = self.get_logged()
+        timing = response["Server-Timing"]
+        self.assertRegex(timing, r'^db;dur=[\d.]+;desc="{} queries", serialize;dur=[\d.]+, '
+                                 r'total;dur=[\d.]+$'.format(logged["queries"]))
+        with override_settings(API_SERVER_TIMING=False):
+            response, _, _ = self.get_logged()
+            self.assertNotIn("Server-Timing", response)
+
+    @override_settings(API_SLOW_REQUEST_MS=60000)
+    def test_log_line(self):
+        response, level, logged = self.get_logged()
+        self.assertEqual(level, "INFO")
+        self.assertEqual(sorted(logged), sorted([
+            "method", "path", "status", "view", "action", "duration_ms", "queries",
+            "db_ms", "serialize_ms", "response_bytes"]))
+        self.assertEqual((logged["method"], logged["path"], logged["status"]),
+                         ("GET", "/user_courses/", 200))
+        self.assertEqual((logged["view"], logged["action"]), ("CourseViewSet", "list"))
+        self.assertGreater(logged["queries"], 0)
+        self.assertEqual(logged["response_bytes"], len(response.content))
+
+    @override_settings(API_SLOW_REQUEST_MS=0)
+    def test_slow_requests_log_their_sql(self):
+        _, level, logged = self.get_logged("WARNING")
+        self.assertEqual(level, "WARNING")
+        self.assertEqual(len(logged["sql"]), logged["queries"])
+        table = models.Course._meta.db_table
+        self.assertTrue(any(table in query["sql"] for query in logged["sql"]))
+        self.assertTrue(all(query["ms"] >= 0 for query in logged["sql"]))
+
+##############
+# throttling #
+##############
+
+class ThrottleTests(TestCase):
+    """ Token bucket rate limits """
+
+    def setUp(self):
+        # a fresh store for every test
+        throttling._store = None
+        self.addCleanup(setattr, throttling, "_store", None)
+
+    @override_settings(API_THROTTLE_RATES={"heart": "2/min"})
+    def test_over_the_limit_is_429_with_retry_after(self):
+        user = models.User.objects.create(username="fan")
+        hearted = models.User.objects.create(username="hearted")
+        client = APIClient()
+        client.force_authenticate(user)
+        path = "/users/{}/heart/".format(hearted.pk)
+        self.assertEqual(client.get(path).status_code, 200)
+        self.assertEqual(client.get(path).status_code, 200)
+        response = client.get(path)
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response["Retry-After"], "30")
+
+    @override_settings(API_THROTTLE_RATES={"login": "1/min"},
+                       REST_FRAMEWORK=dict(settings.REST_FRAMEWORK, NUM_PROXIES=1))
+    def test_forwarded_for_entries_from_the_client_are_ignored(self):
+        for spoofed in ["10.0.0.1", "10.0.0.2"]:
+            response = self.client.post("/token_auth/", {"username": "a", "password": "b"},
+                                        HTTP_X_FORWARDED_FOR="{}, 203.0.113.7".format(spoofed))
+        self.assertEqual(response.status_code, 429)
+
+    def assertRefills(self, store, elapse):
+        """ Spends a bucket of 2 per minute, then lets `elapse(seconds)` pass """
+        self.assertTrue(store.take("key", 2, 60)[0])
+        self.assertTrue(store.take("key", 2, 60)[0])
+        allowed, wait = store.take("key", 2, 60)
+        self.assertFalse(allowed)
+        self.assertAlmostEqual(wait, 30, delta=1)
+        elapse(30)
+        self.assertTrue(store.take("key", 2, 60)[0])
+        self.assertFalse(store.take("key", 2, 60)[0])
+        elapse(600)
+        # never more than the capacity
+        self.assertTrue(store.take("key", 2, 60)[0])
+        self.assertTrue(store.take("key", 2, 60)[0])
+        self.assertFalse(store.take("key", 2, 60)[0])
+
+    def test_local_store_refills(self):
+        now = [time.time()]
+        with mock.patch.object(throttling.time, "time", lambda: now[0]):
+            self.assertRefills(throttling.LocalStore(),
+                               lambda seconds: now.__setitem__(0, now[0] + seconds))
+
+    def test_database_store_refills(self):
+        def elapse(seconds):
+            models.ThrottleBucket.objects.update(
+                refilled_at=timezone.now() - timedelta(seconds=seconds))
+        self.assertRefills(throttling.DatabaseStore(), elapse)
+
+    def test_local_store_is_bounded(self):
+        store = throttling.LocalStore()
+        store.max_keys = 3
+        for index in range(10):
+            store.take("key{}".format(index), 2, 60)
+        self.assertEqual(list(store.buckets), ["key7", "key8", "key9"])
+
+    @override_settings(API_THROTTLE_RATES={"login": "1/min"})
+    def test_database_store_prunes_stale_buckets(self):
+        store = throttling.DatabaseStore()
+        store.take("stale", 2, 60)
+        models.ThrottleBucket.objects.update(refilled_at=timezone.now() - timedelta(hours=1))
+        store.pruned_at = 0
+        store.take("fresh", 2, 60)
+        self.assertEqual(list(models.ThrottleBucket.objects.values_list("key", flat=True)),
+                         ["fresh"])
+
+##################
+# authentication #
+##################
+
+class TokenAuthenticationTests(TestCase):
+    """ JWTs authenticate from their claims, and stop once those are out of date """
+
+    def setUp(self):
+        authentication.user_states.states.clear()
+        self.addCleanup(authentication.user_states.states.clear)
+        self.user = models.User.objects.create_user(username="ada", password="secret")
+        self.path = "/users/{}/feed/".format(self.user.pk)
+
+    def get_token(self, password="secret"):
+        response = self.client.post("/token_auth/", {"username": "ada", "password": password})
+        self.assertEqual(response.status_code, 200, response.data)
+        return response.data["token"]
+
+    def get(self, token):
+        return self.client.get(self.path, HTTP_AUTHORIZATION="JWT " + token)
+
+    def test_claims_authenticate_without_loading_the_user(self):
+        token = self.get_token()
+        self.assertEqual(self.get(token).status_code, 200)
+        # the user's state is now cached, and the user row is not read again
+        with self.assertNumQueries(2):
+            self.assertEqual(self.get(token).status_code, 200)
+
+    @override_settings(API_JWT_USER_CACHE_SECONDS=0)
+    def test_stale_claims_are_refused(self):
+        token = self.get_token()
+        models.User.objects.filter(pk=self.user.pk).update(is_staff=True)
+        self.assertEqual(self.get(token).status_code, 403)
+        self.assertEqual(self.get(self.get_token()).status_code, 200)
+
+        self.user.refresh_from_db()
+        self.user.set_password("changed")
+        self.user.save()
+        self.assertEqual(self.get(token).status_code, 403)
+        self.assertEqual(self.get(self.get_token("changed")).status_code, 200)
+
+    @override_settings(API_JWT_USER_CACHE_SECONDS=0)
+    def test_deactivated_users_are_refused(self):
+        token = self.get_token()
+        models.User.objects.filter(pk=self.user.pk).update(is_active=False)
+        self.assertEqual(self.get(token).status_code, 403)
+
+    def test_password_hash_upgrade_keeps_tokens_valid(self):
+        hasher = PBKDF2PasswordHasher()
+        models.User.objects.filter(pk=self.user.pk).update(
+            password=hasher.encode("secret", hasher.salt(), iterations=1000))
+        token = self.get_token()
+        user = models.User.objects.get(pk=self.user.pk)
+        self.assertNotIn("$1000$", user.password)
+        self.assertEqual(user.token_version, self.user.token_version)
+        self.assertEqual(self.get(token).status_code, 200)
+
+###############
+# memberships #
+###############
+
+class MembershipTests(TransactionTestCase):
+    """ ProjectMembership mirrors the members and leaders relations """
+
+    def setUp(self):
+        cache.get_cache().clear()
+        self.ada = models.User.objects.create(username="ada")
+        self.bob = models.User.objects.create(username="bob")
+        category = models.ProjectCategory.objects.create(name="category")
+        self.first = models.Project.objects.create(name="first", description="", category=category)
+        self.second = models.Project.objects.create(name="second", description="",
+                                                    category=category)
+
+    def memberships(self):
+        return set(models.ProjectMembership.objects.values_list("user__username",
+                                                                "project__name", "role"))
+
+    def test_changes_from_the_project_side(self):
+        self.first.members.add(self.ada, self.bob)
+        self.first.leaders.add(self.ada)
+        self.assertEqual(self.memberships(), {("ada", "first", "member"), ("bob", "first", "member"),
+                                              ("ada", "first", "leader")})
+        self.first.members.remove(self.ada)
+        self.assertEqual(self.memberships(), {("bob", "first", "member"),
+                                              ("ada", "first", "leader")})
+        self.first.members.clear()
+        self.assertEqual(self.memberships(), {("ada", "first", "leader")})
+
+    def test_changes_from_the_user_side(self):
+        self.ada.leader_projects.add(self.first, self.second)
+        self.ada.member_projects.add(self.second)
+        self.assertEqual(self.memberships(), {("ada", "first", "leader"), ("ada", "second", "leader"),
+                                              ("ada", "second", "member")})
+        self.ada.leader_projects.remove(self.first)
+        self.assertEqual(self.memberships(), {("ada", "second", "leader"),
+                                              ("ada", "second", "member")})
+        self.ada.leader_projects.clear()
+        self.assertEqual(self.memberships(), {("ada", "second", "member")})
+
+    def test_rebuild(self):
+        through = models.Project.members.through
+        through.objects.bulk_create([through(project=self.first, user=self.ada),
+                                     through(project=self.second, user=self.bob)])
+        self.assertEqual(self.memberships(), set())
+        versions = cache.get_versions([models.User, models.Project])
+        models.rebuild_memberships()
+        self.assertEqual(self.memberships(), {("ada", "first", "member"),
+                                              ("bob", "second", "member")})
+        moved = cache.get_versions([models.User, models.Project])
+        self.assertTrue(all(new > old for new, old in zip(moved, versions)))
+
+    def test_user_projects_by_role(self):
+        self.first.members.add(self.ada)
+        self.second.leaders.add(self.ada)
+        path = "/users/{}/projects/".format(self.ada.pk)
+        self.client.force_login(self.ada)
+        for query, names in [("", ["second", "first"]), ("?role=member", ["first"]),
+                             ("?role=leader", ["second"])]:
+            response = self.client.get(path + query)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual([project["name"] for project in response.data["results"]], names)
+        response = self.client.get(path + "?role=owner")
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("role", response.data)
 
-# Create your tests here.
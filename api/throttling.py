@@ -0,0 +1,164 @@
+###########
+# imports #
+###########
+
+import logging
+import threading
+import time
+from collections import OrderedDict
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import DatabaseError, transaction
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from rest_framework.throttling import BaseThrottle
+
+from api import models
+
+logger = logging.getLogger(__name__)
+
+# Expensive endpoints (password hashing, hearts) are rate limited with token
+# buckets. A view names the rate limits of its actions in `throttle_scopes`,
+# e.g. {"create": "signup", "heart": "heart"} (plain API views key them by
+# HTTP method), and settings.API_THROTTLE_RATES gives each scope a rate such
+# as "10/min": a client may burst up to 10 requests, and gets a token back
+# every 6 seconds. Clients are told apart by user, or by IP address when
+# anonymous, and get a 429 with a Retry-After header once out of tokens.
+#
+# Buckets live in settings.API_THROTTLE_STORE:
+#
+# - LocalStore keeps them in process memory: cheap, but each worker process
+#   counts on its own
+# - DatabaseStore shares them between processes in the ThrottleBucket table,
+#   updating a bucket under a row lock; when the database fails it falls back
+#   to a LocalStore rather than failing the request. Each process deletes the
+#   stale buckets once a minute, through the refilled_at index.
+
+PERIODS = {"s": 1, "m": 60, "h": 60 * 60, "d": 24 * 60 * 60}
+
+def parse_rate(rate):
+    """ Returns (requests, seconds) for a rate such as "10/min" """
+    requests, period = rate.split("/")
+    return int(requests), PERIODS[period[0]]
+
+def refill(tokens, elapsed, capacity, period):
+    """ Returns the tokens of a bucket after `elapsed` seconds without requests """
+    return min(capacity, tokens + max(elapsed, 0) * capacity / float(period))
+
+def spend(tokens, capacity, period):
+    """ Returns (allowed, tokens left, seconds to wait) for a request """
+    if tokens >= 1:
+        return True, tokens - 1, 0
+    return False, tokens, (1 - tokens) * period / float(capacity)
+
+##########
+# stores #
+##########
+
+class LocalStore(object):
+    """ Token buckets in the memory of this process """
+    max_keys = 10000
+
+    def __init__(self):
+        # key -> (tokens, refilled at, period), least recently used first
+        self.buckets = OrderedDict()
+        self.lock = threading.Lock()
+
+    def take(self, key, capacity, period):
+        now = time.time()
+        with self.lock:
+            tokens, refilled_at, _ = self.buckets.pop(key, (capacity, now, period))
+            allowed, tokens, wait = spend(refill(tokens, now - refilled_at, capacity, period),
+                                          capacity, period)
+            self.buckets[key] = (tokens, now, period)
+            self.prune(now)
+        return allowed, wait
+
+    def prune(self, now):
+        # a bucket left alone for a whole period is full, as good as absent;
+        # past max_keys the least recently used ones go even if they are not
+        while self.buckets:
+            key, (_, refilled_at, period) = next(iter(self.buckets.items()))
+            if now - refilled_at < period and len(self.buckets) <= self.max_keys:
+                return
+            self.buckets.popitem(last=False)
+
+class DatabaseStore(object):
+    """ Token buckets shared by every process, in the ThrottleBucket table """
+    prune_interval = 60  # seconds between the deletions of stale buckets by a process
+
+    def __init__(self):
+        self.fallback = LocalStore()
+        self.pruned_at = 0
+        self.prune_lock = threading.Lock()
+
+    def take(self, key, capacity, period):
+        try:
+            return self.take_shared(key, capacity, period)
+        except DatabaseError:
+            logger.warning("Throttle store unavailable, limiting in process", exc_info=True)
+            return self.fallback.take(key, capacity, period)
+
+    def take_shared(self, key, capacity, period):
+        # always the primary, without the router pinning the user to it
+        buckets = models.ThrottleBucket.objects.using("default")
+        with transaction.atomic(using="default"):
+            now = timezone.now()
+            bucket, created = buckets.select_for_update().get_or_create(
+                key=key, defaults={"tokens": capacity, "refilled_at": now})
+            elapsed = (now - bucket.refilled_at).total_seconds()
+            allowed, bucket.tokens, wait = spend(
+                refill(bucket.tokens, elapsed, capacity, period), capacity, period)
+            bucket.refilled_at = now
+            bucket.save(using="default", update_fields=["tokens", "refilled_at"])
+        self.prune(now)
+        return allowed, wait
+
+    def prune(self, now):
+        """ Deletes the buckets that have been full for a while, at most every prune_interval """
+        with self.prune_lock:
+            if time.time() - self.pruned_at < self.prune_interval:
+                return
+            self.pruned_at = time.time()
+        longest = max(parse_rate(rate)[1] for rate in settings.API_THROTTLE_RATES.values())
+        (models.ThrottleBucket.objects.using("default")
+         .filter(refilled_at__lt=now - timedelta(seconds=longest)).delete())
+
+_store = None
+_store_lock = threading.Lock()
+
+def get_store():
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = import_string(settings.API_THROTTLE_STORE)()
+    return _store
+
+############
+# throttle #
+############
+
+class TokenBucketThrottle(BaseThrottle):
+    """ Limits the actions a view lists in `throttle_scopes` to their API_THROTTLE_RATES """
+
+    def get_scope(self, request, view):
+        action = getattr(view, "action", None) or request.method.lower()
+        return getattr(view, "throttle_scopes", {}).get(action)
+
+    def get_key(self, request, scope):
+        if request.user and request.user.is_authenticated:
+            return "{}:user:{}".format(scope, request.user.pk)
+        return "{}:ip:{}".format(scope, self.get_ident(request))
+
+    def allow_request(self, request, view):
+        scope = self.get_scope(request, view)
+        if scope is None or scope not in settings.API_THROTTLE_RATES:
+            return True
+        capacity, period = parse_rate(settings.API_THROTTLE_RATES[scope])
+        allowed, self.seconds = get_store().take(self.get_key(request, scope), capacity, period)
+        return allowed
+
+    def wait(self):
+        return self.seconds
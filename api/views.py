@@ -5,17 +5,21 @@
 # Shortcuts and Models
 from django.shortcuts import render, get_object_or_404
 from django.contrib.auth.models import User
-from django.http import Http404
+from django.http import Http404, StreamingHttpResponse
+from django.db import transaction
 
 # View Builders
 from rest_framework import viewsets, mixins, status, generics
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework.decorators import action
+from rest_framework.exceptions import ValidationError
+from rest_framework_jwt.views import ObtainJSONWebToken
 
 # Filters
 from django_filters.rest_framework import DjangoFilterBackend
-from rest_framework.filters import SearchFilter, OrderingFilter
+from rest_framework.filters import OrderingFilter
+from api.filters import RankedSearchFilter
 
 # Models and Serializers
 from api import models
@@ -24,18 +28,92 @@ from api import serializers
 # Permissions
 from api import permissions
 
+# Pagination
+from api import pagination
+
+# Bulk writes
+from api import bulk
+from api.bulk import BulkModelMixin
+
+# Exports
+from api import export
+
+# Caching
+from api.cache import CachedResponseMixin
+from api.conditional import ConditionalGetMixin
+
+# Database
+from api.db import pool
+from api.db.router import ReplicaReadMixin
+
+###########
+# helpers #
+###########
+
+def get_hearted(request):
+    """
+    The intent of a heart request: True for ?hearted=true, False for
+    ?hearted=false, or None to toggle
+    """
+    value = request.query_params.get("hearted")
+    if value is None:
+        return None
+    if value not in ["true", "false"]:
+        raise ValidationError({"hearted": "Must be true or false."})
+    return value == "true"
+
+##########
+# mixins #
+##########
+
+class PrefetchRelatedMixin(object):
+    """
+    Plans the relation prefetches (and, for sparse fieldsets, the loaded
+    columns) for read actions from the fields of the serializer that will
+    render them, so list pages cost a constant number of queries.
+    """
+    prefetch_actions = permissions.READ_ACTIONS
+
+    def get_queryset(self):
+        queryset = super(PrefetchRelatedMixin, self).get_queryset()
+        if self.action in self.prefetch_actions:
+            serializer = self.get_serializer()
+            queryset = queryset.prefetch_related(*serializer.get_prefetch_lookups())
+            columns = serializer.get_only_columns()
+            if columns is not None:
+                queryset = queryset.only(*columns)
+        return queryset
+
+    def get_object_for_response(self, serializer_class):
+        """
+        Reads the object of a detail action that changed it again, with the
+        prefetches of `serializer_class`. Such actions are left out of
+        prefetch_actions, so their first get_object() prefetches nothing.
+        """
+        serializer = serializer_class(context=self.get_serializer_context())
+        queryset = self.get_queryset().prefetch_related(*serializer.get_prefetch_lookups())
+        lookup_url_kwarg = self.lookup_url_kwarg or self.lookup_field
+        return generics.get_object_or_404(
+            queryset, **{self.lookup_field: self.kwargs[lookup_url_kwarg]})
+
 #########
 # users #
 #########
 
-class UserViewSet(viewsets.GenericViewSet,
+class UserViewSet(ReplicaReadMixin, ConditionalGetMixin, CachedResponseMixin, PrefetchRelatedMixin,
+                  viewsets.GenericViewSet,
                   mixins.ListModelMixin, mixins.RetrieveModelMixin, 
                   mixins.CreateModelMixin, mixins.DestroyModelMixin,
                   mixins.UpdateModelMixin):
 
     queryset = models.User.objects.all()
+    replica_actions = permissions.READ_ACTIONS + ["feed", "projects"]
+    cache_dependencies = (models.User, models.UserSiteRole, models.Course,
+                          models.Project, models.ProjectJoinRequest)
+    query_budgets = {"list": 11, "retrieve": 11, "feed": 4, "projects": 10}
+    throttle_scopes = {"create": "signup", "heart": "heart"}
 
-    filter_backends = [DjangoFilterBackend, OrderingFilter, SearchFilter]
+    filter_backends = [DjangoFilterBackend, OrderingFilter, RankedSearchFilter]
     filter_fields = ["username", "email"]
     ordering_fields = ["hearts", "date_joined"]
     search_fields = ["username", "email"]
@@ -46,6 +124,10 @@ class UserViewSet(viewsets.GenericViewSet,
             permission_classes = []
         if self.action in ["heart"]:
             permission_classes = [permissions.UserHeart]
+        if self.action in ["feed"]:
+            permission_classes = [permissions.UserFeed]
+        if self.action in ["projects"]:
+            permission_classes = [permissions.UserProjects]
         if self.action in ["destroy"]:
             permission_classes = [permissions.UserDestroy]
         if self.action in ["update", "partial_update"]:
@@ -63,17 +145,55 @@ class UserViewSet(viewsets.GenericViewSet,
     def heart(self, request, pk=None):
         """
         API endpoint that allows users to be hearted. If authenticated,
-        a simple visit to this endpoint will heart or unheart the user.
+        a simple visit to this endpoint will heart or unheart the user;
+        ?hearted=true or ?hearted=false only hearts or only unhearts.
         """
         target_user = self.get_object()
-        source_user = request.user
-        if target_user in source_user.hearted_users.all():
-            source_user.hearted_users.remove(target_user)
-        else:
-            source_user.hearted_users.add(target_user)
+        target_user.toggle_heart(request.user, hearted=get_hearted(request))
+        # the counter and relations are stale after the toggle
+        target_user = self.get_object_for_response(serializers.UserListRetrieve)
         serializer = serializers.UserListRetrieve(target_user, context={"request" : request})
         return Response(serializer.data)
 
+    @action(detail=True)
+    def feed(self, request, pk=None):
+        """
+        API endpoint listing the posts, comments and join requests of the
+        projects a user is a member or leader of, newest first. Supports the
+        ?cursor= keyset pagination of the project feeds.
+        """
+        user = self.get_object()
+        entries = (models.FeedEntry.objects.filter(user=user)
+                   .select_related("post", "comment", "join_request")
+                   .order_by("-timestamp", "-pk"))
+        paginator = pagination.FeedPagination()
+        page = paginator.paginate_queryset(entries, request, view=self)
+        serializer = serializers.FeedEntrySerializer(page, many=True, context={"request": request})
+        return paginator.get_paginated_response(serializer.data)
+
+    @action(detail=True)
+    def projects(self, request, pk=None):
+        """
+        API endpoint listing the projects a user is a member or leader of,
+        newest first. ?role=member or ?role=leader narrows it to one role.
+        """
+        user = self.get_object()
+        memberships = models.ProjectMembership.objects.filter(user=user)
+        role = request.query_params.get("role")
+        if role is not None:
+            if role not in dict(models.ProjectMembership.ROLES):
+                raise ValidationError({"role": "Must be one of {}.".format(
+                    ", ".join(dict(models.ProjectMembership.ROLES)))})
+            memberships = memberships.filter(role=role)
+        serializer = serializers.ProjectSerializer(context=self.get_serializer_context())
+        projects = (models.Project.objects.filter(pk__in=memberships.values("project"))
+                    .prefetch_related(*serializer.get_prefetch_lookups())
+                    .order_by("-timestamp", "-pk"))
+        page = self.paginate_queryset(projects)
+        serializer = serializers.ProjectSerializer(page, many=True,
+                                                   context=self.get_serializer_context())
+        return self.get_paginated_response(serializer.data)
+
 
 
     # def list(self, request):
@@ -142,19 +262,22 @@ class UserViewSet(viewsets.GenericViewSet,
 # user courses #
 ################
 
-class CourseViewSet(viewsets.ModelViewSet):
+class CourseViewSet(ReplicaReadMixin, ConditionalGetMixin, CachedResponseMixin, PrefetchRelatedMixin,
+                    BulkModelMixin, viewsets.ModelViewSet):
     """
     API endpoint that allows courses to be viewed (by all) or edited (by staff).
     """
     # default query-set and serializer for all actions
     queryset = models.Course.objects.all()
     serializer_class = serializers.CourseSerializer
+    cache_dependencies = (models.Course,)
+    query_budgets = {"list": 3, "retrieve": 3}
 
     # set filtering options
-    filter_backends = [DjangoFilterBackend, OrderingFilter, SearchFilter]
+    filter_backends = [DjangoFilterBackend, OrderingFilter, RankedSearchFilter]
     filter_fields = ["name", "code"]
     search_fields = ["name", "code"]
-    ordering_fields = ["user_count"]
+    ordering_fields = ["code", "name"]
     
     # set permissions
     def get_permissions(self):
@@ -167,25 +290,72 @@ class CourseViewSet(viewsets.ModelViewSet):
 # projects #
 ############
 
-class ProjectViewSet(viewsets.ViewSet):
+class ProjectViewSet(ReplicaReadMixin, ConditionalGetMixin, PrefetchRelatedMixin, viewsets.ReadOnlyModelViewSet):
+    """
+    API endpoint that allows projects to be viewed.
+    """
     # default query-set and serializer for all actions
     serializer_class = serializers.ProjectSerializer
     queryset = models.Project.objects.all().order_by('-timestamp')
+    pagination_class = pagination.FeedPagination
+    cache_dependencies = (models.Project, models.User, models.ProjectTag,
+                          models.ProjectJoinRequest, models.ProjectComment, models.ProjectPost)
+    query_budgets = {"list": 10, "retrieve": 10}
+    throttle_scopes = {"heart": "heart"}
 
     # set filtering options
-    # filter_backends = [DjangoFilterBackend, OrderingFilter, SearchFilter]
-    # filter_fields = ["category", "tags", "name"]
-    # search_fields = ["name", "description"]
-    # ordering_fields = ["timestamp", "hearts"]
+    filter_backends = [DjangoFilterBackend, OrderingFilter, RankedSearchFilter]
+    filter_fields = ["category", "tags", "name"]
+    search_fields = ["name", "description"]
+    search_vector_field = "search_vector"
+    ordering_fields = ["timestamp", "hearts"]
 
-    def list(self, request):
-        queryset = models.Project.objects.filter()
-        serializer = serializers.ProjectSerializer(queryset, many=True, context={"request" : request})
+    @action(detail=True, permission_classes=[permissions.IsAuthenticated])
+    def heart(self, request, pk=None):
+        """
+        API endpoint that allows projects to be hearted. If authenticated,
+        a simple visit to this endpoint will heart or unheart the project;
+        ?hearted=true or ?hearted=false only hearts or only unhearts.
+        """
+        project = self.get_object()
+        project.toggle_heart(request.user, hearted=get_hearted(request))
+        # the counter and relations are stale after the toggle
+        project = self.get_object_for_response(serializers.ProjectSerializer)
+        serializer = serializers.ProjectSerializer(project, context={"request": request})
         return Response(serializer.data)
 
-    def retrieve(self, request, pk=None):
-        queryset = models.Project.objects.filter()
-        project = get_object_or_404(queryset, pk=pk)
+    @action(detail=True, methods=["post", "delete"], permission_classes=[permissions.ProjectWrite])
+    def members(self, request, pk=None):
+        """
+        API endpoint that adds (POST) or removes (DELETE) a list of user ids
+        as members of the project.
+        """
+        return self.change_memberships(request, "members")
+
+    @action(detail=True, methods=["post", "delete"], permission_classes=[permissions.ProjectWrite])
+    def leaders(self, request, pk=None):
+        """
+        API endpoint that adds (POST) or removes (DELETE) a list of user ids
+        as leaders of the project.
+        """
+        return self.change_memberships(request, "leaders")
+
+    def change_memberships(self, request, relation):
+        project = self.get_object()
+        user_ids = bulk.get_items(request)
+        found = set(models.User.objects.filter(pk__in=bulk.valid_ids(user_ids))
+                    .values_list("pk", flat=True))
+        errors = bulk.lookup_errors(user_ids, found)
+        if any(errors):
+            raise ValidationError(errors)
+        # one query for the existing through rows and one bulk insert (or
+        # delete) for the rest
+        with transaction.atomic():
+            if request.method == "POST":
+                getattr(project, relation).add(*found)
+            else:
+                getattr(project, relation).remove(*found)
+        project = self.get_object_for_response(serializers.ProjectSerializer)
         serializer = serializers.ProjectSerializer(project, context={"request": request})
         return Response(serializer.data)
 
@@ -229,23 +399,24 @@ class ProjectViewSet(viewsets.ViewSet):
 # project join requests #
 #########################
 
-class ProjectJoinRequestViewSet(viewsets.ViewSet):
+class ProjectJoinRequestViewSet(ReplicaReadMixin, ConditionalGetMixin, PrefetchRelatedMixin,
+                                viewsets.GenericViewSet,
+                                mixins.ListModelMixin, mixins.RetrieveModelMixin):
     """
     API endpoint that allows project join requests to be viewed or edited.
     """
     serializer_class = serializers.ProjectJoinRequestSerializer
     queryset = models.ProjectJoinRequest.objects.all()
-
-    def list(self, request, project_pk=None):
-        queryset = models.ProjectJoinRequest.objects.filter(project=project_pk)
-        serializer = serializers.ProjectJoinRequestSerializer(queryset, many=True, context={'request': request})
-        return Response(serializer.data)
-
-    def retrieve(self, request, pk=None, project_pk=None):
-        queryset = models.ProjectJoinRequest.objects.filter(pk=pk, project=project_pk)
-        project_join_request = get_object_or_404(queryset, pk=pk)
-        serializer = serializers.ProjectJoinRequestSerializer(project_join_request, context={'request': request})
-        return Response(serializer.data)
+    pagination_class = pagination.FeedPagination
+    cache_dependencies = (models.ProjectJoinRequest,)
+    # the reader's project roles are looked up once per request
+    query_budgets = {"list": 4, "retrieve": 4}
+    permission_classes = [permissions.ProjectJoinRequestRead]
+
+    def get_queryset(self):
+        # join requests are nested under their project
+        return super(ProjectJoinRequestViewSet, self).get_queryset().filter(
+            project=self.kwargs.get("project_pk")).order_by('-timestamp')
     
     # set filtering options
     # filter_backends = [DjangoFilterBackend, OrderingFilter, SearchFilter]
@@ -264,16 +435,19 @@ class ProjectJoinRequestViewSet(viewsets.ViewSet):
 # project tags and categories #
 ###############################
 
-class ProjectCategoryViewSet(viewsets.ModelViewSet):
+class ProjectCategoryViewSet(ReplicaReadMixin, ConditionalGetMixin, CachedResponseMixin, PrefetchRelatedMixin,
+                             viewsets.ModelViewSet):
     """
     API endpoint that allows project categories to be viewed or edited.
     """
     # default query-set and serializer for all actions
     queryset = models.ProjectCategory.objects.all()
     serializer_class = serializers.ProjectCategorySerializer
+    cache_dependencies = (models.ProjectCategory, models.Project)
+    query_budgets = {"list": 4, "retrieve": 4}
 
     # set filtering options
-    filter_backends = [DjangoFilterBackend, SearchFilter]
+    filter_backends = [DjangoFilterBackend, RankedSearchFilter]
     filter_fields = ["name"]
     search_fields = ["name"]
 
@@ -284,16 +458,19 @@ class ProjectCategoryViewSet(viewsets.ModelViewSet):
             permission_classes = [permissions.ProjectCategoryWrite]
         return [permission() for permission in permission_classes]
 
-class ProjectTagViewSet(viewsets.ModelViewSet):
+class ProjectTagViewSet(ReplicaReadMixin, ConditionalGetMixin, CachedResponseMixin, PrefetchRelatedMixin,
+                        BulkModelMixin, viewsets.ModelViewSet):
     """
     API endpoint that allows project tags to be viewed or edited.
     """
     # default query-set and serializer for all actions
     queryset = models.ProjectTag.objects.all()
     serializer_class = serializers.ProjectTagSerializer
+    cache_dependencies = (models.ProjectTag, models.Project)
+    query_budgets = {"list": 4, "retrieve": 4}
 
     # set filtering options
-    filter_backends = [DjangoFilterBackend, SearchFilter]
+    filter_backends = [DjangoFilterBackend, RankedSearchFilter]
     filter_fields = ["name"]
     search_fields = ["name"]
 
@@ -308,18 +485,22 @@ class ProjectTagViewSet(viewsets.ModelViewSet):
 # project comments #
 ####################
 
-class ProjectCommentViewSet(viewsets.ModelViewSet):
+class ProjectCommentViewSet(ReplicaReadMixin, ConditionalGetMixin, PrefetchRelatedMixin, viewsets.ModelViewSet):
     """
     API endpoint that allows project comments to be viewed or edited.
     """
     # default query-set and serializer for all actions
     queryset = models.ProjectComment.objects.all().order_by('-timestamp')
     serializer_class = serializers.ProjectCommentSerializer
+    pagination_class = pagination.FeedPagination
+    cache_dependencies = (models.ProjectComment,)
+    query_budgets = {"list": 3, "retrieve": 3}
 
     # set filtering options
-    filter_backends = [DjangoFilterBackend, OrderingFilter, SearchFilter]
+    filter_backends = [DjangoFilterBackend, OrderingFilter, RankedSearchFilter]
     filter_fields = ["user", "project"]
     search_fields = ["comment"]
+    search_vector_field = "search_vector"
     ordering_fields = ["timestamp"]
 
     # set permissions
@@ -329,26 +510,34 @@ class ProjectCommentViewSet(viewsets.ModelViewSet):
             permission_classes = [permissions.ProjectCommentWrite]
         return [permission() for permission in permission_classes]
 
+    def perform_create(self, serializer):
+        serializer.save(user=self.request.user)
+
 #################
 # project posts #
 #################
 
-class ProjectPostViewSet(viewsets.ModelViewSet):
+class ProjectPostViewSet(ReplicaReadMixin, ConditionalGetMixin, PrefetchRelatedMixin, viewsets.ModelViewSet):
     """
     API endpoint that allows project posts to be viewed or edited.
     """
     # default query-set and serializer for all actions
     queryset = models.ProjectPost.objects.all().order_by('-timestamp')
     serializer_class = serializers.ProjectPostSerializer
+    pagination_class = pagination.FeedPagination
+    # private posts are shown depending on project membership
+    cache_dependencies = (models.ProjectPost, models.Project)
+    # private posts look up the reader's project roles, once per request
+    query_budgets = {"list": 4, "retrieve": 4}
 
     # set filtering options
-    filter_backends = [DjangoFilterBackend, OrderingFilter, SearchFilter]
+    filter_backends = [DjangoFilterBackend, OrderingFilter, RankedSearchFilter]
     filter_fields = ["project"]
     search_fields = ["post"]
+    search_vector_field = "search_vector"
     ordering_fields = ["timestamp"]
 
-    # TODO: how to prevent people creating posts in list view and associating
-    # them with any random project?
+    # ProjectPostSerializer only accepts projects the user leads
 
     # set permissions
     def get_permissions(self):
@@ -358,3 +547,42 @@ class ProjectPostViewSet(viewsets.ModelViewSet):
         else: 
             permission_classes = [permissions.ProjectPostWrite]
         return [permission() for permission in permission_classes]
+
+##################
+# authentication #
+##################
+
+class ObtainToken(ObtainJSONWebToken):
+    """ API endpoint that exchanges a username and password for a JWT """
+    # every attempt hashes a password
+    throttle_scopes = {"post": "login"}
+
+#########
+# stats #
+#########
+
+class DatabasePoolStats(APIView):
+    """ Connection pool metrics of the process serving the request """
+    permission_classes = [permissions.IsStaff]
+
+    def get(self, request):
+        return Response(pool.get_stats())
+
+##########
+# export #
+##########
+
+class Export(APIView):
+    """ Streams every user, project or comment as CSV or NDJSON """
+    permission_classes = [permissions.IsStaff]
+
+    def perform_content_negotiation(self, request, force=False):
+        # the response format comes from the URL, not the Accept header
+        return super(Export, self).perform_content_negotiation(request, force=True)
+
+    def get(self, request, resource, file_format):
+        response = StreamingHttpResponse(export.iter_export(resource, file_format),
+                                         content_type=export.FORMATS[file_format])
+        response["Content-Disposition"] = 'attachment; filename="{}.{}"'.format(
+            resource, file_format)
+        return response
@@ -0,0 +1,193 @@
+"""
+ASGI config for thinkspace_api project.
+
+It exposes the ASGI callable as a module-level variable named ``application``.
+
+Django 2.0 only speaks WSGI, so the WSGI application is adapted here: request
+bodies are received and responses are sent on the event loop, and only the
+Django request handling (and iterating its response) runs on a bounded pool of ASGI_THREADS
+threads. Slow clients then hold a coroutine rather than a thread, and the
+pool size also bounds the number of database connections per process.
+"""
+
+import asyncio
+import os
+import sys
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.wsgi import get_wsgi_application
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "thinkspace_api.settings.production")
+
+# the most response chunks a pool thread gets ahead of the client
+RESPONSE_BUFFER_CHUNKS = 16
+
+class ResponseQueue(object):
+    """
+    Hands response messages from a pool thread to the event loop without
+    waiting for them to be sent. The thread only waits once `size` messages
+    are still unsent, so a streaming response is not read into memory ahead
+    of a slow client.
+    """
+    def __init__(self, loop, size):
+        self.loop = loop
+        self.size = size
+        self.messages = asyncio.Queue()
+        self.space = threading.Semaphore(size)
+        self.closed = False
+
+    def put(self, message):
+        """ Queues `message` from the pool thread; False once the client is gone """
+        self.space.acquire()
+        if self.closed:
+            return False
+        self.loop.call_soon_threadsafe(self.messages.put_nowait, message)
+        return True
+
+    def finish(self):
+        """ Marks the end of the response, from the pool thread """
+        self.loop.call_soon_threadsafe(self.messages.put_nowait, None)
+
+    async def send_all(self, send):
+        """ Sends the queued messages until the response is finished """
+        try:
+            while True:
+                message = await self.messages.get()
+                if message is None:
+                    return
+                await send(message)
+                self.space.release()
+        finally:
+            # lets a thread waiting for space find out the client is gone
+            self.closed = True
+            for _ in range(self.size):
+                self.space.release()
+
+class WsgiToAsgi(object):
+    def __init__(self, wsgi_application, max_threads):
+        self.wsgi_application = wsgi_application
+        self.executor = ThreadPoolExecutor(max_workers=max_threads)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            await self.lifespan(receive, send)
+            return
+        if scope["type"] != "http":
+            raise ValueError("Unsupported ASGI scope type {}".format(scope["type"]))
+        body = await self.read_body(receive)
+        if body is None:
+            return  # the client went away before sending its request
+        loop = asyncio.get_event_loop()
+        queue = ResponseQueue(loop, RESPONSE_BUFFER_CHUNKS)
+        try:
+            handled = loop.run_in_executor(self.executor, self.run, scope, body, queue)
+            try:
+                await queue.send_all(send)
+            finally:
+                await handled
+        finally:
+            body.close()
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                self.executor.shutdown(wait=True)
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    async def read_body(self, receive):
+        """ Receives the request body into a file, or returns None on disconnect """
+        body = tempfile.SpooledTemporaryFile(max_size=settings.FILE_UPLOAD_MAX_MEMORY_SIZE)
+        while True:
+            message = await receive()
+            if message["type"] == "http.disconnect":
+                body.close()
+                return None
+            body.write(message.get("body", b""))
+            if not message.get("more_body", False):
+                return body
+
+    def get_environ(self, scope, body):
+        server = scope.get("server") or ("localhost", 80)
+        client = scope.get("client") or ("", 0)
+        environ = {
+            "REQUEST_METHOD": scope["method"],
+            "SCRIPT_NAME": scope.get("root_path", ""),
+            # WSGI carries the raw path bytes as latin-1
+            "PATH_INFO": scope["path"].encode("utf-8").decode("latin-1"),
+            "QUERY_STRING": scope.get("query_string", b"").decode("latin-1"),
+            "SERVER_NAME": server[0],
+            "SERVER_PORT": str(server[1]),
+            "SERVER_PROTOCOL": "HTTP/{}".format(scope.get("http_version", "1.1")),
+            "REMOTE_ADDR": client[0],
+            "REMOTE_PORT": str(client[1]),
+            "wsgi.version": (1, 0),
+            "wsgi.url_scheme": scope.get("scheme", "http"),
+            "wsgi.input": body,
+            "wsgi.errors": sys.stderr,
+            "wsgi.multithread": True,
+            "wsgi.multiprocess": True,
+            "wsgi.run_once": False,
+        }
+        for name, value in scope.get("headers", []):
+            name = name.decode("latin-1").upper().replace("-", "_")
+            value = value.decode("latin-1")
+            if name not in ("CONTENT_TYPE", "CONTENT_LENGTH"):
+                name = "HTTP_" + name
+            if name in environ:
+                separator = "; " if name == "HTTP_COOKIE" else ","
+                value = environ[name] + separator + value
+            environ[name] = value
+        # the whole body is at hand, also for chunked requests
+        body.seek(0, os.SEEK_END)
+        environ["CONTENT_LENGTH"] = str(body.tell())
+        body.seek(0)
+        return environ
+
+    def start(self, queue, start):
+        """ Queues the response status and headers given to start_response """
+        return queue.put({"type": "http.response.start", "status": start["status"],
+                          "headers": start["headers"]})
+
+    def run(self, scope, body, queue):
+        """ Runs Django on a pool thread, queueing the response as it is produced """
+        start = {}
+
+        def start_response(status, headers, exc_info=None):
+            start["status"] = int(status.split(" ", 1)[0])
+            start["headers"] = [(name.lower().encode("latin-1"), value.encode("latin-1"))
+                                for name, value in headers]
+
+        try:
+            response = self.wsgi_application(self.get_environ(scope, body), start_response)
+            try:
+                # start_response may only be called once iteration begins
+                sent = started = False
+                # streaming responses are sent chunk by chunk
+                for chunk in response:
+                    if not started:
+                        started = True
+                        sent = self.start(queue, start)
+                    if not sent:
+                        break
+                    if chunk:
+                        sent = queue.put({"type": "http.response.body", "body": chunk,
+                                          "more_body": True})
+                if not started:
+                    sent = self.start(queue, start)
+                if sent:
+                    queue.put({"type": "http.response.body", "body": b""})
+            finally:
+                # fires request_finished, as a WSGI server would
+                if hasattr(response, "close"):
+                    response.close()
+        finally:
+            queue.finish()
+
+application = WsgiToAsgi(get_wsgi_application(), max_threads=settings.ASGI_THREADS)
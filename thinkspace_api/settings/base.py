@@ -32,6 +32,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'api.instrumentation.InstrumentationMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'whitenoise.middleware.WhiteNoiseMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -96,12 +97,80 @@ SECRET_KEY = config("SECRET_KEY")
 ALLOWED_HOSTS = config('ALLOWED_HOSTS', cast=Csv())
 
 # Database
+# POOL configures the connection pool of the api.db.backends.postgresql
+# backend (see api/db/pool.py). DB_MAX_CONNECTIONS is the budget of a whole
+# dyno, shared by its WEB_CONCURRENCY processes.
+DB_POOL = {
+    'MAX_SIZE': max(1, config('DB_MAX_CONNECTIONS', default=20, cast=int) //
+                    config('WEB_CONCURRENCY', default=1, cast=int)),
+    'MAX_LIFETIME': config('DB_POOL_MAX_LIFETIME', default=1800, cast=int),
+    'WAIT_TIMEOUT': config('DB_POOL_WAIT_TIMEOUT', default=10, cast=float),
+    'PRE_PING': config('DB_POOL_PRE_PING', default=True, cast=bool),
+}
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': os.path.join(BASE_DIR, 'db.sqlite3'),
+        'POOL': DB_POOL,
+    }
+}
+
+# Read replicas
+# List and retrieve actions read from one of these DATABASES aliases (see
+# api/db/router.py), except for API_REPLICA_STICKY_SECONDS after a write by
+# the same user or to the models the view reads, which replication may not
+# have caught up with yet.
+DATABASE_REPLICAS = []
+DATABASE_ROUTERS = ['api.db.router.ReplicaRouter']
+API_REPLICA_STICKY_SECONDS = config('API_REPLICA_STICKY_SECONDS', default=5, cast=float)
+
+# Caching
+# Responses to anonymous reads are cached (see api/cache.py), keyed on write
+# versions kept in the database and, with API_CACHE_VERSIONS, in the cache.
+# Local memory is per-process, so deployments with several workers should
+# share a cache to avoid building each response once per worker, and must
+# share it to keep the versions there.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
     }
 }
+API_CACHE_ALIAS = 'default'
+API_CACHE_ENABLED = config('API_CACHE_ENABLED', default=True, cast=bool)
+API_CACHE_TIMEOUT = 300
+API_CACHE_VERSIONS = config('API_CACHE_VERSIONS', default=True, cast=bool)
+
+# Background tasks
+# Slow side effects run as tasks (see api/tasks.py). The thread pool backend
+# runs them inside the web process; production queues them in the database
+# for `python manage.py run_worker` processes.
+API_TASK_BACKEND = config('API_TASK_BACKEND', default='api.tasks.ThreadPoolBackend')
+API_TASK_WORKERS = config('API_TASK_WORKERS', default=4, cast=int)
+
+# ASGI
+# Threads per process running Django behind thinkspace_api/asgi.py, which is
+# also the most database connections a process opens.
+ASGI_THREADS = config('ASGI_THREADS', default=10, cast=int)
+
+# Instrumentation
+# Every request is logged with its time, queries and serializer time on the
+# api.requests logger, and, outside production unless enabled, timed in a
+# Server-Timing header (see api/instrumentation.py). Requests slower than API_SLOW_REQUEST_MS are logged
+# as warnings with their SQL.
+API_SERVER_TIMING = config('API_SERVER_TIMING', default=True, cast=bool)
+API_SLOW_REQUEST_MS = config('API_SLOW_REQUEST_MS', default=500, cast=float)
+
+# Rate limiting
+# Token buckets limiting the expensive actions a view names in its
+# throttle_scopes (see api/throttling.py), per user or, for anonymous
+# requests, per IP address. The local store counts per process; production
+# shares the buckets through the database.
+API_THROTTLE_STORE = config('API_THROTTLE_STORE', default='api.throttling.LocalStore')
+API_THROTTLE_RATES = {
+    'login': config('API_THROTTLE_LOGIN', default='10/min'),
+    'signup': config('API_THROTTLE_SIGNUP', default='5/hour'),
+    'heart': config('API_THROTTLE_HEART', default='60/min'),
+}
 
 # Static files (CSS, JavaScript, Images)
 # https://docs.djangoproject.com/en/2.0/howto/static-files/
@@ -111,15 +180,25 @@ STATICFILES_STORAGE = 'whitenoise.storage.CompressedManifestStaticFilesStorage'
 
 # Rest Framework
 REST_FRAMEWORK = {
-    'DEFAULT_AUTHENTICATION_CLASSES': (
+    'DEFAULT_AUTHENTICATION_CLASSES': [
         'rest_framework.authentication.SessionAuthentication',
         'rest_framework.authentication.BasicAuthentication',
-        'rest_framework_jwt.authentication.JSONWebTokenAuthentication'
+        'api.authentication.ClaimsJSONWebTokenAuthentication',
+    ],
+    'DEFAULT_THROTTLE_CLASSES': (
+        'api.throttling.TokenBucketThrottle',
     ),
     'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.LimitOffsetPagination',
     'PAGE_SIZE': 100,
 }
 
+# JWTs carry the user fields permission checks need (see
+# api/authentication.py); how long a process trusts its last read of them
+JWT_AUTH = {
+    'JWT_PAYLOAD_HANDLER': 'api.authentication.jwt_payload_handler',
+}
+API_JWT_USER_CACHE_SECONDS = config('API_JWT_USER_CACHE_SECONDS', default=60, cast=float)
+
 # custom user model
 AUTH_USER_MODEL = "api.User"
 
@@ -1,3 +1,5 @@
+from django.core.exceptions import ImproperlyConfigured
+
 from thinkspace_api.settings.base import *
 
 DEBUG = False
@@ -8,5 +10,58 @@ AWS_STORAGE_BUCKET_NAME = config('AWS_STORAGE_BUCKET_NAME', default='')
 AWS_S3_CUSTOM_DOMAIN = '%s.s3.amazonaws.com' % AWS_STORAGE_BUCKET_NAME
 DEFAULT_FILE_STORAGE = 'storages.backends.s3boto3.S3Boto3Storage'
 MEDIA_URL = "https://%s/%s/" % (AWS_S3_CUSTOM_DOMAIN, 'media')
-db_from_env = dj_database_url.config(conn_max_age=500)
+# connections are returned to the pool at the end of every request
+db_from_env = dj_database_url.config(conn_max_age=0, engine='api.db.backends.postgresql')
 DATABASES['default'].update(db_from_env)
+
+# DATABASE_REPLICA_URLS: comma separated URLs of read replicas of the primary
+for index, url in enumerate(config('DATABASE_REPLICA_URLS', default='', cast=Csv())):
+    alias = 'replica{}'.format(index + 1)
+    DATABASES[alias] = dj_database_url.parse(url, conn_max_age=0, engine='api.db.backends.postgresql')
+    DATABASES[alias].update({'POOL': DB_POOL, 'TEST': {'MIRROR': 'default'}})
+    DATABASE_REPLICAS.append(alias)
+
+REDIS_URL = config('REDIS_URL', default='')
+if REDIS_URL:
+    CACHES['default'] = {
+        'BACKEND': 'django_redis.cache.RedisCache',
+        'LOCATION': REDIS_URL,
+    }
+# every worker has to see the same versions, which local memory can't share
+API_CACHE_VERSIONS = config('API_CACHE_VERSIONS', default=bool(REDIS_URL), cast=bool)
+# the writes keeping requests off the replicas (see api/db/router.py) are
+# noted in the cache, which has to be shared for every worker to see them
+if DATABASE_REPLICAS and not REDIS_URL:
+    raise ImproperlyConfigured('DATABASE_REPLICA_URLS needs REDIS_URL for a shared cache')
+
+API_TASK_BACKEND = config('API_TASK_BACKEND', default='api.tasks.DatabaseBackend')
+API_THROTTLE_STORE = config('API_THROTTLE_STORE', default='api.throttling.DatabaseStore')
+# Heroku's router appends the address it got the request from to
+# X-Forwarded-For, and clients can send any entries before it, so anonymous
+# clients are throttled by the entry added by the last API_NUM_PROXIES proxies.
+REST_FRAMEWORK['NUM_PROXIES'] = config('API_NUM_PROXIES', default=1, cast=int)
+
+# Basic authentication hashes the password on every request it authenticates
+if not config('API_BASIC_AUTH', default=False, cast=bool):
+    REST_FRAMEWORK['DEFAULT_AUTHENTICATION_CLASSES'].remove(
+        'rest_framework.authentication.BasicAuthentication')
+
+# Server-Timing hands query counts and times to every client, so production
+# only sends it when asked to
+API_SERVER_TIMING = config('API_SERVER_TIMING', default=False, cast=bool)
+
+# request log lines go to stdout, where the platform collects them
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler'},
+    },
+    'loggers': {
+        'api.requests': {
+            'handlers': ['console'],
+            'level': config('API_REQUEST_LOG_LEVEL', default='INFO'),
+            'propagate': False,
+        },
+    },
+}
@@ -22,27 +22,34 @@ from django.conf.urls.static import static
 from rest_framework import routers
 from rest_framework.urlpatterns import format_suffix_patterns
 from rest_framework.documentation import include_docs_urls
-from rest_framework_jwt.views import obtain_jwt_token
 
 from api import views
 
 # create base router
 router = routers.DefaultRouter()
 router.register(r'users', views.UserViewSet, base_name="user")
-# router.register(r'projects', views.ProjectViewSet)
-# router.register(r'user_courses', views.CourseViewSet)
-# router.register(r'project_categories', views.ProjectCategoryViewSet)
-# router.register(r'project-join-requests', views.ProjectJoinRequestViewSet, base_name='projectjoinrequest')
-# router.register(r'project_comments', views.ProjectCommentViewSet)
-# router.register(r'project_posts', views.ProjectPostViewSet)
-# router.register(r'project_tags', views.ProjectTagViewSet)
+router.register(r'projects', views.ProjectViewSet)
+router.register(r'user_courses', views.CourseViewSet)
+router.register(r'project_categories', views.ProjectCategoryViewSet)
+router.register(r'project_comments', views.ProjectCommentViewSet)
+router.register(r'project_posts', views.ProjectPostViewSet)
+router.register(r'project_tags', views.ProjectTagViewSet)
+
+# join requests are nested under their project
+join_requests = views.ProjectJoinRequestViewSet.as_view({'get': 'list'})
+join_request = views.ProjectJoinRequestViewSet.as_view({'get': 'retrieve'})
 
 urlpatterns = [
     path('admin/', admin.site.urls),
+    url(r'^projects/(?P<project_pk>\d+)/join_requests/$', join_requests),
+    url(r'^projects/(?P<project_pk>\d+)/join_requests/(?P<pk>\d+)/$', join_request),
     url(r'^', include(router.urls)),
     url(r'^docs/', include_docs_urls(title='Thinkspace API', public=False)),
     url(r'^browsable_auth/', include('rest_framework.urls', namespace='rest_framework')),
-    url(r'^token_auth/', obtain_jwt_token),
+    url(r'^token_auth/', views.ObtainToken.as_view()),
+    url(r'^stats/db-pool/$', views.DatabasePoolStats.as_view()),
+    url(r'^export/(?P<resource>users|projects|comments)\.(?P<file_format>csv|ndjson)$',
+        views.Export.as_view()),
 ]
 
 # urlpatterns = format_suffix_patterns(urlpatterns)